@@ -1,33 +1,126 @@
 import re
 
-
+# Fields are separated by tabs and lines by newlines, so those (and the escape
+# character itself) travel as ESC followed by a single letter.
 escmap = {
-	"\t": "t",
-	"\x1b": "e",
-	"\n": "n",
-	"\0": "z",
+	"\x1b": "\x1be",
+	"\t":   "\x1bt",
+	"\n":   "\x1bn",
+	"\r":   "\x1br",
+	"\0":   "\x1bz",
 }
-escpat = re.compile('([\t\x1b\n\0])')
+escpat = re.compile('([\x1b\t\n\r\0])')
+rawpat = re.compile('[\x1b\n\r\0]')
 
-unescmap = {
-	"t": "\t",
-	"e": "\x1b",
-	"n": "\n",
-	"z": "\0",
-}
-unescpat = re.compile('\x1b([tenz])')
+unescmap = dict([ (v[1], k) for (k, v) in escmap.items() ])
 
 def parse(s):
-	msg = map(unescape, s.split("\t"))
-	return (msg[0], msg[1:])
+	"""Split a line into its command and a list of unescaped arguments."""
+	msg = s.split("\t")
+	if "\x1b" in s:
+		for i in xrange(len(msg)):
+			if "\x1b" in msg[i]:
+				msg[i] = unescape(msg[i])
+	cmd = msg[0]
+	del msg[0]
+	return (cmd, msg)
+
+def split(s):
+	"""Split a line into its command, unescaped, and the rest of it, which
+	fields() decodes once the command has been let through."""
+	cmd, tab, rest = s.partition("\t")
+	if "\x1b" in cmd:
+		cmd = unescape(cmd)
+	if not tab:
+		return (cmd, None)
+	return (cmd, rest)
+
+def fields(rest):
+	"""The unescaped arguments in the rest of a line, as split() left it."""
+	if rest is None:
+		return []
+	msg = rest.split("\t")
+	if "\x1b" in rest:
+		for i in xrange(len(msg)):
+			if "\x1b" in msg[i]:
+				msg[i] = unescape(msg[i])
+	return msg
+
+def arity(rest):
+	"""How many arguments the rest of a line holds, without decoding them."""
+	if rest is None:
+		return 0
+	return rest.count("\t") + 1
 
 def deparse(cmd, args):
-	msg = [cmd] + list(args)
-	return "\t".join(map(escape, msg))
+	"""Join a command and its arguments into one escaped line."""
+	msg = [cmd]
+	msg.extend(args)
+	line = "\t".join(msg)
+	# Nearly every line needs no escaping at all, which we can tell from the
+	# joined line without looking at each field.
+	if line.count("\t") == len(msg) - 1 and rawpat.search(line) is None:
+		return line
+	return "\t".join([ escape(x) for x in msg ])
 
+# Escaping ESC itself first, and unescaping it last, means no replacement
+# can make a sequence that a later one would replace again; and as no
+# sequence starts with its own letter, they cannot overlap. So a chain of
+# str.replace gives what a left to right scan would, faster.
 def escape(s):
-	return re.sub(escpat, lambda m: escmap[m.group(1)], s)
+	if escpat.search(s) is None:
+		return s
+	s = s.replace("\x1b", "\x1be")
+	for c in "\t\n\r\0":
+		if c in s:
+			s = s.replace(c, escmap[c])
+	return s
 
 def unescape(s):
-	return re.sub(unescpat, lambda m: unescmap[m.group(1)], s)
+	if "\x1b" not in s:
+		return s
+	for c in "tnrz":
+		s = s.replace("\x1b" + c, unescmap[c])
+	return s.replace("\x1be", "\x1b")
+
+class Frame(object):
+	"""A message encoded once and shared by every talker it is written to.
+
+	Renderings for other wire formats (e.g. IRC) are cached in views so
+	they too are built only once per message."""
+	__slots__ = ('cmd', 'args', 'line', 'data', 'views')
+
+	def __init__(self, cmd, args):
+		self.cmd   = cmd
+		self.args  = tuple(args)
+		self.line  = deparse(cmd, self.args)
+		self.data  = self.line + "\n"
+		self.views = dict()
+
+	def view(self, name, render):
+		"""Return render(*args), computing it at most once for this frame."""
+		try:
+			return self.views[name]
+		except KeyError:
+			line = self.views[name] = render(*self.args)
+			return line
+
+class Batch(object):
+	"""Frames of one command written together, as when a room drops many
+	members at once. Their lines are joined once and every talker writes
+	them in one go."""
+	__slots__ = ('cmd', 'frames', 'data', 'views')
+
+	def __init__(self, frames):
+		self.cmd    = frames[0].cmd
+		self.frames = frames
+		self.data   = "".join([ frame.data for frame in frames ])
+		self.views  = dict()
 
+	def view(self, name, render, separator):
+		"""Return each frame's view joined by separator, computed at most once."""
+		try:
+			return self.views[name]
+		except KeyError:
+			text = self.views[name] = separator.join([ frame.view(name, render) for frame in self.frames ])
+			return text
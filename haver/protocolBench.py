@@ -0,0 +1,32 @@
+#!/usr/bin/python
+"""Microbenchmark for the line codec. Prints lines per second for each case.
+
+	python protocolBench.py [lines]
+"""
+import sys, time
+import protocol
+
+CASES = [
+	('plain',   ('IN', ['main', 'bob', 'say', 'hello there, how is everyone doing today?'])),
+	('escaped', ('IN', ['main', 'bob', 'say', 'tab\there\nnewline and an \x1b escape'])),
+	('wide',    ('USERS', [ 'user%d' % i for i in range(200) ])),
+]
+
+def rate(func, arg, count):
+	start = time.time()
+	for i in xrange(count):
+		func(*arg)
+	return count / (time.time() - start)
+
+def main(count):
+	for (name, (cmd, args)) in CASES:
+		line = protocol.deparse(cmd, args)
+		assert protocol.parse(line) == (cmd, args)
+		print "%-8s deparse %10.0f lines/s" % (name, rate(protocol.deparse, (cmd, args), count))
+		print "%-8s parse   %10.0f lines/s" % (name, rate(protocol.parse, (line,), count))
+
+if __name__ == '__main__':
+	if len(sys.argv) > 1:
+		main(int(sys.argv[1]))
+	else:
+		main(100000)
@@ -1,5 +1,5 @@
 #!/usr/bin/python
-import unittest
+import unittest, random
 import protocol
 
 class TestProtocol(unittest.TestCase):
@@ -16,6 +16,81 @@ class TestProtocol(unittest.TestCase):
 		results = protocol.parse(testString)
 		self.assertEqual(results,("er",["rt","were"]))
 
+	def testParseEscaped(self):
+		testString = "IN\tmain\ta\x1btb\x1bnc\x1bed\x1brz\x1bz"
+		results = protocol.parse(testString)
+		self.assertEqual(results,("IN",["main","a\tb\nc\x1bd\rz\0"]))
+	def testParseUnknownEscape(self):
+		results = protocol.parse("er\t\x1bq\x1b")
+		self.assertEqual(results,("er",["\x1bq\x1b"]))
+	def testDeparse(self):
+		self.assertEqual(protocol.deparse("er", []), "er")
+		self.assertEqual(protocol.deparse("er", ("rt", "were")), "er\trt\twere")
+	def testDeparseEscaped(self):
+		results = protocol.deparse("IN", ["main", "a\tb\nc\x1bd\rz\0"])
+		self.assertEqual(results, "IN\tmain\ta\x1btb\x1bnc\x1bed\x1brz\x1bz")
+
+class TestRoundTrip(unittest.TestCase):
+	alphabet = "ab\t\n\r\0\x1betnrz\\"
+
+	def field(self, rng):
+		return "".join([ rng.choice(self.alphabet) for i in range(rng.randint(0, 12)) ])
+
+	def testFuzz(self):
+		rng = random.Random(7575)
+		for i in range(5000):
+			cmd  = rng.choice(["IN", "TO", "HAVER", "HELP:COMMANDS"])
+			args = [ self.field(rng) for j in range(rng.randint(0, 6)) ]
+			line = protocol.deparse(cmd, args)
+			for c in "\n\r\0":
+				self.assertFalse(c in line)
+			self.assertEqual(line.count("\t"), len(args))
+			self.assertEqual(protocol.parse(line), (cmd, args))
+			first, rest = protocol.split(line)
+			self.assertEqual(protocol.arity(rest), len(args))
+			self.assertEqual((first, protocol.fields(rest)), (cmd, args))
+
+	def testEscapeInverse(self):
+		rng = random.Random(7666)
+		for i in range(5000):
+			s = self.field(rng)
+			self.assertEqual(protocol.unescape(protocol.escape(s)), s)
+
+	def testEveryShortString(self):
+		# Escapes are replaced one kind at a time, so try every way for one
+		# to sit next to another, or next to the letters they use.
+		alphabet = "\x1b\t\ne\x00tz"
+		strings  = [""]
+		for length in range(4):
+			strings = [ x + c for x in strings for c in alphabet ]
+			for s in strings:
+				escaped = protocol.escape(s)
+				self.assertEqual(protocol.unescape(escaped), s)
+				self.assertEqual(escaped, "".join([ protocol.escmap.get(c, c) for c in s ]))
+
+class TestSplit(unittest.TestCase):
+	def testRestLeftEscaped(self):
+		cmd, rest = protocol.split("IN\tmain\tsay\ta\x1btb")
+		self.assertEqual((cmd, rest, protocol.arity(rest)), ("IN", "main\tsay\ta\x1btb", 3))
+		self.assertEqual(protocol.fields(rest), ["main", "say", "a\tb"])
+		self.assertEqual(protocol.split("P\x1btOKE"), ("P\tOKE", None))
+		self.assertEqual((protocol.arity(None), protocol.fields(None)), (0, []))
+		self.assertEqual(protocol.fields(protocol.split("POKE\t")[1]), [""])
+
+class TestFrame(unittest.TestCase):
+	def testLine(self):
+		frame = protocol.Frame("IN", ["main", "bob", "say", "hi"])
+		self.assertEqual(frame.line, protocol.deparse("IN", ["main", "bob", "say", "hi"]))
+	def testViewOnce(self):
+		calls = []
+		def render(*args):
+			calls.append(args)
+			return " ".join(args)
+		frame = protocol.Frame("PART", ["main", "bob"])
+		self.assertEqual(frame.view("irc", render), "main bob")
+		self.assertEqual(frame.view("irc", render), "main bob")
+		self.assertEqual(len(calls), 1)
+
 
 if __name__ == '__main__':
     unittest.main()
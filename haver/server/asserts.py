@@ -1,12 +1,22 @@
 from haver.server.errors import Fail, Bork
-import re, inspect
+import re
 namepattern = re.compile("^&?[A-Za-z][A-Za-z0-9_.'`\[\]{}^\|\\\@-]+$")
 cmdpattern  = re.compile('^[A-Z][A-Z:]*$')
+impure      = re.compile("[^A-Za-z0-9_.'`\[\]{}^\|\\-]")
+unlettered  = re.compile("^[^A-Za-z]+")
 
 def assert_name(n):
 	if not namepattern.match(n):
 		raise Fail('invalid.name', n)
 
+def purify(n):
+	"""Strip n down to a name usable as a genname() root: no reserved or invalid
+	characters, starting with a letter. Falls back to 'guest'."""
+	n = unlettered.sub('', impure.sub('', n))
+	if n == '':
+		return 'guest'
+	return n
+
 def assert_name_unreserved(n):
 	if n[0] == '&' or '@' in n:
 		raise Fail('reserved.name')
@@ -18,20 +28,4 @@ def assert_ns(n):
 def assert_cmd(cmd):
 	if not cmdpattern.match(cmd):
 		raise Fail('invalid.command')
-	
-def assert_arity(f, args):
-	arity_max = f.func_code.co_argcount - 1
-
-	if f.func_defaults is None:
-		arity_min = arity_max
-		arity_text = str(arity_min)
-	else:
-		arity_min = arity_max - len(f.func_defaults)
-		arity_text = "%d-%d" % (arity_min, arity_max)
-
-	if f.func_code.co_flags & 4:
-		arity_max = 1000000
-	catchall = lambda x: inspect.getargspec(x)[2] is None
 
-	if (len(args) > arity_max and catchall(f)) or len(args) < arity_min:
-		raise Fail('arity', arity_text, str(len(args)))
@@ -0,0 +1,213 @@
+#!/usr/bin/python
+"""Run haverd on several cores: one coordinator process holding the
+authoritative house, and worker processes that all accept on the same ports
+and own the connections they accept. See haver.server.link.
+
+	python -m haver.server.cluster [-w WORKERS] [-s SOCKET] [--host HOST]
+	python -m haver.server.cluster coordinator [-s SOCKET] [--host HOST]
+	python -m haver.server.cluster worker [-s SOCKET] [--host HOST] [--haver PORT] [--irc PORT] [--ssl PORT]
+
+Or run a single-process node federated with others (see
+haver.server.peertalker), accepting links on --link from the nodes named by
+--node and linking to each --peer. Every node reads the secret they share
+from --secret-file, and without --node none link at all:
+
+	python -m haver.server.cluster node --host HOST --node HOST --secret-file FILE [--link PORT] [--peer HOST:PORT] [--haver PORT] ...
+
+The coordinator and nodes keep their rooms in --journal if given. Workers
+and nodes write their metrics in the Prometheus text format to --metrics if
+given; each worker adds its pid to the file name. --log sets log levels,
+e.g. 'info,irc.wire=debug'.
+
+Any of --haver, --irc, --ssl, --peer and --node may be given more than once; a port
+of 0 turns that listener off.
+
+A node may run on --core select instead of twisted's reactor (see
+haver.server.core). It serves Haver, IRC and incoming links the same way,
+but cannot dial --peer links."""
+
+import os, sys, time, socket, signal, subprocess
+from optparse import OptionParser
+
+from twisted.python   import log
+from twisted.internet import reactor
+
+from haver.server.house import House
+from haver.server.thing import Room
+from haver.server.link  import Mesh, LinkFactory, LinkClientFactory
+from haver.server       import metrics, logger, core
+
+# Not every python knows the name; this is its value on Linux.
+SO_REUSEPORT = getattr(socket, 'SO_REUSEPORT', 15)
+
+def listenShared(port, factory, interface = ''):
+	"""Listen on a TCP port that other processes may be listening on too.
+	The kernel spreads new connections across all of them."""
+	s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+	try:
+		s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		s.setsockopt(socket.SOL_SOCKET, SO_REUSEPORT, 1)
+		s.bind((interface, port))
+		s.listen(50)
+		s.setblocking(False)
+		return reactor.adoptStreamPort(s.fileno(), socket.AF_INET, factory)
+	finally:
+		s.close()
+
+# Services to stop once the loop has, when the core is not the reactor.
+stopping = []
+
+def atShutdown(when, func):
+	if core.loop is None:
+		reactor.addSystemEventTrigger(when, 'shutdown', func)
+	elif when == 'before':
+		stopping.insert(0, func)
+	else:
+		stopping.append(func)
+
+def rooms(options):
+	"""A house with the saved rooms, or the default ones."""
+	house = House(options.host)
+	if options.journal:
+		from haver.server.journal import Journal
+		journal = Journal(house, options.journal)
+		journal.startService()
+		atShutdown('after', journal.stopService)
+	if not house.lookup_namespace('room'):
+		for room in [ Room('main'), Room('lobby') ]:
+			house.add(room)
+	return house
+
+def report(path):
+	"""Measure reactor lag, and write the metrics to path if it is given."""
+	reporter = metrics.Reporter(metrics.shared(), path)
+	reporter.startService()
+	atShutdown('before', reporter.stopService)
+
+def coordinator(options):
+	house = rooms(options)
+	mesh = Mesh(house, authority = True)
+	if os.path.exists(options.socket):
+		os.unlink(options.socket)
+	reactor.listenUNIX(options.socket, LinkFactory(mesh))
+	log.msg('Coordinator listening on %s' % options.socket)
+
+def worker(options):
+	from haver.server.talker    import HaverFactory
+	from haver.server.irctalker import IRCFactory
+
+	house = House(options.host)
+	mesh  = Mesh(house)
+	listeners = [ (port, HaverFactory(house)) for port in options.haver or [7575] ]
+	listeners = listeners + [ (port, IRCFactory(house)) for port in options.irc or [7666] ]
+	for port in options.ssl or [7474]:
+		if port and os.path.exists('server.pem'):
+			from twisted.protocols.tls import TLSMemoryBIOFactory
+			from haver.server.ssl      import SSLContextFactory
+			factory = TLSMemoryBIOFactory(SSLContextFactory(), False, HaverFactory(house, ssl = True))
+			listeners.append((port, factory))
+
+	def listen():
+		# Only take clients once the coordinator has told us who and what
+		# already exists.
+		for port, factory in listeners:
+			if port:
+				listenShared(port, factory)
+		log.msg('Worker %d accepting connections' % os.getpid())
+	mesh.ready.append(listen)
+	reactor.connectUNIX(options.socket, LinkClientFactory(mesh))
+	path = options.metrics
+	if path:
+		root, ext = os.path.splitext(path)
+		path = '%s-%d%s' % (root, os.getpid(), ext)
+	report(path)
+
+def node(options):
+	from haver.server.talker     import HaverFactory
+	from haver.server.irctalker  import IRCFactory
+	from haver.server.peertalker import PeerFactory, PeerClientFactory
+
+	loop  = core.clock()
+	house = rooms(options)
+	for port in options.haver or [7575]:
+		if port:
+			loop.listenTCP(port, HaverFactory(house))
+	for port in options.irc or [7666]:
+		if port:
+			loop.listenTCP(port, IRCFactory(house))
+	# Without nodes allowed to link, there is no link listener at all.
+	if options.node:
+		secret = open(options.secret_file).read().strip()
+		if options.link:
+			loop.listenTCP(options.link, PeerFactory(house, options.node, secret))
+		for peer in options.peer or []:
+			host, port = peer.rsplit(':', 1)
+			loop.connectTCP(host, int(port), PeerClientFactory(house, options.node, secret))
+	report(options.metrics)
+
+def spawn(role, argv):
+	args = [sys.executable, '-m', 'haver.server.cluster', role] + argv
+	return subprocess.Popen(args)
+
+def run(options, argv):
+	"""Start a coordinator and the workers, and wait for them."""
+	children = [ spawn('coordinator', argv) ]
+	while not os.path.exists(options.socket):
+		time.sleep(0.1)
+	for i in range(options.workers):
+		children.append(spawn('worker', argv))
+
+	def stop(signum, frame):
+		for child in children:
+			if child.poll() is None:
+				os.kill(child.pid, signal.SIGTERM)
+	signal.signal(signal.SIGTERM, stop)
+	signal.signal(signal.SIGINT, stop)
+	for child in children:
+		child.wait()
+
+def main(argv):
+	parser = OptionParser(usage = __doc__.strip())
+	parser.add_option('-w', '--workers', type = 'int', default = 4)
+	parser.add_option('-s', '--socket',  default = 'haverd.sock')
+	parser.add_option('--host',  default = 'chat.haverdev.org')
+	parser.add_option('--haver', type = 'int', action = 'append')
+	parser.add_option('--irc',   type = 'int', action = 'append')
+	parser.add_option('--ssl',   type = 'int', action = 'append')
+	parser.add_option('--link',  type = 'int', default = 7577)
+	parser.add_option('--peer',  action = 'append')
+	parser.add_option('--node',  action = 'append')
+	parser.add_option('--secret-file')
+	parser.add_option('--journal')
+	parser.add_option('--metrics')
+	parser.add_option('--log',   default = 'info')
+	parser.add_option('--core',  type = 'choice', choices = core.CORES, default = 'twisted')
+	options, args = parser.parse_args(argv)
+
+	if len(args) == 0:
+		run(options, argv)
+		return
+
+	log.startLogging(sys.stdout)
+	logger.configure(options.log)
+	if options.core != 'twisted' and (args[0] != 'node' or options.peer):
+		parser.error('only a node without --peer can run on --core %s' % options.core)
+	if options.peer and not options.node:
+		parser.error('--peer needs --node for each node allowed to link')
+	if options.node and not options.secret_file:
+		parser.error('--node needs --secret-file')
+	loop = core.use(options.core)
+	if args[0] == 'coordinator':
+		coordinator(options)
+	elif args[0] == 'worker':
+		worker(options)
+	elif args[0] == 'node':
+		node(options)
+	else:
+		parser.error('unknown role %s' % args[0])
+	loop.run()
+	for func in stopping:
+		func()
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,135 @@
+#!/usr/bin/python
+import unittest, os, sys, time, socket, select, subprocess, tempfile, shutil
+from haver.protocol import parse, deparse
+
+root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+def freeport():
+	s = socket.socket()
+	s.bind(('127.0.0.1', 0))
+	port = s.getsockname()[1]
+	s.close()
+	return port
+
+class Client(object):
+	def __init__(self, port, name = None):
+		deadline = time.time() + 10
+		while True:
+			try:
+				self.sock = socket.create_connection(('127.0.0.1', port), 5)
+				break
+			except socket.error:
+				if time.time() > deadline:
+					raise
+				time.sleep(0.1)
+		self.buf = ''
+		self.send('HAVER', 'test/1')
+		self.expect('HAVER')
+		if name is not None:
+			self.send('IDENT', name)
+			self.expect('HELLO', name)
+
+	def send(self, cmd, *args):
+		self.sock.sendall(deparse(cmd, args) + "\n")
+
+	def read(self):
+		while "\n" not in self.buf:
+			data = self.sock.recv(4096)
+			if not data:
+				raise AssertionError('connection closed')
+			self.buf = self.buf + data
+		line, self.buf = self.buf.split("\n", 1)
+		return parse(line)
+
+	def expect(self, cmd, *args):
+		"""Read until a line starting with cmd and args arrives."""
+		while True:
+			c, a = self.read()
+			if c == cmd and tuple(a[:len(args)]) == args:
+				return a
+
+	def close(self):
+		self.sock.close()
+
+class TestCluster(unittest.TestCase):
+	def setUp(self):
+		self.dir      = tempfile.mkdtemp()
+		self.socket   = os.path.join(self.dir, 'haverd.sock')
+		self.shared   = freeport()
+		self.ports    = [ freeport(), freeport() ]
+		self.null     = open(os.devnull, 'w')
+		self.procs    = [ self.spawn('coordinator') ]
+		for port in self.ports:
+			self.procs.append(self.spawn('worker', '--haver', str(self.shared), '--haver', str(port), '--irc', '0', '--ssl', '0'))
+		self.clients  = []
+
+	def tearDown(self):
+		for client in self.clients:
+			client.close()
+		for proc in self.procs:
+			proc.terminate()
+			proc.wait()
+		self.null.close()
+		shutil.rmtree(self.dir)
+
+	def spawn(self, role, *args):
+		env = dict(os.environ)
+		env['PYTHONPATH'] = root
+		argv = [sys.executable, '-m', 'haver.server.cluster', role, '-s', self.socket] + list(args)
+		proc = subprocess.Popen(argv, stdout = self.null, stderr = self.null, env = env)
+		if role == 'coordinator':
+			while not os.path.exists(self.socket):
+				time.sleep(0.05)
+		return proc
+
+	def client(self, port, name = None):
+		client = Client(port, name)
+		self.clients.append(client)
+		return client
+
+	def testRoomSpansWorkers(self):
+		alice = self.client(self.ports[0], 'alice')
+		bob   = self.client(self.ports[1], 'bob')
+		alice.send('JOIN', 'main')
+		alice.expect('JOIN', 'main', 'alice')
+		bob.send('JOIN', 'main')
+		alice.expect('JOIN', 'main', 'bob')
+		alice.send('IN', 'main', 'say', 'hello')
+		bob.expect('IN', 'main', 'alice', 'say', 'hello')
+		bob.send('TO', 'alice', 'say', 'psst')
+		alice.expect('FROM', 'bob', 'say', 'psst')
+		bob.send('USERSOF', 'main')
+		self.assertEqual(sorted(bob.expect('USERSOF', 'main')[1:]), ['alice', 'bob'])
+		bob.close()
+		alice.expect('PART', 'main', 'bob', 'quit')
+
+	def testNameCollision(self):
+		alice = self.client(self.ports[0], 'alice')
+		other = self.client(self.ports[1])
+		other.send('IDENT', 'alice')
+		# Refused outright if the other worker has already heard of alice.
+		# Otherwise both are accepted and whichever claim the coordinator
+		# hears second is killed.
+		cmd, args = other.read()
+		if cmd == 'FAIL':
+			self.assertEqual(args[1], 'existing.thing')
+			return
+		self.assertEqual(cmd, 'HELLO')
+		readable = select.select([alice.sock, other.sock], [], [], 10)[0]
+		self.assertEqual(len(readable), 1)
+		loser = readable[0] is alice.sock and alice or other
+		self.assertEqual(loser.expect('BYE'), ['collision'])
+
+	def testSharedPort(self):
+		carol = self.client(self.shared, 'carol')
+		dave  = self.client(self.ports[0], 'dave')
+		while True:
+			carol.send('USERS')
+			if 'dave' in carol.expect('USERS'):
+				break
+			time.sleep(0.05)
+		carol.send('TO', 'dave', 'say', 'hi')
+		dave.expect('FROM', 'carol', 'say', 'hi')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,35 @@
+"""The event loop the server runs on.
+
+Talkers are twisted protocols, but they only need a transport to write to
+and someone to call dataReceived and connectionLost; the rest of the server
+(House, Room, outbound queues, the idle wheel, departures) only needs
+timers. Everything asks clock() for those rather than importing twisted's
+reactor, so the same command logic runs on either core:
+
+	twisted  twisted's reactor, the default
+	select   haver.server.selectcore, a loop of our own on epoll or poll
+
+use() picks one, and must be called before anything has been started."""
+
+CORES = ('twisted', 'select')
+
+loop = None
+
+def clock():
+	"""The loop to schedule timers on."""
+	if loop is None:
+		from twisted.internet import reactor
+		return reactor
+	return loop
+
+def use(name):
+	"""Run on the core called name, and return its loop."""
+	global loop
+	if name == 'twisted':
+		loop = None
+	elif name == 'select':
+		from haver.server.selectcore import Loop
+		loop = Loop()
+	else:
+		raise ValueError('unknown core %s' % name)
+	return clock()
@@ -0,0 +1,81 @@
+"""The compress extension: zlib streams both ways on a Haver connection.
+
+A client asks for it by listing compress in the extensions of HAVER, and
+then sends nothing more until it has read the server's HAVER. If the
+server listed compress too, everything after that HAVER is one zlib
+stream in each direction; if not, both carry on uncompressed.
+
+The server deflates what a connection's outbound queue hands over, and
+ends each piece with a sync flush, so the client can always inflate every
+byte it has been sent. Lines are handed over once per reactor iteration,
+so a tick's worth of traffic costs one flush however many lines it holds,
+and small lines ride along with the rest instead of each paying for a
+flush of its own."""
+
+import time, zlib
+from haver.server.errors import Bork
+
+# The most one read may inflate to, so that a few bytes cannot become
+# gigabytes of lines.
+MAX_INFLATED = 1 << 20
+
+class Stats(object):
+	"""What compression saves, and what it costs, in one direction."""
+	__slots__ = ('raw', 'packed', 'seconds')
+
+	def __init__(self, registry, direction):
+		self.raw     = registry.counter('haver_compress_raw_bytes_total',
+			'Bytes of compressed connections before deflating or after inflating', direction = direction)
+		self.packed  = registry.counter('haver_compress_packed_bytes_total',
+			'Bytes of compressed connections on the wire', direction = direction)
+		self.seconds = registry.counter('haver_compress_seconds_total',
+			'Time spent deflating or inflating', direction = direction)
+		registry.gauge('haver_compress_ratio',
+			'Bytes before compression for every byte on the wire', self.ratio, direction = direction)
+
+	def ratio(self):
+		if not self.packed.value:
+			return 1.0
+		return float(self.raw.value) / self.packed.value
+
+	def add(self, raw, packed, seconds):
+		self.raw.inc(raw)
+		self.packed.inc(packed)
+		self.seconds.inc(seconds)
+
+class Deflater(object):
+	"""The stream the server writes to one client."""
+	__slots__ = ('stream', 'stats')
+
+	def __init__(self, level = 1, stats = None):
+		self.stream = zlib.compressobj(level)
+		self.stats  = stats
+
+	def pack(self, data):
+		"""Deflate data, flushed so that the client can read all of it."""
+		start  = time.time()
+		stream = self.stream
+		packed = stream.compress(data) + stream.flush(zlib.Z_SYNC_FLUSH)
+		if self.stats is not None:
+			self.stats.add(len(data), len(packed), time.time() - start)
+		return packed
+
+class Inflater(object):
+	"""The stream one client writes to the server."""
+	__slots__ = ('stream', 'stats')
+
+	def __init__(self, stats = None):
+		self.stream = zlib.decompressobj()
+		self.stats  = stats
+
+	def unpack(self, data):
+		start = time.time()
+		try:
+			raw = self.stream.decompress(data, MAX_INFLATED)
+		except zlib.error:
+			raise Bork('Bad compressed data')
+		if self.stream.unconsumed_tail:
+			raise Bork('Compressed data inflates too far')
+		if self.stats is not None:
+			self.stats.add(len(raw), len(data), time.time() - start)
+		return raw
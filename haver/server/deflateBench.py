@@ -0,0 +1,44 @@
+#!/usr/bin/python
+"""Benchmark for the compress extension: what deflating one client's
+traffic saves and costs. A room's chat is written to a Deflater a tick at a
+time, lines lines to a tick, at a few zlib levels; for each, the ratio of
+bytes before and after and the time per line are reported.
+
+	python deflateBench.py [ticks] [lines]
+"""
+import sys, time, random
+from haver.server.deflate import Deflater
+from haver.protocol       import deparse
+
+WORDS = ('the', 'a', 'bot', 'build', 'is', 'green', 'red', 'again', 'deploy',
+	'done', 'lunch', 'anyone', 'ok', 'thanks', 'ping', 'me', 'later', 'why')
+
+def traffic(n):
+	"""n lines of chat, as members of a busy room would see it."""
+	random.seed(1)
+	names = [ 'user%d' % i for i in range(20) ]
+	lines = []
+	for i in xrange(n):
+		msg = ' '.join([ random.choice(WORDS) for x in range(random.randint(2, 12)) ])
+		lines.append(deparse('IN', ('main', random.choice(names), 'say', msg)) + "\n")
+	return lines
+
+def run(level, ticks, lines, chat):
+	deflater = Deflater(level)
+	raw = packed = 0
+	start = time.time()
+	for i in xrange(ticks):
+		data = "".join(chat[i * lines:(i + 1) * lines])
+		raw    = raw + len(data)
+		packed = packed + len(deflater.pack(data))
+	took = time.time() - start
+	print "level %d, %3d lines a tick: ratio %.2f, %.2f us a line" % (level, lines, float(raw) / packed,
+		took / (ticks * lines) * 1e6)
+
+if __name__ == '__main__':
+	ticks = len(sys.argv) > 1 and int(sys.argv[1]) or 2000
+	lines = len(sys.argv) > 2 and int(sys.argv[2]) or 20
+	chat  = traffic(ticks * lines)
+	for size in (1, lines):
+		for level in (1, 6, 9):
+			run(level, ticks, size, chat)
@@ -0,0 +1,80 @@
+#!/usr/bin/python
+import unittest, zlib
+from twisted.internet import address
+from twisted.test.proto_helpers import StringTransport
+from haver.server.house   import House
+from haver.server.talker  import HaverFactory
+from haver.server.errors  import Bork
+from haver.server         import outbound, deflate
+
+class Client(object):
+	"""Both ends of a compressed connection, as a client sees them."""
+	def __init__(self):
+		self.deflater = zlib.compressobj()
+		self.inflater = zlib.decompressobj()
+
+	def pack(self, data):
+		return self.deflater.compress(data) + self.deflater.flush(zlib.Z_SYNC_FLUSH)
+
+	def unpack(self, data):
+		return self.inflater.decompress(data)
+
+class TestDeflate(unittest.TestCase):
+	def setUp(self):
+		self.factory = HaverFactory(House('test'))
+
+	def connect(self, extensions):
+		transport = StringTransport(peerAddress = address.IPv4Address('TCP', '10.0.0.1', 1))
+		talker    = self.factory.buildProtocol(transport.getPeer())
+		talker.makeConnection(transport)
+		talker.dataReceived("HAVER\ttest/1\t%s\n" % extensions)
+		return talker
+
+	def read(self, talker):
+		outbound.shared().flush()
+		data = talker.transport.value()
+		talker.transport.clear()
+		return data
+
+	def testNegotiated(self):
+		talker = self.connect('compress')
+		reply  = self.read(talker).split("\n")
+		self.assertEqual(reply[1:], [''])
+		self.assertTrue('compress' in reply[0].split("\t")[3].split(','))
+		client = Client()
+		raw    = self.factory.inflated.raw.value
+		talker.dataReceived(client.pack("IDENT\tal\n"))
+		talker.dataReceived(client.pack("OPEN\tmain\nJOIN\tmain\nIN\tmain\tsay\thi\n"))
+		lines = client.unpack(self.read(talker)).split("\n")
+		self.assertEqual(lines[0], "HELLO\tal\t10.0.0.1")
+		self.assertEqual(lines[-2], "IN\tmain\tal\tsay\thi")
+		self.assertTrue(self.factory.deflated.packed.value > 0)
+		self.assertEqual(self.factory.inflated.raw.value - raw, 44)
+
+	def testPlainWithoutAsking(self):
+		talker = self.connect('')
+		self.read(talker)
+		talker.dataReceived("IDENT\tal\n")
+		self.assertEqual(self.read(talker), "HELLO\tal\t10.0.0.1\n")
+
+	def testRefused(self):
+		self.factory.compression = None
+		talker = self.connect('compress')
+		self.assertFalse('compress' in self.read(talker).split("\t")[3])
+		talker.dataReceived("IDENT\tal\n")
+		self.assertEqual(self.read(talker), "HELLO\tal\t10.0.0.1\n")
+
+	def testGarbageBorks(self):
+		talker = self.connect('compress')
+		self.read(talker)
+		talker.dataReceived("IDENT\tal\n")
+		self.assertTrue(talker.transport.disconnecting)
+		self.assertEqual(Client().unpack(self.read(talker)), "BORK\tBad compressed data\nBYE\tbork\n")
+
+	def testInflatesTooFar(self):
+		inflater = deflate.Inflater()
+		bomb = Client().pack("\n" * (deflate.MAX_INFLATED + 1))
+		self.assertRaises(Bork, inflater.unpack, bomb)
+
+if __name__ == '__main__':
+    unittest.main()
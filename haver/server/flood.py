@@ -0,0 +1,96 @@
+"""Flood control: token buckets per connection and per room.
+
+Every command a client sends costs a token from its connection's bucket.
+A command that writes to a room costs as many more tokens as the room has
+members, divided by unit, both from the sender's bucket and the room's, so
+talking in a big room uses up a client's allowance (and the room's) faster
+than a POKE. Buckets refill at rate tokens a second up to burst. A command
+that finds a bucket short fails with rate.limited, saying how long to wait.
+Only a short bucket of its own counts as a strike against a client, and
+one that keeps going anyway is borked; a room's bucket is shared by all
+its members, and running short there is nobody's fault in particular."""
+
+import math
+from haver.server.errors import Fail, Bork
+
+class Bucket(object):
+	__slots__ = ('level', 'stamp')
+
+	def __init__(self, burst, now):
+		self.level = burst
+		self.stamp = now
+
+	def refill(self, rate, burst, now):
+		if now > self.stamp:
+			self.level = min(burst, self.level + (now - self.stamp) * rate)
+			self.stamp = now
+
+	def wait(self, cost, rate, burst):
+		"""Seconds until cost can be taken. A cost bigger than burst can be
+		taken from a full bucket, leaving it in debt."""
+		need = min(cost, burst)
+		if self.level >= need:
+			return 0.0
+		return (need - self.level) / rate
+
+class Flood(object):
+	"""The limits of one listener. A rate of None turns flood control off.
+
+	Talkers and rooms keep their own bucket, in a bucket attribute that is
+	None until they are first charged, and talkers count their strikes, the
+	rate.limited failures in a row they have had, in strikes."""
+
+	def __init__(self, rate = 20.0, burst = 40.0, room_rate = 100.0, room_burst = 400.0,
+			unit = 200, strikes = 20):
+		self.rate       = rate
+		self.burst      = burst
+		self.room_rate  = room_rate
+		self.room_burst = room_burst
+		self.unit       = unit
+		self.strikes    = strikes
+
+	def fanout(self, room):
+		"""What writing to every member of room costs."""
+		return float(len(room.users)) / self.unit
+
+	def charge(self, talker, cost, now, room = None):
+		"""Take cost from talker's bucket, and from room's if given."""
+		if self.rate is None:
+			return
+		mine = talker.bucket
+		if mine is None:
+			mine = talker.bucket = Bucket(self.burst, now)
+		mine.refill(self.rate, self.burst, now)
+		wait = mine.wait(cost, self.rate, self.burst)
+		if wait > 0:
+			talker.strikes = talker.strikes + 1
+			if talker.strikes >= self.strikes:
+				raise Bork('Flooding')
+			raise limited(wait)
+		talker.strikes = 0
+		if room is not None:
+			theirs = room.bucket
+			if theirs is None:
+				theirs = room.bucket = Bucket(self.room_burst, now)
+			theirs.refill(self.room_rate, self.room_burst, now)
+			wait = theirs.wait(cost, self.room_rate, self.room_burst)
+			if wait > 0:
+				raise limited(wait)
+		mine.level = mine.level - cost
+		if room is not None:
+			theirs.level = theirs.level - cost
+
+	def describe(self):
+		"""Name and value pairs for HELP:LIMITS."""
+		if self.rate is None:
+			return ['RATE', 'none']
+		return ['RATE', '%g' % self.rate, 'BURST', '%g' % self.burst,
+			'ROOM_RATE', '%g' % self.room_rate, 'ROOM_BURST', '%g' % self.room_burst,
+			'FANOUT_UNIT', str(self.unit)]
+
+def limited(wait):
+	# Round up, so a client told to wait 0.1 seconds never finds it too soon.
+	return Fail('rate.limited', '%.1f' % (math.ceil(wait * 10) / 10))
+
+# For servers and benchmarks that do not want flood control.
+UNLIMITED = Flood(rate = None)
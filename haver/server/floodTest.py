@@ -0,0 +1,91 @@
+#!/usr/bin/python
+import unittest
+from twisted.internet import address
+from twisted.test.proto_helpers import StringTransport
+from haver.server.flood  import Bucket, Flood, UNLIMITED
+from haver.server.thing  import Room, User
+from haver.server.house  import House
+from haver.server.talker import HaverFactory
+from haver.server.errors import Fail, Bork
+
+class Talker:
+	bucket  = None
+	strikes = 0
+
+class TestFlood(unittest.TestCase):
+	def setUp(self):
+		self.flood  = Flood(rate = 1.0, burst = 3.0, room_rate = 10.0, room_burst = 5.0,
+			unit = 2, strikes = 3)
+		self.talker = Talker()
+
+	def testBucketRefills(self):
+		bucket = Bucket(3.0, 0.0)
+		bucket.level = 0.0
+		bucket.refill(1.0, 3.0, 2.0)
+		self.assertEqual(bucket.level, 2.0)
+		bucket.refill(1.0, 3.0, 10.0)
+		self.assertEqual(bucket.level, 3.0)
+		self.assertEqual(bucket.wait(5.0, 1.0, 3.0), 0.0)
+
+	def testLimited(self):
+		for i in range(3):
+			self.flood.charge(self.talker, 1.0, 0.0)
+		try:
+			self.flood.charge(self.talker, 1.0, 0.5)
+		except Fail, failure:
+			self.assertEqual(failure.name, 'rate.limited')
+			self.assertEqual(failure.args, ('0.5',))
+		else:
+			self.fail('not limited')
+		self.flood.charge(self.talker, 1.0, 1.0)
+		self.assertEqual(self.talker.strikes, 0)
+
+	def testRoomFanout(self):
+		room = Room('big')
+		for i in range(8):
+			room.admit(User('u%d' % i, None))
+		self.assertEqual(self.flood.fanout(room), 4.0)
+		self.flood.charge(self.talker, 1.0, 0.0, room)
+		other = Talker()
+		self.flood.charge(other, self.flood.fanout(room), 0.0, room)
+		self.assertRaises(Fail, self.flood.charge, Talker(), 1.0, 0.0, room)
+
+	def testBorkAfterStrikes(self):
+		self.flood.charge(self.talker, 3.0, 0.0)
+		self.assertRaises(Fail, self.flood.charge, self.talker, 1.0, 0.0)
+		self.assertRaises(Fail, self.flood.charge, self.talker, 1.0, 0.0)
+		self.assertRaises(Bork, self.flood.charge, self.talker, 1.0, 0.0)
+
+	def testRoomShortIsNoStrike(self):
+		room = Room('big')
+		for i in range(8):
+			room.admit(User('u%d' % i, None))
+		self.flood.charge(Talker(), 3.0, 0.0, room)
+		self.flood.charge(Talker(), 2.0, 0.0, room)
+		for i in range(10):
+			self.assertRaises(Fail, self.flood.charge, self.talker, 1.0, 0.0, room)
+		self.assertEqual(self.talker.strikes, 0)
+		self.assertEqual(self.talker.bucket.level, 3.0)
+
+	def testUnlimited(self):
+		for i in range(1000):
+			UNLIMITED.charge(self.talker, 100.0, 0.0)
+		self.assertEqual(UNLIMITED.describe(), ['RATE', 'none'])
+
+	def testOnlyValidJoinsCost(self):
+		house = House('test')
+		house.add(Room('main'))
+		factory = HaverFactory(house, flood = Flood(rate = 0.001, burst = 5.0, unit = 1))
+		transport = StringTransport(peerAddress = address.IPv4Address('TCP', '10.0.0.1', 1))
+		talker = factory.buildProtocol(transport.getPeer())
+		talker.makeConnection(transport)
+		talker.dataReceived("HAVER\ttest/1\nIDENT\tal\nJOIN\tmain\n")
+		level = talker.bucket.level
+		talker.dataReceived("JOIN\tmain\n")
+		self.assertTrue(talker.bucket.level > level - 1.5)
+		level = talker.bucket.level
+		talker.dataReceived("PART\tmain\nPART\tmain\n")
+		self.assertTrue(talker.bucket.level >= level)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,4 +1,5 @@
 import inspect
+from haver.protocol import Frame
 
 FAILS = {
 	'mismatch.ip': "Your IP address does not match that one associated with this nick",
@@ -9,23 +10,56 @@ FAILS = {
 	'reserved.name': "The name $1 is reserved by the server",
 	'already.attached': "The user is already attached",
 	'strange.command': "Command from phase $2 sent while server expecting commands from phase $1",
+	'history.off': "Room $1 does not keep its history",
+	'invalid.number': "$1 is not a number",
+	'access.admin': "Only admins may do that, and $1 is not an admin address",
+	'rate.limited': "You are sending too fast; try again in $1 seconds",
+	'watch.limit': "You may watch at most $1 names",
 }
 
+class Command(object):
+	"""A client command as invoke() sees it, worked out once from the decorated
+	method so that dispatching costs a dict lookup and a few compares."""
+	__slots__ = ('name', 'handler', 'phase', 'arity_min', 'arity_max', 'arity_text', 'catchall')
+
+	def __init__(self, name, handler):
+		code = handler.func_code
+		self.name      = name
+		self.handler   = handler
+		self.phase     = handler.phase
+		self.arity_max = code.co_argcount - 1
+
+		if handler.func_defaults is None:
+			self.arity_min  = self.arity_max
+			self.arity_text = str(self.arity_min)
+		else:
+			self.arity_min  = self.arity_max - len(handler.func_defaults)
+			self.arity_text = "%d-%d" % (self.arity_min, self.arity_max)
+
+		self.catchall = bool(code.co_flags & 4)
+		if self.catchall:
+			self.arity_max = 1000000
+
 class Help(object):
 	def __init__(self, talker):
 		self.commands   = list()
 		self.extensions = set()
-		self.failures   = set(['strange.command'])
+		self.failures   = set(['strange.command', 'rate.limited'])
 		self.replies    = dict()
+		self.table      = dict()
 		self.talker     = talker
 
 		for name in dir(talker):
 			if name[0] == '_': continue
 			func = getattr(talker, name)
+			# Extensions that are not commands, like quit, mark the method
+			# that implements them.
+			if hasattr(func, 'extension'):
+				self.extensions.add(func.extension)
 			if hasattr(func, 'phase'):
 				self.commands.append(name)
-				if hasattr(func, 'extension'):
-					self.extensions.add(func.extension)
+				cmd = name.replace('_', ':')
+				self.table[cmd] = Command(cmd, func.im_func)
 				if hasattr(func, 'failures'):
 					for x in func.failures:
 						self.failures.add(x)
@@ -36,6 +70,19 @@ class Help(object):
 						except KeyError:
 							self.replies[name] = [x]
 
+		names = [ x.replace('_', ':') for x in self.commands ]
+		self.commands_frame = Frame('HELP:COMMANDS', names)
+		self.replies_frames = dict()
+		for cmd in names:
+			self.replies_frames[cmd] = self.replies_frame(cmd)
+
+	def replies_frame(self, cmd):
+		"""Return the HELP:REPLIES response for the client command cmd."""
+		try:
+			return self.replies_frames[cmd]
+		except KeyError:
+			return Frame('HELP:REPLIES', [cmd] + self.reply(cmd.replace(':', '_')))
+
 	def fail(self, name):
 		try:
 			return FAILS[name]
@@ -51,7 +98,7 @@ class Help(object):
 
 	def command(self, name):
 		"""Return info about a client command"""
-		cmd = getattr(self.talker, name)
+		cmd = self.table[name].handler
 
 		try: exten = cmd.extension
 		except AttributeError: exten = 'core'
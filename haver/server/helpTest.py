@@ -0,0 +1,34 @@
+#!/usr/bin/python
+import unittest
+from haver.server.help import Command
+
+def normal(func):
+	func.phase = 'normal'
+	return func
+
+class TestCommand(unittest.TestCase):
+	def testFixedArity(self):
+		@normal
+		def JOIN(self, name): pass
+		cmd = Command('JOIN', JOIN)
+		self.assertEqual((cmd.arity_min, cmd.arity_max, cmd.arity_text), (1, 1, "1"))
+		self.assertFalse(cmd.catchall)
+
+	def testOptionalArity(self):
+		@normal
+		def POKE(self, token = "datetime"): pass
+		cmd = Command('POKE', POKE)
+		self.assertEqual((cmd.arity_min, cmd.arity_max, cmd.arity_text), (0, 1, "0-1"))
+
+	def testCatchall(self):
+		@normal
+		def TO(self, name, kind, msg, *rest): pass
+		cmd = Command('TO', TO)
+		self.assertEqual((cmd.arity_min, cmd.arity_text), (3, "3"))
+		self.assertTrue(cmd.catchall)
+		self.assertTrue(cmd.arity_max > 1000)
+		self.assertEqual(cmd.phase, 'normal')
+		self.assertTrue(cmd.handler is TO)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,277 @@
+"""Recent IN traffic of rooms that keep it, for the HISTORY extension.
+
+A room keeps a backlog once its owner sets its history flag. Each backlog
+is a ring of segments of up to SEGMENT lines, stored as the frames were
+encoded for broadcast, each with the time it was sent. The lines of every
+backlog together are held under a memory cap; when it is exceeded, the
+oldest in-memory segment of the least recently used backlog is spilled to
+that room's file, which is read back through mmap. Queries only look at
+the segments they need and only copy the lines they return."""
+
+import os, time, mmap, tempfile
+from array       import array
+from bisect      import bisect_left
+from collections import OrderedDict
+from twisted.python import log
+
+SEGMENT = 64
+
+class Segment(object):
+	"""Consecutive lines of one backlog. While in memory they are in lines;
+	once spilled, line i is at base + offsets[i] in the backlog's file."""
+	__slots__ = ('stamps', 'lines', 'size', 'base', 'offsets')
+
+	def __init__(self):
+		self.stamps  = array('d')
+		self.lines   = []
+		self.size    = 0
+		self.base    = 0
+		self.offsets = None
+
+	def __len__(self):
+		return len(self.stamps)
+
+class Ring(object):
+	"""The backlog of one room: at least its last limit lines, oldest first."""
+
+	def __init__(self, store, room):
+		self.store    = store
+		self.room     = room
+		self.segments = []
+		self.count    = 0
+		self.latest   = 0.0
+		self.file     = None
+		self.map      = None
+		self.live     = 0
+		self.end      = 0
+
+	def append(self, line):
+		# Keep stamps in order even if the clock steps back.
+		stamp = self.latest = max(time.time(), self.latest)
+		segments = self.segments
+		if not segments or segments[-1].offsets is not None or len(segments[-1]) >= SEGMENT:
+			segments.append(Segment())
+		segment = segments[-1]
+		segment.stamps.append(stamp)
+		segment.lines.append(line)
+		segment.size = segment.size + len(line)
+		self.count   = self.count + 1
+		if self.count - len(segments[0]) >= self.store.limit:
+			self.expire()
+		self.store.grew(self, len(line))
+
+	def expire(self):
+		"""Drop the oldest segment."""
+		segment = self.segments.pop(0)
+		self.count = self.count - len(segment)
+		if segment.offsets is None:
+			self.store.shrank(segment.size)
+		else:
+			self.live = self.live - 1
+			if self.live == 0:
+				self.truncate()
+			else:
+				self.compact()
+
+	def spill(self):
+		"""Move the oldest in-memory segment to disk. Return the bytes freed."""
+		for segment in self.segments:
+			if segment.offsets is None:
+				break
+		else:
+			return 0
+		if self.file is None:
+			self.file = tempfile.TemporaryFile(dir = self.store.dir)
+		offsets = array('L', [0])
+		for line in segment.lines:
+			offsets.append(offsets[-1] + len(line))
+		self.file.seek(self.end)
+		self.file.write("".join(segment.lines))
+		self.file.flush()
+		segment.base    = self.end
+		segment.offsets = offsets
+		segment.lines   = None
+		self.end  = self.end + segment.size
+		self.live = self.live + 1
+		return segment.size
+
+	def truncate(self):
+		"""Nothing on disk is wanted any more; start the file over."""
+		if self.map is not None:
+			self.map.close()
+			self.map = None
+		self.file.truncate(0)
+		self.end = 0
+
+	def compact(self):
+		"""Once more of the file is dropped lines than kept ones, move the
+		kept ones to the start of it."""
+		spilled = [ x for x in self.segments if x.offsets is not None ]
+		dead    = spilled[0].base
+		if dead < self.end - dead:
+			return
+		if self.map is not None:
+			self.map.close()
+			self.map = None
+		self.file.seek(dead)
+		data = self.file.read(self.end - dead)
+		self.file.seek(0)
+		self.file.write(data)
+		self.file.truncate(len(data))
+		self.file.flush()
+		for segment in spilled:
+			segment.base = segment.base - dead
+		self.end = len(data)
+
+	def close(self):
+		if self.map is not None:
+			self.map.close()
+		if self.file is not None:
+			self.file.close()
+		for segment in self.segments:
+			if segment.offsets is None:
+				self.store.shrank(segment.size)
+		self.segments = []
+
+	def lines(self, segment, start):
+		"""Yield (stamp, line) for the lines of segment from start on."""
+		stamps = segment.stamps
+		if segment.offsets is None:
+			lines = segment.lines
+			for i in xrange(start, len(stamps)):
+				yield stamps[i], lines[i]
+			return
+		if self.map is None or len(self.map) < self.end:
+			if self.map is not None:
+				self.map.close()
+			self.map = mmap.mmap(self.file.fileno(), self.end, access = mmap.ACCESS_READ)
+		map, base, offsets = (self.map, segment.base, segment.offsets)
+		for i in xrange(start, len(stamps)):
+			yield stamps[i], map[base + offsets[i]:base + offsets[i + 1]]
+
+	def last(self, n):
+		"""Return up to the last n (stamp, line) pairs, oldest first."""
+		self.store.touch(self)
+		segments = self.segments
+		i    = len(segments)
+		need = n
+		while i > 0 and need > 0:
+			i    = i - 1
+			need = need - len(segments[i])
+		if i >= len(segments):
+			return []
+		result = list(self.lines(segments[i], max(0, -need)))
+		for segment in segments[i + 1:]:
+			result.extend(self.lines(segment, 0))
+		return result
+
+	def since(self, when):
+		"""Return the (stamp, line) pairs sent after when, oldest first."""
+		self.store.touch(self)
+		segments = self.segments
+		lo, hi = (0, len(segments))
+		while lo < hi:
+			mid = (lo + hi) // 2
+			if segments[mid].stamps[-1] <= when:
+				lo = mid + 1
+			else:
+				hi = mid
+		if lo >= len(segments):
+			return []
+		stamps = segments[lo].stamps
+		result = list(self.lines(segments[lo], bisect_left(stamps, when)))
+		while result and result[0][0] <= when:
+			del result[0]
+		for segment in segments[lo + 1:]:
+			result.extend(self.lines(segment, 0))
+		return result
+
+class Backlog(object):
+	"""The backlogs of every room in house that keeps one.
+
+	cap is how many bytes of lines may be held in memory across all rooms,
+	and limit how many lines each room keeps. Spilled segments go in
+	anonymous files under dir, or the system's temporary directory, so
+	nothing is left behind however the server stops."""
+
+	def __init__(self, house, cap = 16 << 20, limit = 1000, dir = None):
+		self.house = house
+		self.cap   = cap
+		self.limit = limit
+		self.used  = 0
+		# Backlogs with lines in memory, least recently used first.
+		self.rings = OrderedDict()
+		self.dir   = dir
+		house.observers.append(self)
+		for room in house.lookup_namespace('room').values():
+			self.changed(room, 'history')
+
+	def keep(self, room):
+		if room.backlog is None:
+			room.backlog = Ring(self, room)
+			self.rings[room.backlog] = True
+
+	def forget(self, room):
+		if room.backlog is not None:
+			self.rings.pop(room.backlog, None)
+			room.backlog.close()
+			room.backlog = None
+
+	def touch(self, ring):
+		rings = self.rings
+		if rings.pop(ring, None):
+			rings[ring] = True
+
+	def grew(self, ring, size):
+		rings = self.rings
+		rings.pop(ring, None)
+		rings[ring] = True
+		self.used = self.used + size
+		if self.used > self.cap:
+			self.evict()
+
+	def shrank(self, size):
+		self.used = self.used - size
+
+	def evict(self):
+		"""Spill the least recently used backlogs until we are under the cap."""
+		rings = self.rings
+		while self.used > self.cap and rings:
+			ring = iter(rings).next()
+			try:
+				freed = ring.spill()
+			except (IOError, OSError, mmap.error), e:
+				log.msg('Cannot spill history of %s: %s' % (ring.room.name, e))
+				freed = 0
+			if freed == 0:
+				del rings[ring]
+			self.used = self.used - freed
+
+	def close(self):
+		for room in self.house.lookup_namespace('room').values():
+			self.forget(room)
+
+	def added(self, thing):
+		if thing.namespace == 'room':
+			self.changed(thing, 'history')
+
+	def removed(self, thing):
+		if thing.namespace == 'room':
+			self.forget(thing)
+
+	def changed(self, thing, key):
+		if thing.namespace == 'room' and key == 'history':
+			if thing.history == 'yes':
+				self.keep(thing)
+			else:
+				self.forget(thing)
+
+	def broadcast(self, room, frame):
+		pass
+
+def shared(house):
+	"""Return the Backlog of house, creating it on first use."""
+	for observer in house.observers:
+		if isinstance(observer, Backlog):
+			return observer
+	return Backlog(house)
@@ -0,0 +1,107 @@
+#!/usr/bin/python
+import unittest, os, tempfile, shutil
+from haver.server.house   import House
+from haver.server.thing   import Room
+from haver.server.history import Backlog, SEGMENT
+
+class TestBacklog(unittest.TestCase):
+	def setUp(self):
+		self.dir   = tempfile.mkdtemp()
+		self.house = House('test')
+		for name in ['main', 'lobby', 'quiet']:
+			self.house.add(Room(name))
+		self.store = Backlog(self.house, cap = 4096, limit = 200, dir = self.dir)
+		for name in ['main', 'lobby']:
+			self.keep(name, 'yes')
+
+	def tearDown(self):
+		self.store.close()
+		shutil.rmtree(self.dir, True)
+
+	def keep(self, name, flag):
+		room = self.house.lookup('room', name)
+		room['history'] = flag
+		self.house.changed(room, 'history')
+		return room
+
+	def say(self, name, count):
+		room = self.house.lookup('room', name)
+		for i in range(count):
+			room.sendMsg('IN', room.name, 'bob', 'say', '%s %d' % (name, i))
+
+	def msgs(self, entries):
+		return [ data.split("\t")[4].rstrip("\n") for stamp, data in entries ]
+
+	def testOptIn(self):
+		self.say('quiet', 5)
+		self.assertTrue(self.house.lookup('room', 'quiet').backlog is None)
+		room = self.keep('main', 'no')
+		self.assertTrue(room.backlog is None)
+
+	def testLast(self):
+		self.say('main', 3)
+		backlog = self.house.lookup('room', 'main').backlog
+		self.assertEqual(self.msgs(backlog.last(2)), ['main 1', 'main 2'])
+		self.assertEqual(self.msgs(backlog.last(10)), ['main 0', 'main 1', 'main 2'])
+		self.assertEqual(backlog.last(0), [])
+
+	def testLimit(self):
+		self.say('main', 500)
+		backlog = self.house.lookup('room', 'main').backlog
+		self.assertTrue(200 <= backlog.count < 200 + SEGMENT)
+		self.assertEqual(self.msgs(backlog.last(1)), ['main 499'])
+
+	def testSpillsLeastRecentlyUsed(self):
+		self.say('lobby', 10)
+		self.say('main', 190)
+		self.assertTrue(self.store.used <= self.store.cap)
+		lobby = self.house.lookup('room', 'lobby').backlog
+		main  = self.house.lookup('room', 'main').backlog
+		self.assertTrue(lobby.segments[0].lines is None)
+		self.assertTrue(main.segments[-1].lines is not None)
+		self.assertEqual(self.msgs(lobby.last(3)), ['lobby 7', 'lobby 8', 'lobby 9'])
+		self.assertEqual(self.msgs(main.last(190)), [ 'main %d' % i for i in range(190) ])
+
+	def testSince(self):
+		self.say('main', 150)
+		backlog = self.house.lookup('room', 'main').backlog
+		entries = backlog.last(150)
+		when    = entries[99][0]
+		since   = backlog.since(when)
+		self.assertTrue(len(since) <= 50)
+		self.assertEqual(since, [ x for x in entries if x[0] > when ])
+		self.assertEqual(len(backlog.since(0)), 150)
+		self.assertEqual(backlog.since(entries[-1][0]), [])
+
+	def testSpillFileStaysSmall(self):
+		self.say('main', 5000)
+		backlog = self.house.lookup('room', 'main').backlog
+		kept    = sum([ x.size for x in backlog.segments ])
+		self.assertTrue(backlog.end <= 2 * kept + 4096)
+		self.assertEqual(self.msgs(backlog.last(2)), ['main 4998', 'main 4999'])
+
+	def testForgetOnClose(self):
+		self.say('main', 100)
+		room = self.house.lookup('room', 'main')
+		self.house.remove(room)
+		self.assertTrue(room.backlog is None)
+		self.assertTrue(self.store.used < self.store.cap)
+
+	def testNothingLeftBehind(self):
+		self.say('main', 500)
+		self.assertEqual(os.listdir(self.dir), [])
+		house = House('test')
+		house.add(Room('main'))
+		store = Backlog(house, cap = 4096, limit = 200)
+		self.assertTrue(store.dir is None)
+		room = house.lookup('room', 'main')
+		room['history'] = 'yes'
+		house.changed(room, 'history')
+		for i in range(500):
+			room.sendMsg('IN', 'main', 'bob', 'say', 'main %d' % i)
+		self.assertTrue(room.backlog.file is not None)
+		self.assertEqual(self.msgs(room.backlog.last(1)), ['main 499'])
+		store.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,58 +1,226 @@
+from bisect import bisect_left
+from fnmatch import fnmatchcase
+from heapq import heappush, heappop
 from haver.server.errors import Fail, Bork
-from haver.server.asserts import assert_name, assert_ns
+from haver.server.asserts import assert_name, assert_ns, purify, namepattern
+
+globchars = '*?['
+
+class Index(object):
+	"""The canonical keys of one namespace, sorted on demand for range queries.
+
+	Adds and removes are only noted, so logins and logouts stay O(1); the
+	next query merges them into the sorted keys in one pass and a sort of
+	what was added."""
+	def __init__(self):
+		self.keys    = []
+		self.added   = set()
+		self.removed = set()
+
+	def add(self, key):
+		if key in self.removed:
+			self.removed.discard(key)
+		else:
+			self.added.add(key)
+
+	def remove(self, key):
+		if key in self.added:
+			self.added.discard(key)
+		else:
+			self.removed.add(key)
+
+	def sort(self):
+		keys = self.keys
+		if self.removed:
+			removed = self.removed
+			keys = [ k for k in keys if k not in removed ]
+			self.removed = set()
+		if self.added:
+			# Two sorted runs, which timsort merges in one pass.
+			keys.extend(sorted(self.added))
+			keys.sort()
+			self.added = set()
+		self.keys = keys
+
+	def prefix(self, prefix):
+		"""Return every key starting with prefix, in order."""
+		self.sort()
+		keys = self.keys
+		# Names are plain ASCII, so no key starting with prefix sorts after this.
+		return keys[ bisect_left(keys, prefix) : bisect_left(keys, prefix + '\xff') ]
+
+class Suffixes(object):
+	"""Hands out numeric suffixes for one genname() root, lowest freed one first."""
+	def __init__(self):
+		self.next  = 1
+		self.freed = []
+		self.used  = 0
+
+	def take(self):
+		self.used = self.used + 1
+		if self.freed:
+			return heappop(self.freed)
+		suffix    = self.next
+		self.next = suffix + 1
+		return suffix
+
+	def give(self, suffix):
+		self.used = self.used - 1
+		heappush(self.freed, suffix)
 
 class House(set):
+	"""Every user and room on the server, by namespace.
+
+	Observers are told about every change to the house: added(thing),
+	removed(thing), changed(thing, key) and broadcast(room, frame). While a
+	change that came from elsewhere (e.g. another server process) is being
+	applied, origin is set to whatever it came from."""
 	def __init__(self, host):
 		self.host      = host
+		self.observers = []
+		self.origin    = None
 		self.__things = dict( user = dict(), room = dict () )
+		self.__index  = dict( user = Index(), room = Index() )
+		self.__roots  = dict()
+		self.__named  = dict()
 
 	def lookup_namespace(self, ns):
 		try:
 			return self.__things[ns]
 		except KeyError:
 			raise Fail('unknown.namespace', ns)
-	
+
 	def lookup(self, ns, name):
+		"""Find a thing by name. Names that are already canonical (lowercase) are
+		found without folding, and a name is only validated when it is not found."""
 		things = self.lookup_namespace(ns)
+		try:
+			return things[name]
+		except KeyError:
+			pass
 		try:
 			return things[ name.lower() ]
 		except KeyError:
+			assert_name(name)
 			raise Fail('unknown.thing', ns, name)
-	
+
 	def add(self, thing):
 		assert hasattr(thing, 'namespace')
-		assert hasattr(thing, 'name')
+		assert hasattr(thing, 'key')
 
-		ns, name = (thing.namespace, thing.name.lower())
+		ns, key = (thing.namespace, thing.key)
 		things = self.lookup_namespace(ns)
-		if things.has_key(name):
+		if things.has_key(key):
 			raise Fail('existing.thing', ns, thing.name)
-		things[name] = thing
-		
+		things[key] = thing
+		self.__index[ns].add(key)
+		thing.house = self
+		for observer in self.observers:
+			observer.added(thing)
+
+	def restore(self, things):
+		"""Add many things at once, e.g. when loading saved state. Observers
+		are not told."""
+		for thing in things:
+			ns, key = (thing.namespace, thing.key)
+			table   = self.lookup_namespace(ns)
+			if key in table:
+				raise Fail('existing.thing', ns, thing.name)
+			table[key] = thing
+			self.__index[ns].add(key)
+			thing.house = self
+
 	def remove(self, thing):
-		ns       = thing.namespace
-		name     = thing.name
-		lname    = name.lower()
+		ns     = thing.namespace
+		key    = thing.key
 		things = self.lookup_namespace(ns)
 		try:
-			del things[lname]
+			del things[key]
 		except KeyError:
-			raise Fail('unknown.thing', ns, name)
+			raise Fail('unknown.thing', ns, thing.name)
+		self.__index[ns].remove(key)
+		if ns == 'user' and key in self.__named:
+			self.__giveback(key)
+		thing.house = None
+		for observer in self.observers:
+			observer.removed(thing)
+
+	def changed(self, thing, key):
+		"""Called after thing[key] is set to something other observers must know."""
+		for observer in self.observers:
+			observer.changed(thing, key)
+
+	def broadcast(self, room, frame):
+		"""Called by a room after writing a frame to its members."""
+		for observer in self.observers:
+			observer.broadcast(room, frame)
 
 	def list(self, ns):
 		things = self.lookup_namespace(ns)
 		return things.values()
 
+	def prefix(self, ns, prefix):
+		"""Return the things in ns whose names start with prefix, ordered by name."""
+		things = self.lookup_namespace(ns)
+		return [ things[k] for k in self.__index[ns].prefix(prefix.lower()) ]
+
+	def glob(self, ns, pattern):
+		"""Return the things in ns whose names match the shell-style pattern.
+		Only names sharing the pattern's literal prefix are examined."""
+		things  = self.lookup_namespace(ns)
+		pattern = pattern.lower()
+		literal = pattern
+		for c in globchars:
+			i = literal.find(c)
+			if i != -1:
+				literal = literal[:i]
+		keys = self.__index[ns].prefix(literal)
+		if len(literal) < len(pattern):
+			keys = [ k for k in keys if fnmatchcase(k, pattern) ]
+		return [ things[k] for k in keys ]
+
 	def genname(self, root = 'random'):
+		"""Return an unused, valid user name built from root, which is purified
+		first. Suffixes are allocated per root and handed out again once their
+		users are removed, so this never rescans the names given out before.
+		The name, bare root or not, is kept from later calls until the user
+		added by it is removed; a caller that does not add one must release()
+		the name instead."""
 		users = self.lookup_namespace('user')
-		name = root
-		i    = 1
+		root  = purify(root)
+		rkey  = intern(root.lower())
+		if rkey not in users and rkey not in self.__named and namepattern.match(root):
+			self.__named[rkey] = (rkey, None)
+			return root
+
+		try:
+			suffixes = self.__roots[rkey]
+		except KeyError:
+			suffixes = self.__roots[rkey] = Suffixes()
 		while True:
-			if name in users:
-				name = root + str(i)
-				i    = i + 1
-			else:
-				break
-		return name
+			suffix = suffixes.take()
+			name   = root + str(suffix)
+			key    = intern(name.lower())
+			if key in users:
+				# Claimed without genname(), e.g. by IDENT; skip it for good.
+				suffixes.used = suffixes.used - 1
+				continue
+			self.__named[key] = (rkey, suffix)
+			return name
 
+	def release(self, name):
+		"""Give back a name from genname() that no user will be added by.
+		Names users were added by are given back when they are removed."""
+		key = name.lower()
+		if key in self.__named and key not in self.lookup_namespace('user'):
+			self.__giveback(key)
 
+	def __giveback(self, key):
+		"""Forget a name made by genname(), returning its suffix to its root."""
+		rkey, suffix = self.__named.pop(key)
+		if suffix is None:
+			return
+		suffixes = self.__roots[rkey]
+		suffixes.give(suffix)
+		if suffixes.used == 0:
+			del self.__roots[rkey]
@@ -0,0 +1,75 @@
+#!/usr/bin/python
+"""Benchmark for House.genname: allocate many names under one root, as an IRC
+bouncer reconnecting all its clients as 'guest' would. Also times logins
+and logouts in a house of that many users, with and without a USERS glob
+every so often.
+
+	python houseBench.py [names]
+"""
+import sys, time
+from haver.server.house import House
+from haver.server.thing import User
+
+def probe(house, root):
+	"""The old allocator: try root, root1, root2, ... one at a time."""
+	users = house.lookup_namespace('user')
+	name = root
+	i    = 1
+	while name.lower() in users:
+		name = root + str(i)
+		i    = i + 1
+	return name
+
+def allocate(count, genname):
+	house = House('bench')
+	start = time.time()
+	for i in xrange(count):
+		house.add(User(genname(house, 'guest'), None))
+	return time.time() - start
+
+def churn(count):
+	"""Drop every other user and allocate again, reusing the freed suffixes."""
+	house = House('bench')
+	users = []
+	for i in xrange(count):
+		users.append(User(house.genname('guest'), None))
+		house.add(users[-1])
+	for user in users[::2]:
+		house.remove(user)
+	start = time.time()
+	for i in xrange(0, count, 2):
+		house.add(User(house.genname('guest'), None))
+	return time.time() - start
+
+def logins(count, cycles, every):
+	"""Log a user in and another out cycles times in a house of count users,
+	with a glob query every so many cycles if every is given."""
+	house = House('bench')
+	users = [ User('user%d' % i, None) for i in xrange(count) ]
+	house.restore(users)
+	house.prefix('user', 'user')
+	start = time.time()
+	for i in xrange(cycles):
+		house.add(User('login%d' % i, None))
+		house.remove(users[i])
+		if every and i % every == 0:
+			house.glob('user', 'login*')
+	return time.time() - start
+
+def main(count):
+	elapsed = allocate(count, House.genname)
+	print "genname  %7d names %8.3fs %10.0f names/s" % (count, elapsed, count / elapsed)
+	elapsed = churn(count)
+	print "reuse    %7d names %8.3fs %10.0f names/s" % (count / 2, elapsed, count / 2 / elapsed)
+	small   = min(count, 5000)
+	elapsed = allocate(small, probe)
+	print "probing  %7d names %8.3fs %10.0f names/s" % (small, elapsed, small / elapsed)
+	for every in (0, 100):
+		elapsed = logins(count, 2000, every)
+		print "login    %7d users %8.3fs %10.0f cycles/s, a glob every %d" % (count, elapsed, 2000 / elapsed, every)
+
+if __name__ == '__main__':
+	if len(sys.argv) > 1:
+		main(int(sys.argv[1]))
+	else:
+		main(100000)
@@ -0,0 +1,121 @@
+#!/usr/bin/python
+import unittest
+from haver.server.errors import Fail
+from haver.server.asserts import namepattern, assert_name_unreserved
+from haver.server.house import House
+from haver.server.thing import Room, User
+
+class TestHouse(unittest.TestCase):
+	def setUp(self):
+		self.house = House('test')
+		for name in ['dev-ops', 'Dev-Core', 'lobby', 'main', 'dev', 'devious']:
+			self.house.add(Room(name))
+
+	def failure(self, func, *args):
+		try:
+			func(*args)
+		except Fail, f:
+			return f.name
+		self.fail('no failure raised')
+
+	def testInternedKey(self):
+		room = self.house.lookup('room', 'DEV-CORE')
+		self.assertEqual(room.name, 'Dev-Core')
+		self.assertTrue(room.key is intern('dev-core'))
+		self.assertTrue(self.house.lookup('room', 'dev-core') is room)
+
+	def testLookupFailures(self):
+		self.assertEqual(self.failure(self.house.lookup, 'room', 'nowhere'), 'unknown.thing')
+		self.assertEqual(self.failure(self.house.lookup, 'room', '4 score'), 'invalid.name')
+		self.assertEqual(self.failure(self.house.lookup, 'soul', 'main'), 'unknown.namespace')
+		self.assertEqual(self.failure(self.house.add, Room('MAIN')), 'existing.thing')
+
+	def testPrefix(self):
+		names = [ x.name for x in self.house.prefix('room', 'DEV-') ]
+		self.assertEqual(names, ['Dev-Core', 'dev-ops'])
+		self.assertEqual(len(self.house.prefix('room', 'dev')), 4)
+		self.assertEqual(self.house.prefix('room', 'zz'), [])
+
+	def testGlob(self):
+		names = [ x.name for x in self.house.glob('room', 'dev*s') ]
+		self.assertEqual(names, ['dev-ops', 'devious'])
+		names = [ x.name for x in self.house.glob('room', '*o*') ]
+		self.assertEqual(names, ['Dev-Core', 'dev-ops', 'devious', 'lobby'])
+		self.assertEqual([ x.name for x in self.house.glob('room', 'main') ], ['main'])
+
+	def testRemoveKeepsIndex(self):
+		self.house.remove(self.house.lookup('room', 'dev-ops'))
+		names = [ x.name for x in self.house.prefix('room', 'dev-') ]
+		self.assertEqual(names, ['Dev-Core'])
+		self.assertEqual(self.failure(self.house.lookup, 'room', 'dev-ops'), 'unknown.thing')
+
+	def testChurnBetweenQueries(self):
+		main = self.house.lookup('room', 'main')
+		self.house.prefix('room', 'dev')
+		self.house.remove(self.house.lookup('room', 'dev'))
+		self.house.add(Room('Dev'))
+		self.house.add(Room('dev-a'))
+		self.house.remove(self.house.lookup('room', 'dev-a'))
+		self.house.remove(main)
+		self.house.add(Room('aardvark'))
+		self.house.add(main)
+		self.assertEqual([ x.name for x in self.house.glob('room', '*') ],
+			['aardvark', 'Dev', 'Dev-Core', 'dev-ops', 'devious', 'lobby', 'main'])
+
+	def testGennameFoldsCase(self):
+		self.house.add(User('Guest', None))
+		self.assertEqual(self.house.genname('guest'), 'guest1')
+
+	def testInfo(self):
+		room = self.house.lookup('room', 'main')
+		self.assertEqual(room['owner'], '&root')
+		room['topic'] = 'hi'
+		self.assertEqual(dict(zip(*[iter(room.info())] * 2)),
+			dict(owner = '&root', secure = 'no', history = 'no', topic = 'hi'))
+		self.assertEqual(self.failure(room.__getitem__, 'mood'), 'unknown.infokey')
+		user = User('bob', None)
+		self.assertEqual(self.failure(user.__getitem__, 'address'), 'unknown.infokey')
+		self.assertEqual(user['idle'], '0')
+		self.assertFalse(hasattr(user, '__dict__'))
+
+	def adduser(self, root):
+		user = User(self.house.genname(root), None)
+		self.house.add(user)
+		return user
+
+	def testGennameReusesSuffixes(self):
+		users = [ self.adduser('guest') for i in range(4) ]
+		self.assertEqual([ x.name for x in users ], ['guest', 'guest1', 'guest2', 'guest3'])
+		self.house.remove(users[2])
+		self.house.remove(users[1])
+		self.assertEqual(self.adduser('guest').name, 'guest1')
+		self.assertEqual(self.adduser('guest').name, 'guest2')
+		self.assertEqual(self.adduser('guest').name, 'guest4')
+
+	def testGennameKeepsNamesUntilAdded(self):
+		self.assertEqual(self.house.genname('guest'), 'guest')
+		self.assertEqual(self.house.genname('guest'), 'guest1')
+		self.assertEqual(self.house.genname('guest'), 'guest2')
+
+	def testReleaseUnusedNames(self):
+		for name in [ self.house.genname('guest') for i in range(3) ]:
+			self.house.release(name)
+		self.assertEqual(self.adduser('guest').name, 'guest')
+		self.assertEqual(self.adduser('guest').name, 'guest1')
+		self.house.release('guest')
+		self.assertEqual(self.adduser('guest').name, 'guest2')
+
+	def testGennameSkipsClaimedNames(self):
+		self.house.add(User('bob', None))
+		self.house.add(User('Bob2', None))
+		self.assertEqual(self.adduser('bob').name, 'bob1')
+		self.assertEqual(self.adduser('bob').name, 'bob3')
+
+	def testGennameIsValid(self):
+		for root in ['#chan', '&root', '42', 'x', 'a@b', '']:
+			name = self.adduser(root).name
+			self.assertTrue(namepattern.match(name), name)
+			assert_name_unreserved(name)
+
+if __name__ == '__main__':
+    unittest.main()
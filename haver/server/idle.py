@@ -0,0 +1,119 @@
+import time
+from twisted.internet import task
+from haver.server     import core
+
+class IdleWheel(object):
+	"""One ping scheduler shared by every talker on the server.
+
+	Talkers are hashed into the slot of the wheel that their deadline falls in
+	and one timer turns the wheel, so each tick only looks at the talkers that
+	are due. Deadlines are derived from lastCmd lazily: a talker that has been
+	active since it was scheduled is simply put back at lastCmd + timeout when
+	its slot comes up.
+
+	A talker must provide phase, lastCmd, tardy, sendMsg() and disconnect()."""
+
+	token = 'foo'
+
+	def __init__(self, timeout = 60, slots = 60, clock = None):
+		if clock is None:
+			clock = core.clock()
+		self.timeout    = timeout
+		self.resolution = float(timeout) / slots
+		self.wheel      = [ set() for i in range(slots) ]
+		self.where      = dict()
+		self.clock      = clock
+		self.loop       = None
+		self.cursor     = self.tickOf(time.time())
+
+	def __len__(self):
+		return len(self.where)
+
+	def tickOf(self, when):
+		return int(when / self.resolution)
+
+	def add(self, talker):
+		"""Start watching a newly connected talker."""
+		talker.tardy = None
+		now = time.time()
+		if self.loop is None:
+			self.cursor = self.tickOf(now)
+		self.schedule(talker, now + self.timeout)
+		if self.loop is None:
+			self.loop = task.LoopingCall(self.tick)
+			self.loop.clock = self.clock
+			self.loop.start(self.resolution, now = False)
+
+	def cancel(self, talker):
+		"""Stop watching a talker; called when its connection is lost."""
+		try:
+			tick = self.where.pop(talker)
+		except KeyError:
+			return
+		self.wheel[tick % len(self.wheel)].discard(talker)
+		self.stopIfEmpty()
+
+	def stopIfEmpty(self):
+		if len(self.where) == 0 and self.loop is not None:
+			self.loop.stop()
+			self.loop = None
+
+	def schedule(self, talker, deadline):
+		tick = max(self.tickOf(deadline), self.cursor + 1)
+		old  = self.where.get(talker)
+		if old is not None:
+			self.wheel[old % len(self.wheel)].discard(talker)
+		self.wheel[tick % len(self.wheel)].add(talker)
+		self.where[talker] = tick
+
+	def tick(self, now = None):
+		"""Expire every talker whose slot has come up since the last tick."""
+		if now is None:
+			now = time.time()
+		current = self.tickOf(now)
+		# After a long stall, one full turn of the wheel covers everything.
+		start = max(self.cursor + 1, current - len(self.wheel) + 1)
+		for tick in xrange(start, current + 1):
+			self.cursor = tick
+			slot = self.wheel[tick % len(self.wheel)]
+			if len(slot) == 0:
+				continue
+			# Talkers rescheduled during this sweep may share the slot but
+			# belong to a later turn of the wheel.
+			due = [ x for x in slot if self.where[x] <= tick ]
+			for talker in due:
+				slot.remove(talker)
+				del self.where[talker]
+			for talker in due:
+				self.expire(talker, now)
+		self.cursor = max(self.cursor, current)
+		self.stopIfEmpty()
+
+	def expire(self, talker, now):
+		"""Issue a ping if this talker hasn't sent a command recently, or drop
+		it if it never answered the last one."""
+		if talker.phase != 'normal':
+			talker.tardy = None
+			self.schedule(talker, now + self.timeout)
+			return
+
+		if talker.tardy is not None:
+			talker.disconnect('ping')
+			return
+
+		deadline = talker.lastCmd + self.timeout
+		if deadline > now:
+			self.schedule(talker, deadline)
+		else:
+			talker.sendMsg('PING', self.token)
+			talker.tardy = self.token
+			self.schedule(talker, now + self.timeout)
+
+wheel = None
+
+def shared():
+	"""Return the server-wide wheel, creating it on first use."""
+	global wheel
+	if wheel is None:
+		wheel = IdleWheel()
+	return wheel
@@ -0,0 +1,76 @@
+#!/usr/bin/python
+import unittest, time
+from twisted.internet import task
+from haver.server.idle import IdleWheel
+
+class Talker:
+	def __init__(self):
+		self.phase   = 'normal'
+		self.lastCmd = time.time()
+		self.sent    = []
+		self.closed  = None
+
+	def sendMsg(self, cmd, *args):
+		self.sent.append((cmd,) + args)
+
+	def disconnect(self, why):
+		self.closed = why
+
+class TestIdleWheel(unittest.TestCase):
+	def setUp(self):
+		self.clock = task.Clock()
+		self.wheel = IdleWheel(timeout = 60, slots = 12, clock = self.clock)
+		self.start = time.time()
+
+	def testPingThenBye(self):
+		t = Talker()
+		self.wheel.add(t)
+		self.wheel.tick(self.start + 30)
+		self.assertEqual(t.sent, [])
+		self.wheel.tick(self.start + 66)
+		self.assertEqual(t.sent, [('PING', 'foo')])
+		self.wheel.tick(self.start + 132)
+		self.assertEqual(t.closed, 'ping')
+		self.assertEqual(len(self.wheel), 0)
+		self.assertEqual(self.wheel.loop, None)
+
+	def testActiveTalkerIsRescheduled(self):
+		t = Talker()
+		self.wheel.add(t)
+		t.lastCmd = self.start + 50
+		self.wheel.tick(self.start + 66)
+		self.assertEqual(t.sent, [])
+		self.assertEqual(len(self.wheel), 1)
+		self.wheel.tick(self.start + 116)
+		self.assertEqual(t.sent, [('PING', 'foo')])
+
+	def testPongClearsTardy(self):
+		t = Talker()
+		self.wheel.add(t)
+		self.wheel.tick(self.start + 66)
+		t.tardy   = None
+		t.lastCmd = self.start + 67
+		self.wheel.tick(self.start + 132)
+		self.assertEqual(t.closed, None)
+
+	def testLoginPhaseNeverPinged(self):
+		t = Talker()
+		t.phase = 'login'
+		self.wheel.add(t)
+		self.wheel.tick(self.start + 200)
+		self.assertEqual(t.sent, [])
+		self.assertEqual(len(self.wheel), 1)
+
+	def testCancel(self):
+		t = Talker()
+		self.wheel.add(t)
+		self.assertNotEqual(self.wheel.loop, None)
+		self.wheel.cancel(t)
+		self.wheel.cancel(t)
+		self.assertEqual(len(self.wheel), 0)
+		self.assertEqual(self.wheel.loop, None)
+		self.wheel.tick(self.start + 200)
+		self.assertEqual(t.sent, [])
+
+if __name__ == '__main__':
+    unittest.main()
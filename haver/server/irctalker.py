@@ -1,17 +1,22 @@
 import time
-from twisted.python            import log
-from twisted.protocols.basic   import LineOnlyReceiver
 from twisted.internet.protocol import Factory
-from twisted.internet          import task
 
 from haver.server.errors  import Fail, Bork
 from haver.server.thing   import User, Room
 from haver.server.asserts import *
+from haver.server.idle    import shared
+from haver.server.outbound import Outbound
+from haver.server.lines    import LineBatchReceiver
+from haver.server.names    import Names, split
+from haver.server.flood    import Flood
+from haver.server          import metrics, logger, quits, core
 import haver.server
 
-badchars = re.compile('[\[\[\\\|\`\^#]')
-def purify(s):
-	return re.sub(badchars, '', s)
+commands = metrics.Commands(metrics.shared(), 'irc')
+clients  = logger.get('irc')
+fails    = logger.get('irc.fail')
+# Every line read and written.
+wire     = logger.get('irc.wire')
 
 def parsemsg(s):
     """Breaks a message from an IRC server into its prefix, command, and arguments.
@@ -30,81 +35,170 @@ def parsemsg(s):
     command = args.pop(0)
     return prefix, command, args
 
+# Longest line an IRC client has to accept, with its CRLF.
+LINE    = 512
+# Names up to this long get NAMES lines from the room's cached chunks.
+NICKLEN = 30
+
+prefixes = dict()
+
+def prefix(uname):
+	"""The :nick!user@haver prefix of lines from uname."""
+	try:
+		return prefixes[uname]
+	except KeyError:
+		if len(prefixes) > 10000:
+			prefixes.clear()
+		p = prefixes[uname] = ':%s!user@haver' % uname
+		return p
+
+def render_join(rname, uname, *rest):
+	return '%s JOIN :#%s' % (prefix(uname), rname)
+
+def render_part(rname, uname, *rest):
+	return '%s PART #%s' % (prefix(uname), rname)
+
+def render_quit(uname, why, *rest):
+	return '%s QUIT :%s' % (prefix(uname), why)
+
+def render_in(rname, uname, kind, msg, *rest):
+	return '%s PRIVMSG #%s :%s' % (prefix(uname), rname, msg)
+
+# Commands that cost no tokens.
+FREE = set(['PING', 'PONG', 'QUIT', 'PART'])
+
+def budget(nick, rname):
+	"""Room for names in a 353 line to nick about room rname."""
+	return LINE - len(':haver 353 %s = #%s :\r\n' % (nick, rname))
+
+def members(room):
+	"""The room's Names, made on first use."""
+	if room.names is None:
+		room.names = Names([ x.name for x in room.users ], budget('x' * NICKLEN, room.name))
+	return room.names
+
 class IRCFactory(Factory):
 
-	def __init__(self, house, ssl = False):
+	def __init__(self, house, ssl = False, idle = None, backlog = 1000, overflow = 'drop', flood = None):
+		if idle is None:
+			idle = shared()
 		self.house    = house
 		self.protocol = IRCTalker
 		self.ssl = ssl
+		self.idle = idle
+		self.backlog  = backlog
+		self.overflow = overflow
+		if flood is None:
+			flood = Flood()
+		self.flood    = flood
+		self.meter    = metrics.shared().meter(ssl and 'irc+ssl' or 'irc')
+		metrics.watch(metrics.shared(), house, idle)
 
 	def buildProtocol(self, addr):
 		p = self.protocol(addr)
 		p.factory = self
-		p.house   = self.house
 		return p
 		
-class IRCTalker(LineOnlyReceiver):
-	def __init__(self, addr):
-		self.addr      = addr
-		self.delimiter = "\n"
+class IRCTalker(LineBatchReceiver):
+	# Defaults shared by every connection until one sets its own.
+	delimiter = "\n"
+	tardy     = None
+	closing   = False
+	bucket    = None
+	strikes   = 0
+	quits     = True
 
-		self.lastCmd   = time.time()
-		#self.tardy     = None
-		#self.pingTime  = 60
-		#self.pingLoop  = task.LoopingCall(self.checkPing)
-		#self.pingLoop.start(self.pingTime)
+	def __init__(self, addr):
+		self.addr    = addr
+		self.lastCmd = time.time()
 
 	def lineReceived(self, line):
-		log.msg('C: ' + line.rstrip("\r"))
+		if wire.level <= logger.DEBUG:
+			wire.debug('C: %s', line.rstrip("\r"))
+		self.lastCmd = time.time()
 		try:
 			prefix, cmd, args = parsemsg(line.rstrip("\r"))
 			self.cmd = cmd
 			try:
 				f = getattr(self, "C_" + cmd)
 			except AttributeError:
-				log.msg('FIXME: C_' + cmd)
+				clients.limited(logger.DEBUG, 'C_' + cmd, 'Unsupported IRC command %s', cmd)
 				return
-			f(*args)
+			if cmd not in FREE:
+				self.factory.flood.charge(self, 1.0, self.lastCmd)
+			start = time.time()
+			try:
+				f(*args)
+			finally:
+				commands.timer(cmd).observe(time.time() - start)
 		except Fail, failure:
-			log.msg('Command %s failed with failure %s (%s)' % (self.cmd, failure.name, str(failure.args)))
+			fails.limited(logger.INFO, failure.name, 'Command %s failed with failure %s %r',
+				self.cmd, failure.name, failure.args)
+			commands.failed(failure.name)
 			self.sendMsg('FAIL', self.cmd, failure.name, *failure.args)
 		except Bork, bork:
-			log.msg('Borking client: %s' % bork.msg)
+			clients.warn('Borking client %s: %s', self.addr.host, bork.msg)
 			self.sendMsg('BORK', bork.msg)
 			self.disconnect('bork')
 
 	def sendMsg(self, cmd, *args):
-		log.msg('sendMsg: %s (%s)' % (cmd, ', '.join(args)))
+		wire.debug('sendMsg: %s %r', cmd, args)
 		try:
 			f = getattr(self, 'S_' + cmd)
 		except AttributeError:
-			log.msg('FIXME: S_' + cmd)
+			clients.limited(logger.DEBUG, 'S_' + cmd, 'No IRC rendering of %s', cmd)
 			return
 		f(*args)
 
-	def sendRaw(self, s):
-		log.msg('S: ' + s)
-		self.sendLine(s + "\r")
+	def sendFrame(self, frame):
+		"""Write a broadcast frame. The IRC line is rendered once per frame and
+		shared by every IRC recipient."""
+		try:
+			f = getattr(self, 'F_' + frame.cmd)
+		except AttributeError:
+			self.sendMsg(frame.cmd, *frame.args)
+			return
+		f(frame)
+
+	def sendBatch(self, batch):
+		"""Write a batch. PARTs are rendered once, joined, and shared by
+		every IRC recipient."""
+		if batch.cmd == 'PART':
+			self.sendRaw(batch.view('irc', render_part, "\r\n"))
+		else:
+			for frame in batch.frames:
+				self.sendFrame(frame)
+
+	def sendRaw(self, s, urgent = False, chat = False, flush = False):
+		wire.debug('S: %s', s)
+		self.outbound.write(s + "\r\n", urgent, chat, flush)
 
 
 	def connectionMade(self):
 		self.phase = 'connect'
-		log.msg('New client from ' + str(self.addr))
+		self.outbound = Outbound(self.transport, self.slow, self.factory.backlog, self.factory.overflow,
+			meter = self.factory.meter)
+		self.factory.idle.add(self)
+		self.factory.meter.connected.inc()
+		clients.info('New client from %s', self.addr.host)
 
 	def connectionLost(self, reason):
-		log.msg('Lost client from ' + str(self.addr))
+		clients.info('Lost client from %s', self.addr.host)
+		self.factory.idle.cancel(self)
+		self.factory.meter.connected.dec()
 		self.quit('closed')
 
+	def dataReceived(self, data):
+		self.factory.meter.received.inc(len(data))
+		LineBatchReceiver.dataReceived(self, data)
+
 	def quit(self, why, reason = None):
 		house = self.factory.house
 		
 		if self.phase == 'normal':
-			for name in list(self.user.rooms):
-				room = house.lookup('room', name)
-				if reason is not None:
-					why = "%s: %s" % (why, reason)
-				room.part(self.user, 'quit', why)
-
+			if reason is not None:
+				why = "%s: %s" % (why, reason)
+			quits.shared().quit(self.user, why)
 			house.remove(self.user)
 			self.phase = 'quit'
 
@@ -113,59 +207,98 @@ class IRCTalker(LineOnlyReceiver):
 		self.transport.loseConnection()
 		self.quit(*args)
 
-	def checkPing(self):
-		"""Called every once and a while. Issues a ping if this client hasn't sent a command recently"""
-		now      = time.time()
-		duration = int (now - self.lastCmd)
-
-		if self.phase != 'normal':
-			self.tardy = None
-			return
+	def slow(self):
+		"""Called when this client's outbound queue overflows."""
+		if not self.closing:
+			self.closing = True
+			core.clock().callLater(0, self.disconnect, 'slow')
 
-		if self.tardy is not None:
-			self.sendMsg('BYE', 'ping')
-			self.disconnect('ping')
-			return
+	def target(self):
+		"""Who numerics are addressed to: our nick, or * before we have one."""
+		if hasattr(self, 'user'):
+			return self.user.name
+		return '*'
 
-		if duration > self.pingTime:
-			self.sendMsg('PING', 'foo')
-			self.tardy = 'foo'
+	def registered(self):
+		"""Whether we have a nick yet; if not, say so with 451."""
+		if hasattr(self, 'user'):
+			return True
+		self.sendRaw(':haver 451 * %s :You have not registered' % self.cmd, urgent = True)
+		return False
 
 	def S_FAIL(self, cmd, error, *rest):
 		if cmd == 'JOIN' and error == 'unknown.thing' and rest[0] in ['user', 'room']:
-			self.sendRaw(":haver 403 %s #%s :No such channel" % (self.user.name, rest[1]))
+			self.sendRaw(":haver 403 %s #%s :No such channel" % (self.target(), rest[1]), urgent = True)
 		elif error == 'unknown.thing':
-			self.sendRaw(":haver 401 %s %s :No such entity.  Please choose another" % (self.user.name, rest[1]))
+			self.sendRaw(":haver 401 %s %s :No such entity.  Please choose another" % (self.target(), rest[1]), urgent = True)
+		elif error == 'rate.limited':
+			# Clients are charged from their first line, before they have a nick.
+			self.sendRaw(":haver 263 %s %s :You are sending too fast; try again in %s seconds" %
+				(self.target(), cmd, rest[0]), urgent = True)
 		elif error == 'invalid.name':
-			self.sendRaw(":haver 432  %s :Your chosen identifier is invalid (Illegal characters)" % rest[0])
+			self.sendRaw(":haver 432  %s :Your chosen identifier is invalid (Illegal characters)" % rest[0], urgent = True)
 		else:
-			log.msg('unknown error: ' + error)
+			clients.limited(logger.WARN, error, 'No IRC rendering of failure %s', error)
 
 	def S_JOIN(self, rname, uname):
-		house = self.factory.house
-		self.sendRaw(':%s!%s@haver JOIN :#%s' % (uname, 'user', rname))
-		if (uname.lower() == self.user.name.lower()):
-			self.sendRaw(":haver 332 %s #%s :Haver" % (uname, rname))
-			room = house.lookup('room', rname)
-			users = ' '.join(map(lambda x: x.name, list(room.users)))
-			msg = ":haver 353 %s = #%s :%s" % (uname, rname, users)
-			self.sendRaw(msg)
-			self.sendRaw(':haver 366 %s #%s :End of NAMES feed.' % (uname, rname))
+		self.sendRaw(render_join(rname, uname))
+		self.names(rname, uname)
 
 	def S_PART(self, rname, uname, *rest):
-		self.sendRaw(':%s!user@haver PART #%s' % (uname, rname))
+		self.sendRaw(render_part(rname, uname))
 
 	def S_IN(self, rname, uname, kind, msg, *rest):
 		if (uname.lower() == self.user.name.lower()):
 			return
-		self.sendRaw(':%s!user@haver PRIVMSG #%s :%s' % (uname, rname, msg))
+		self.sendRaw(render_in(rname, uname, kind, msg), chat = True)
+
+	def F_JOIN(self, frame):
+		self.sendRaw(frame.view('irc', render_join))
+		self.names(*frame.args[0:2])
+
+	def F_PART(self, frame):
+		self.sendRaw(frame.view('irc', render_part))
+
+	def S_QUIT(self, uname, why, *rest):
+		self.sendRaw(render_quit(uname, why))
+
+	def F_QUIT(self, frame):
+		self.sendRaw(frame.view('irc', render_quit))
+
+	def F_IN(self, frame):
+		if (frame.args[1].lower() == self.user.name.lower()):
+			return
+		self.sendRaw(frame.view('irc', render_in), chat = True)
+
+	def names(self, rname, uname):
+		"""Send the NAMES feed for a room this client just joined."""
+		if (uname.lower() == self.user.name.lower()):
+			house = self.factory.house
+			self.sendRaw(":haver 332 %s #%s :Haver" % (uname, rname))
+			self.sendNames(house.lookup('room', rname))
+
+	def sendNames(self, room):
+		"""353 lines naming every member of room, then 366."""
+		nick  = self.user.name
+		lines = members(room).lines()
+		if len(nick) > NICKLEN:
+			lines = split(members(room), budget(nick, room.name))
+		head = ':haver 353 %s = #%s :' % (nick, room.name)
+		for line in lines:
+			self.sendRaw(head + line)
+		self.sendRaw(':haver 366 %s #%s :End of NAMES feed.' % (nick, room.name))
 	
+	def S_PING(self, token):
+		self.sendRaw('PING :' + token, urgent = True, flush = True)
+
+	def S_BYE(self, why, *rest):
+		self.sendRaw('ERROR :Closing link: ' + ' '.join((why,) + rest), urgent = True, flush = True)
+
 	def S_FROM(self, uname, kind, msg, *rest):
-		self.sendRaw(':%s!user@haver PRIVMSG %s :%s' % (uname, uname, msg))
+		self.sendRaw('%s PRIVMSG %s :%s' % (prefix(uname), self.user.name, msg), chat = True)
 
 	def irc_init(self):
 		house = self.factory.house
-		log.msg('irc init')
 		name, info = ('', dict())
 		try:
 			name, info = self.name, self.info
@@ -176,20 +309,29 @@ class IRCTalker(LineOnlyReceiver):
 		name = house.genname(root = name)
 		user = User(name, self)
 		self.user = user
-		user['address'] = self.addr.host
-		user['version'] = 'irc'
+		user.address = self.addr.host
+		user.version = 'irc'
 
 		if self.factory.ssl:
-			user['secure'] = 'yes'
+			user.secure = 'yes'
 		else:
-			user['secure'] = 'no'
+			user.secure = 'no'
 		
-		house.add(user)
+		try:
+			house.add(user)
+		except:
+			house.release(name)
+			raise
+		self.phase = 'normal'
 		self.sendRaw(':haver NOTICE %s :*** You will be known as %s' % (name, name))
 		self.sendRaw(':haver 001 %s :Welcome to the strange and perverse world of haver!' % name)
 
+	def spend(self, room):
+		"""Charge for writing to every member of room."""
+		flood = self.factory.flood
+		flood.charge(self, flood.fanout(room), self.lastCmd, room)
+
 	def C_NICK(self, name, *rest):
-		log.msg('got NICK')
 		if hasattr(self, 'name') or hasattr(self, 'user'):
 			pass
 		else:
@@ -209,13 +351,13 @@ class IRCTalker(LineOnlyReceiver):
 			kind = 'do'
 		if name[0] == '#':
 			room = house.lookup('room', name[1:])
+			self.spend(room)
 			room.sendMsg('IN', room.name, self.user.name, kind, msg)
 		else:
 			user = house.lookup('user', name)
-			room.sendMsg('FROM', user.name, kind, msg)
+			user.sendMsg('FROM', self.user.name, kind, msg)
 
 	def C_USER(self, user, host, server, real, *rest):
-		log.msg('got USER')
 		house = self.factory.house
 		self.info = dict(
 				username   = user,
@@ -228,8 +370,53 @@ class IRCTalker(LineOnlyReceiver):
 	def C_PING(self, s, *rest):
 		self.sendRaw(':haver PONG haver :' + s)
 
+	def C_PONG(self, *rest):
+		self.tardy = None
+
 	def C_JOIN(self, name, *rest):
 		house = self.factory.house
 		name = name[1:]
 		room = house.lookup('room', name)
+		if self.user in room.users:
+			raise Fail('strange.join')
+		self.spend(room)
 		room.join(self.user)
+
+	def C_NAMES(self, channels = '', *rest):
+		if not self.registered():
+			return
+		house = self.factory.house
+		for name in channels.split(','):
+			if name[:1] != '#':
+				continue
+			try:
+				room = house.lookup('room', name[1:])
+			except Fail:
+				self.sendRaw(':haver 366 %s %s :End of NAMES feed.' % (self.user.name, name))
+				continue
+			self.sendNames(room)
+
+	def C_WHO(self, mask = '', *rest):
+		if not self.registered():
+			return
+		house = self.factory.house
+		nick  = self.user.name
+		if mask[:1] == '#':
+			room    = house.lookup('room', mask[1:])
+			channel = '#' + room.name
+			people  = members(room)
+		else:
+			channel = '*'
+			people  = [ house.lookup('user', mask).name ]
+		for name in people:
+			self.sendRaw(':haver 352 %s %s user haver haver %s H :0 %s' % (nick, channel, name, name))
+		self.sendRaw(':haver 315 %s %s :End of WHO list.' % (nick, mask))
+
+	def C_LIST(self, *rest):
+		if not self.registered():
+			return
+		nick = self.user.name
+		self.sendRaw(':haver 321 %s Channel :Users  Name' % nick)
+		for room in self.factory.house.list('room'):
+			self.sendRaw(':haver 322 %s #%s %d :' % (nick, room.name, len(room.users)))
+		self.sendRaw(':haver 323 %s :End of LIST' % nick)
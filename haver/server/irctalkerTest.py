@@ -0,0 +1,118 @@
+#!/usr/bin/python
+import unittest
+from twisted.internet import address
+from twisted.test.proto_helpers import StringTransport
+from haver.server.house     import House
+from haver.server.thing     import Room, User
+from haver.server.names     import Names
+from haver.server.irctalker import IRCFactory
+from haver.server           import outbound
+
+class TestNames(unittest.TestCase):
+	def testChunksStayUnderBudget(self):
+		names = Names([ 'user%d' % i for i in range(100) ], 50)
+		lines = list(names.lines())
+		self.assertTrue(max(map(len, lines)) <= 50)
+		self.assertEqual(' '.join(lines).split(), [ 'user%d' % i for i in range(100) ])
+
+	def testIncremental(self):
+		names = Names(['al', 'bob'], 10)
+		self.assertEqual(list(names.lines()), ['al bob'])
+		names.add('carol')
+		names.discard('al')
+		self.assertEqual(list(names.lines()), ['bob', 'carol'])
+		self.assertEqual(sorted(names), ['bob', 'carol'])
+
+	def testPacksHoles(self):
+		names = Names([ 'u%02d' % i for i in range(60) ], 11)
+		for i in range(0, 60, 3):
+			names.discard('u%02d' % i)
+		self.assertTrue(len(names.chunks) <= 2 * (names.used // 11) + 2)
+		self.assertEqual(len(names), 40)
+
+class TestIRC(unittest.TestCase):
+	def setUp(self):
+		self.house   = House('test')
+		self.room    = Room('main')
+		self.house.add(self.room)
+		self.factory = IRCFactory(self.house)
+		for i in range(300):
+			user = User('member%03d' % i, None)
+			self.house.add(user)
+			self.room.admit(user)
+
+	def connect(self, nick):
+		transport = StringTransport(peerAddress = address.IPv4Address('TCP', '10.0.0.1', 1))
+		talker    = self.factory.buildProtocol(transport.getPeer())
+		talker.makeConnection(transport)
+		self.send(talker, "NICK %s" % nick, "USER %s h s :real" % nick)
+		transport.clear()
+		return talker
+
+	def send(self, talker, *lines):
+		for line in lines:
+			talker.dataReceived(line + "\r\n")
+		outbound.shared().flush()
+		data = talker.transport.value()
+		talker.transport.clear()
+		return data.split("\r\n")[:-1]
+
+	def testFloodBeforeRegistering(self):
+		transport = StringTransport(peerAddress = address.IPv4Address('TCP', '10.0.0.1', 1))
+		talker    = self.factory.buildProtocol(transport.getPeer())
+		talker.makeConnection(transport)
+		lines = self.send(talker, *["NICK bad!name"] * 60)
+		self.assertTrue(":haver 263 * NICK :You are sending too fast; try again in 0.1 seconds" in lines)
+		self.assertTrue(transport.disconnecting)
+
+	def testQueriesBeforeRegistering(self):
+		transport = StringTransport(peerAddress = address.IPv4Address('TCP', '10.0.0.1', 1))
+		talker    = self.factory.buildProtocol(transport.getPeer())
+		talker.makeConnection(transport)
+		lines = self.send(talker, "NAMES #main", "WHO #main", "LIST")
+		self.assertEqual(lines, [ ':haver 451 * %s :You have not registered' % x for x in ('NAMES', 'WHO', 'LIST') ])
+
+	def testJoinSendsChunkedNames(self):
+		bob   = self.connect('bob')
+		lines = self.send(bob, "JOIN #main")
+		names = [ x for x in lines if ' 353 ' in x ]
+		self.assertTrue(len(names) > 1)
+		self.assertTrue(max(map(len, names)) + 2 <= 512)
+		said = ' '.join([ x.split(' :', 1)[1] for x in names ]).split()
+		self.assertEqual(sorted(said), sorted([ x.name for x in self.room.users ]))
+		self.assertTrue(lines[-1].startswith(':haver 366 bob #main'))
+
+	def testNamesFollowMembership(self):
+		bob = self.connect('bob')
+		self.send(bob, "JOIN #main")
+		self.room.evict(self.house.lookup('user', 'member007'))
+		lines = self.send(bob, "NAMES #main")
+		said  = ' '.join([ x.split(' :', 1)[1] for x in lines if ' 353 ' in x ]).split()
+		self.assertTrue('member007' not in said)
+		self.assertTrue('bob' in said)
+		self.assertEqual(len(said), 300)
+
+	def testWhoAndList(self):
+		bob   = self.connect('bob')
+		lines = self.send(bob, "WHO #main")
+		self.assertEqual(len([ x for x in lines if ' 352 ' in x ]), 300)
+		lines = self.send(bob, "LIST")
+		self.assertTrue(':haver 322 bob #main 300 :' in lines)
+
+	def testPartAll(self):
+		bob  = self.connect('bob')
+		self.send(bob, "JOIN #main")
+		gone = [ self.house.lookup('user', 'member%03d' % i) for i in (1, 2, 3) ]
+		self.assertEqual(self.room.partAll(gone + gone[:1], 'kick', 'bob'), gone)
+		self.assertEqual(self.send(bob), [ ':member%03d!user@haver PART #main' % i for i in (1, 2, 3) ])
+		self.assertEqual(len(self.room.names), 298)
+		self.assertEqual(self.room.partAll(gone, 'kick', 'bob'), [])
+
+	def testPrivateMessage(self):
+		bob = self.connect('bob')
+		al  = self.connect('al')
+		self.send(bob, "PRIVMSG al :hi there")
+		self.assertEqual(self.send(al), [':bob!user@haver PRIVMSG al :hi there'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+"""Rooms that outlive the server.
+
+A Journal watches a house and appends a haver.protocol line to a file for
+every change to its rooms:
+
+	ROOM   name owner secure history
+	CLOSE  name
+	SET    name key value
+
+Each record gives the whole new state of what it touches, so replaying a
+record twice does no harm. Every so often the journal is folded into a
+snapshot (path + '.snapshot', ROOM lines only) and truncated. Users are not
+journaled; they go away with their connections.
+
+The reactor only hands records to a writer thread, which does the writing,
+fsyncing and compacting, so a slow disk never holds up clients."""
+
+import os, gc, time, threading
+from twisted.python      import log
+from twisted.application import service
+
+from haver.server.thing import Room
+from haver.protocol     import parse, deparse
+
+FIELDS = dict(owner = 1, secure = 2, history = 3)
+
+def load(path):
+	"""Fold the snapshot and journal at path into [name, owner, secure, history] lists.
+	Also returns how many whole records the journal held and their length."""
+	rooms   = dict()
+	records = 0
+	size    = 0
+	for name in (path + '.snapshot', path):
+		try:
+			f = open(name, 'rb')
+		except IOError:
+			continue
+		try:
+			data = f.read()
+		finally:
+			f.close()
+		lines = data.split("\n")
+		# Either empty or a record that was torn off by a crash.
+		torn = lines.pop()
+		if name == path:
+			records = len(lines)
+			size    = len(data) - len(torn)
+		for line in lines:
+			cmd, args = parse(line)
+			key = args[0].lower()
+			if cmd == 'ROOM':
+				rooms[key] = args + ['no'] * (4 - len(args))
+			elif cmd == 'CLOSE':
+				rooms.pop(key, None)
+			elif cmd == 'SET' and key in rooms and args[1] in FIELDS:
+				rooms[key][FIELDS[args[1]]] = args[2]
+	return rooms.values(), records, size
+
+class Journal(service.Service):
+	"""Restores house's rooms from path, then records every change to them.
+
+	interval is how many seconds the writer waits between batches, and so
+	between fsyncs; 0 writes and fsyncs each batch as soon as it is handed
+	over, and None never fsyncs, leaving it to the OS. After compact records
+	the journal is folded into the snapshot."""
+
+	def __init__(self, house, path, interval = 1.0, compact = 100000):
+		self.path     = path
+		self.interval = interval
+		self.compact  = compact
+		self.pending  = []
+		self.stopping = False
+		self.lock     = threading.Condition()
+		self.thread   = None
+
+		# Collecting garbage while creating this many objects costs more
+		# than creating them.
+		enabled = gc.isenabled()
+		gc.disable()
+		try:
+			rooms, self.records, size = load(path)
+			things = []
+			for name, owner, secure, history in rooms:
+				room = Room(name, owner, secure)
+				if history != 'no':
+					room.history = history
+				things.append(room)
+			house.restore(things)
+		finally:
+			if enabled:
+				gc.enable()
+		self.file = open(path, 'ab')
+		self.file.truncate(size)
+		house.observers.append(self)
+
+	def record(self, *msg):
+		line = deparse(msg[0], msg[1:]) + "\n"
+		self.lock.acquire()
+		try:
+			self.pending.append(line)
+			self.lock.notify()
+		finally:
+			self.lock.release()
+
+	def added(self, thing):
+		if thing.namespace == 'room':
+			self.record('ROOM', thing.name, thing.owner, thing.secure, thing.history)
+
+	def removed(self, thing):
+		if thing.namespace == 'room':
+			self.record('CLOSE', thing.name)
+
+	def changed(self, thing, key):
+		if thing.namespace == 'room' and key in FIELDS:
+			self.record('SET', thing.name, key, thing[key])
+
+	def broadcast(self, room, frame):
+		pass
+
+	def startService(self):
+		service.Service.startService(self)
+		self.thread = threading.Thread(target = self.run, name = 'journal')
+		self.thread.setDaemon(True)
+		self.thread.start()
+
+	def stopService(self):
+		"""Write out everything recorded so far and stop the writer."""
+		service.Service.stopService(self)
+		self.lock.acquire()
+		try:
+			self.stopping = True
+			self.lock.notify()
+		finally:
+			self.lock.release()
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+		else:
+			self.write(self.take())
+		self.file.close()
+
+	def take(self):
+		lines, self.pending = self.pending, []
+		return lines
+
+	def run(self):
+		while True:
+			self.lock.acquire()
+			try:
+				while not self.pending and not self.stopping:
+					self.lock.wait()
+				lines    = self.take()
+				stopping = self.stopping
+			finally:
+				self.lock.release()
+			try:
+				self.write(lines)
+			except (IOError, OSError), e:
+				log.msg('Journal %s: %s' % (self.path, e))
+			if stopping:
+				break
+			if self.interval:
+				self.rest()
+
+	def rest(self):
+		"""Let the next batch build up, unless we are told to stop."""
+		deadline = time.time() + self.interval
+		self.lock.acquire()
+		try:
+			while not self.stopping and time.time() < deadline:
+				self.lock.wait(deadline - time.time())
+		finally:
+			self.lock.release()
+
+	def write(self, lines):
+		if not lines:
+			return
+		self.file.writelines(lines)
+		self.file.flush()
+		if self.interval is not None:
+			os.fsync(self.file.fileno())
+		self.records = self.records + len(lines)
+		if self.records >= self.compact:
+			self.fold()
+
+	def fold(self):
+		"""Replace the snapshot with the snapshot and journal combined, and
+		empty the journal."""
+		rooms, records, size = load(self.path)
+		snapshot = self.path + '.snapshot'
+		f = open(snapshot + '.new', 'wb')
+		try:
+			f.writelines([ deparse('ROOM', room) + "\n" for room in rooms ])
+			f.flush()
+			os.fsync(f.fileno())
+		finally:
+			f.close()
+		os.rename(snapshot + '.new', snapshot)
+		self.file.close()
+		self.file    = open(self.path, 'wb')
+		self.records = 0
+		log.msg('Journal %s compacted to %d rooms' % (self.path, len(rooms)))
@@ -0,0 +1,45 @@
+#!/usr/bin/python
+"""Benchmark for warm restart from a journal: a snapshot of many rooms plus
+a tail of changes since, loaded into a fresh house.
+
+	python journalBench.py [rooms] [tail]
+"""
+import sys, os, time, tempfile, shutil
+from haver.server.house   import House
+from haver.server.thing   import Room
+from haver.server.journal import Journal
+
+def main(rooms, tail):
+	dir  = tempfile.mkdtemp()
+	path = os.path.join(dir, 'haverd.journal')
+	try:
+		house   = House('bench')
+		journal = Journal(house, path, None, rooms)
+		start   = time.time()
+		for i in xrange(rooms):
+			house.add(Room('room%d' % i, 'owner%d' % (i % 100)))
+		for i in xrange(tail):
+			room = house.lookup('room', 'room%d' % i)
+			room.secure = 'yes'
+			house.changed(room, 'secure')
+		elapsed = time.time() - start
+		journal.stopService()
+		print "record   %7d records %8.3fs" % (rooms + tail, elapsed)
+
+		start   = time.time()
+		house   = House('bench')
+		journal = Journal(house, path)
+		elapsed = time.time() - start
+		journal.stopService()
+		print "restore  %7d rooms %7d tail %8.3fs" % (len(house.lookup_namespace('room')), tail, elapsed)
+	finally:
+		shutil.rmtree(dir)
+
+if __name__ == '__main__':
+	rooms = 100000
+	tail  = 10000
+	if len(sys.argv) > 1:
+		rooms = int(sys.argv[1])
+	if len(sys.argv) > 2:
+		tail = int(sys.argv[2])
+	main(rooms, tail)
@@ -0,0 +1,73 @@
+#!/usr/bin/python
+import unittest, os, tempfile, shutil
+from haver.server.house   import House
+from haver.server.thing   import Room, User
+from haver.server.journal import Journal
+
+class TestJournal(unittest.TestCase):
+	def setUp(self):
+		self.dir  = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, 'haverd.journal')
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def open(self, compact = 100000):
+		house   = House('test')
+		journal = Journal(house, self.path, 0, compact)
+		journal.startService()
+		return house, journal
+
+	def rooms(self, house):
+		rooms = house.lookup_namespace('room').values()
+		return sorted([ (x.name, x['owner'], x['secure']) for x in rooms ])
+
+	def mutate(self, house):
+		for name in ['main', 'Lobby', 'dev', 'gone']:
+			house.add(Room(name, 'bob'))
+		house.add(User('bob', None))
+		room = house.lookup('room', 'dev')
+		room['secure'] = 'yes'
+		house.changed(room, 'secure')
+		room['owner'] = 'al'
+		house.changed(room, 'owner')
+		house.remove(house.lookup('room', 'gone'))
+
+	def testRestore(self):
+		house, journal = self.open()
+		self.mutate(house)
+		expected = self.rooms(house)
+		journal.stopService()
+		house, journal = self.open()
+		self.assertEqual(self.rooms(house), expected)
+		self.assertEqual(house.lookup_namespace('user'), {})
+		journal.stopService()
+
+	def testCompact(self):
+		house, journal = self.open(compact = 3)
+		self.mutate(house)
+		house.add(Room('late'))
+		expected = self.rooms(house)
+		journal.stopService()
+		self.assertTrue(os.path.exists(self.path + '.snapshot'))
+		self.assertTrue(os.path.getsize(self.path) < 40)
+		house, journal = self.open()
+		self.assertEqual(self.rooms(house), expected)
+		journal.stopService()
+
+	def testTornRecord(self):
+		house, journal = self.open()
+		house.add(Room('main'))
+		journal.stopService()
+		f = open(self.path, 'ab')
+		f.write("ROOM\tha")
+		f.close()
+		house, journal = self.open()
+		house.add(Room('later'))
+		journal.stopService()
+		house, journal = self.open()
+		self.assertEqual([ x[0] for x in self.rooms(house) ], ['later', 'main'])
+		journal.stopService()
+
+if __name__ == '__main__':
+    unittest.main()
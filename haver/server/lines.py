@@ -0,0 +1,58 @@
+"""Line framing for the talkers.
+
+LineBatchReceiver splits each read once and hands every complete line in
+it to linesReceived together, so a client that sends a burst of commands
+in one packet costs one call rather than one per line. A partial line is
+kept only while it could still become a line of at most MAX_LENGTH bytes;
+one that cannot is refused before it is copied into the buffer."""
+
+from twisted.internet import protocol
+
+class LineBatchReceiver(protocol.Protocol):
+	delimiter  = "\n"
+	MAX_LENGTH = 16384
+	_buffer    = ''
+
+	def dataReceived(self, data):
+		delimiter = self.delimiter
+		if self._buffer:
+			# Only join the two if the line they start can still be short enough.
+			end = data.find(delimiter)
+			if end < 0:
+				end = len(data)
+			if len(self._buffer) + end > self.MAX_LENGTH:
+				line, self._buffer = (self._buffer, '')
+				return self.lineLengthExceeded(line)
+			data = self._buffer + data
+			self._buffer = ''
+		lines = data.split(delimiter)
+		rest  = lines.pop()
+		if len(data) - len(rest) > self.MAX_LENGTH:
+			for i in xrange(len(lines)):
+				if len(lines[i]) > self.MAX_LENGTH:
+					if i:
+						self.linesReceived(lines[:i])
+					return self.lineLengthExceeded(lines[i])
+		if lines:
+			self.linesReceived(lines)
+		if len(rest) > self.MAX_LENGTH:
+			return self.lineLengthExceeded(rest)
+		if rest and not self.transport.disconnecting:
+			self._buffer = rest
+
+	def linesReceived(self, lines):
+		"""Called with the complete lines of one read, in order."""
+		transport = self.transport
+		for line in lines:
+			if transport.disconnecting:
+				return
+			self.lineReceived(line)
+
+	def lineReceived(self, line):
+		raise NotImplementedError
+
+	def sendLine(self, line):
+		return self.transport.write(line + self.delimiter)
+
+	def lineLengthExceeded(self, line):
+		return self.transport.loseConnection()
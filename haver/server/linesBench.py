@@ -0,0 +1,69 @@
+#!/usr/bin/python
+"""Benchmark for a pipelining client: one logged in talker is sent bursts
+of commands, burst lines to a read, and the commands run a second, from
+the fastest read, are reported for a few kinds of command. Outbound
+queues are flushed after every read, and flood control is off but for
+FLOOD, where every command is refused as rate.limited.
+
+	python linesBench.py [burst] [reads]
+"""
+import sys, time
+from haver.server.house     import House
+from haver.server.thing     import Room
+from haver.server.talker    import HaverFactory
+from haver.server.irctalker import IRCFactory
+from haver.server.flood     import Flood, UNLIMITED
+from haver.server           import outbound
+from haver.server.thingBench import Transport
+
+KINDS = [
+	('POKE',  "POKE\tbot\n"),
+	('IN',    "IN\tmain\tsay\thello there, this is a bot\n"),
+	('MARK',  "IN\tmain\tsay\tunread \x1bt marks\n"),
+	('IRC',   "PRIVMSG #main :hello there, this is a bot\r\n"),
+	# A bot past its flood limit, whose every command is refused.
+	('FLOOD', "IN\tmain\tsay\tunread \x1bt marks, and more of them\n"),
+]
+
+def talker(irc, flood = UNLIMITED):
+	house = House('bench')
+	house.add(Room('main'))
+	if irc:
+		factory = IRCFactory(house, flood = flood)
+	else:
+		factory = HaverFactory(house, flood = flood)
+	transport = Transport(1)
+	talker    = factory.buildProtocol(transport.peer)
+	talker.makeConnection(transport)
+	if irc:
+		talker.dataReceived("NICK bot\r\nUSER bot h s :Bot\r\nJOIN #main\r\n")
+	else:
+		talker.dataReceived("HAVER\tbench/1\nIDENT\tbot\nJOIN\tmain\n")
+	return talker
+
+def fastest(bot, data, reads):
+	"""The shortest time a read took, which is the least disturbed by
+	whatever else is running."""
+	flush = outbound.shared().flush
+	best  = None
+	for i in xrange(reads):
+		start = time.time()
+		bot.dataReceived(data)
+		flush()
+		took = time.time() - start
+		if best is None or took < best:
+			best = took
+	return best
+
+def main(burst, reads):
+	for name, line in KINDS:
+		if name == 'FLOOD':
+			bot = talker(False, Flood(rate = 1e-9, burst = 3.0, strikes = sys.maxint))
+		else:
+			bot = talker(name == 'IRC')
+		took = fastest(bot, line * burst, reads)
+		print "%-5s %4d lines a read %9.0f commands/s" % (name, burst, burst / took)
+
+if __name__ == '__main__':
+	args = [ int(x) for x in sys.argv[1:] ]
+	main(*(args + [100, 2000][len(args):]))
@@ -0,0 +1,49 @@
+#!/usr/bin/python
+import unittest
+from twisted.test.proto_helpers import StringTransport
+from haver.server.lines import LineBatchReceiver
+
+class Receiver(LineBatchReceiver):
+	MAX_LENGTH = 10
+
+	def __init__(self):
+		self.batches  = []
+		self.exceeded = []
+
+	def linesReceived(self, lines):
+		self.batches.append(lines)
+
+	def lineLengthExceeded(self, line):
+		self.exceeded.append(line)
+		self.transport.loseConnection()
+
+class TestLines(unittest.TestCase):
+	def setUp(self):
+		self.receiver = Receiver()
+		self.receiver.makeConnection(StringTransport())
+
+	def testBatches(self):
+		self.receiver.dataReceived("a\nbb\nc")
+		self.receiver.dataReceived("cc\n\ndd")
+		self.assertEqual(self.receiver.batches, [['a', 'bb'], ['ccc', '']])
+		self.assertEqual(self.receiver._buffer, 'dd')
+
+	def testLongPartialRefused(self):
+		self.receiver.dataReceived("a\n" + "x" * 11)
+		self.assertEqual(self.receiver.batches, [['a']])
+		self.assertEqual(self.receiver.exceeded, ["x" * 11])
+		self.assertEqual(self.receiver._buffer, '')
+
+	def testNotJoinedOnceTooLong(self):
+		self.receiver.dataReceived("x" * 8)
+		self.receiver.dataReceived("y" * 3 + "\nz\n")
+		self.assertEqual(self.receiver.exceeded, ["x" * 8])
+		self.assertEqual(self.receiver.batches, [])
+
+	def testLongLineInBatch(self):
+		self.receiver.dataReceived("a\n" + "x" * 11 + "\nb\n")
+		self.assertEqual(self.receiver.batches, [['a']])
+		self.assertEqual(self.receiver.exceeded, ["x" * 11])
+
+if __name__ == '__main__':
+    unittest.main()
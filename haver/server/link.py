@@ -0,0 +1,325 @@
+"""Links between server processes that share one logical House.
+
+Every process keeps a full copy of the house. A Mesh watches the local house
+and tells the other end of each link about every change to it, one
+haver.protocol line per change:
+
+	USER   name secure address version stamp node
+	                                     a user logged in to node at stamp
+	QUIT   name                          a user logged out
+	ROOM   name owner secure             a room was opened
+	CLOSE  name                          a room was closed
+	SET    room key value                a room's owner, secure or history flag changed
+	MEMBER room user                     user is in room (sent when syncing)
+	CAST   room cmd args...              a frame was sent to the room's members
+	SEND   user cmd args...              a message for one user
+	KILL   user reason                   disconnect a user that lost its name
+	SYNCED                               everything the sender knew has been sent
+
+Federated nodes also say PEER and BYE; see haver.server.peertalker.
+
+Processes are linked in a star: workers each have one link, to the
+coordinator, and the coordinator passes what it hears from one worker on to
+the others. The coordinator's house is the authoritative one; when two
+workers claim the same name the first claim it hears wins and the other
+worker is told to KILL its user. Federated nodes are linked in a tree and
+pass on what they hear the same way."""
+
+from twisted.python            import log
+from twisted.protocols.basic   import LineOnlyReceiver
+from twisted.internet.protocol import Factory, ReconnectingClientFactory
+
+from haver.server.errors import Fail
+from haver.server.thing  import User, Room
+from haver.server        import quits
+from haver.protocol      import parse, deparse
+
+class RemoteUser(User):
+	"""A user whose connection belongs to the process at the other end of link."""
+	__slots__ = ('link', 'node')
+
+	def __init__(self, name, link, stamp, node):
+		User.__init__(self, name, None)
+		self.link  = link
+		self.stamp = float(stamp)
+		self.node  = node
+
+	def sendMsg(self, *msg):
+		self.link.send('SEND', self.name, *msg)
+
+	# sendFrame is inherited and does nothing: the process that owns the
+	# connection writes room frames itself when it gets the CAST.
+
+def owner(thing):
+	"""The link a user came in on, or None for local users and rooms."""
+	return getattr(thing, 'link', None)
+
+def home(user):
+	"""The server a user is logged in to."""
+	return user.node or user.house.host
+
+def describe(thing):
+	if thing.namespace == 'user':
+		return ('USER', thing.name, thing.secure, thing.address, thing.version,
+			'%.6f' % thing.stamp, home(thing))
+	else:
+		return ('ROOM', thing.name, thing.owner, thing.secure)
+
+class Mesh(object):
+	"""Keeps the other processes' copies of a house up to date.
+
+	Nothing is sent back over the link a change came in on. With authority
+	set, this is the coordinator and settles name collisions."""
+
+	def __init__(self, house, authority = False):
+		self.house     = house
+		self.authority = authority
+		self.links     = []
+		self.ready     = []
+		house.observers.append(self)
+
+	def peers(self):
+		origin = self.house.origin
+		return [ x for x in self.links if x is not origin ]
+
+	def attach(self, link):
+		"""Start sharing the house with a newly connected process."""
+		self.links.append(link)
+		self.sync(link)
+
+	def detach(self, link):
+		"""Forget everyone who was logged in through a lost link."""
+		self.links.remove(link)
+		house = self.house
+		house.origin = link
+		try:
+			for user in house.lookup_namespace('user').values():
+				if owner(user) is link:
+					self.drop(user, 'netsplit')
+		finally:
+			house.origin = None
+
+	def drop(self, user, why):
+		"""Remove a remote user, telling local members of its rooms."""
+		quits.shared().quit(user, why)
+		self.house.remove(user)
+
+	def sync(self, link):
+		"""Send link everything we know that did not come from it."""
+		house = self.house
+		rooms = house.lookup_namespace('room').values()
+		users = [ x for x in house.lookup_namespace('user').values() if owner(x) is not link ]
+		for room in rooms:
+			link.send(*describe(room))
+			if room.history != 'no':
+				link.send('SET', room.name, 'history', room.history)
+		for user in users:
+			link.send(*describe(user))
+			for room in user.rooms:
+				link.send('MEMBER', room.name, user.name)
+		link.send('SYNCED')
+
+	def synced(self, link):
+		"""Called when link has sent us everything it knows."""
+		ready, self.ready = self.ready, []
+		for func in ready:
+			func()
+
+	def added(self, thing):
+		msg = describe(thing)
+		for link in self.peers():
+			link.send(*msg)
+
+	def removed(self, thing):
+		if thing.namespace == 'user':
+			msg = ('QUIT', thing.name)
+		else:
+			msg = ('CLOSE', thing.name)
+		for link in self.peers():
+			link.send(*msg)
+
+	def changed(self, thing, key):
+		if thing.namespace == 'room':
+			for link in self.peers():
+				link.send('SET', thing.name, key, thing[key])
+
+	def member(self, room, user):
+		for link in self.peers():
+			link.send('MEMBER', room.name, user.name)
+
+	def broadcast(self, room, frame):
+		"""Pass a room frame on. Every process needs JOIN and PART to keep
+		membership right; anything else only goes where the room has members."""
+		if frame.cmd == 'JOIN' or frame.cmd == 'PART':
+			links = self.peers()
+		else:
+			links = set()
+			for user in room.users:
+				link = owner(user)
+				if link is not None:
+					links.add(link)
+			links.discard(self.house.origin)
+			if not links:
+				return
+		line = frame.view('link', lambda *args: deparse('CAST', (room.name, frame.cmd) + args))
+		for link in links:
+			link.sendLine(line)
+
+def shared(house):
+	"""Return the Mesh keeping house's copies elsewhere up to date, creating
+	one if there is none yet."""
+	for observer in house.observers:
+		if isinstance(observer, Mesh):
+			return observer
+	return Mesh(house)
+
+class LinkTalker(LineOnlyReceiver):
+	delimiter  = "\n"
+	MAX_LENGTH = 1 << 20
+
+	def connectionMade(self):
+		self.mesh  = self.factory.mesh
+		self.house = self.mesh.house
+		log.msg('Linked to %s' % str(self.transport.getPeer()))
+		self.mesh.attach(self)
+
+	def connectionLost(self, reason):
+		log.msg('Lost link to %s' % str(self.transport.getPeer()))
+		self.mesh.detach(self)
+
+	def send(self, cmd, *args):
+		self.sendLine(deparse(cmd, args))
+
+	def lineReceived(self, line):
+		cmd, args = parse(line)
+		house = self.house
+		house.origin = self
+		try:
+			try:
+				f = getattr(self, 'L_' + cmd, None)
+				if f is None:
+					log.msg('Unknown link command %s' % cmd)
+				else:
+					f(*args)
+			except Fail, failure:
+				log.msg('Link command %s failed with failure %s (%s)' % (cmd, failure.name, str(failure.args)))
+		finally:
+			house.origin = None
+
+	def owns(self, user):
+		return owner(user) is self
+
+	def L_USER(self, name, secure, address, version, stamp, node):
+		user = RemoteUser(name, self, stamp, node)
+		user.secure  = secure
+		user.address = address
+		user.version = version
+		try:
+			self.house.add(user)
+		except Fail, f:
+			if f.name != 'existing.thing' or not self.mesh.authority:
+				raise
+			# Someone else got there first. Their user is resent after the KILL
+			# so that the loser's process learns about it.
+			self.send('KILL', name, 'collision')
+			winner = self.house.lookup('user', name)
+			self.send(*describe(winner))
+			for room in winner.rooms:
+				self.send('MEMBER', room.name, winner.name)
+
+	def L_QUIT(self, name):
+		house = self.house
+		user  = house.lookup('user', name)
+		if not self.owns(user):
+			return
+		for room in list(user.rooms):
+			room.evict(user)
+		house.remove(user)
+
+	def L_KILL(self, name, reason):
+		user = self.house.lookup('user', name)
+		if user.talker is not None:
+			user.talker.disconnect(reason)
+
+	def L_ROOM(self, name, owner, secure):
+		house = self.house
+		try:
+			room = house.lookup('room', name)
+		except Fail:
+			house.add(Room(name, owner, secure))
+			return
+		if self.mesh.authority:
+			self.send(*describe(room))
+		else:
+			self.L_SET(name, 'owner', owner)
+			self.L_SET(name, 'secure', secure)
+
+	def L_CLOSE(self, name):
+		house = self.house
+		room  = house.lookup('room', name)
+		room.partAll(list(room.users), 'close')
+		house.remove(room)
+
+	def L_SET(self, name, key, value):
+		if key not in ('owner', 'secure', 'history'):
+			raise Fail('unknown.infokey', 'room', name, key)
+		room = self.house.lookup('room', name)
+		room[key] = value
+		self.house.changed(room, key)
+
+	def L_MEMBER(self, rname, uname):
+		house = self.house
+		room  = house.lookup('room', rname)
+		user  = house.lookup('user', uname)
+		if self.owns(user) and user not in room.users:
+			room.admit(user)
+			self.mesh.member(room, user)
+
+	def L_CAST(self, rname, cmd, *args):
+		house = self.house
+		room  = house.lookup('room', rname)
+		if cmd == 'JOIN':
+			user = house.lookup('user', args[1])
+			if self.owns(user) and user not in room.users:
+				room.join(user, *args[2:])
+		elif cmd == 'PART':
+			user = house.lookup('user', args[1])
+			# Users leave of their own accord only through the process that
+			# owns them; kicks, closes and the like can come from anywhere.
+			if args[2:3] in (('normal',), ('quit',)) and not self.owns(user):
+				return
+			if user not in room.users:
+				return
+			if args[2:3] == ('quit',):
+				quits.shared().part(room, user, (args[3:4] or ('',))[0])
+			else:
+				room.part(user, *args[2:])
+		else:
+			room.sendMsg(cmd, *args)
+
+	def L_SEND(self, name, cmd, *args):
+		user = self.house.lookup('user', name)
+		if not self.owns(user):
+			user.sendMsg(cmd, *args)
+
+	def L_SYNCED(self):
+		self.mesh.synced(self)
+
+class LinkFactory(Factory):
+	"""Accepts links from worker processes."""
+	protocol = LinkTalker
+
+	def __init__(self, mesh):
+		self.mesh = mesh
+
+class LinkClientFactory(ReconnectingClientFactory):
+	"""Keeps a worker process linked to its coordinator."""
+	protocol = LinkTalker
+	maxDelay = 10
+
+	def __init__(self, mesh):
+		self.mesh = mesh
+
+	def buildProtocol(self, addr):
+		self.resetDelay()
+		return ReconnectingClientFactory.buildProtocol(self, addr)
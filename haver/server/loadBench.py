@@ -0,0 +1,484 @@
+#!/usr/bin/python
+"""Load generator: starts a HaverFactory and an IRCFactory in this process
+and drives them with many simulated clients, over loopback TCP or, with
+--memory, over in-memory pipes that hand data over once per reactor
+iteration. Clients and server share one loop and one CPU, so the numbers
+are for comparing runs, not absolute capacity. --core picks the loop,
+twisted's reactor or haver.server.selectcore; run both to compare them.
+
+	python loadBench.py [-c CLIENTS] [--irc FRACTION] [--memory] [--core CORE] [-o FILE] [scenario ...]
+
+Scenarios (all of them if none are named):
+
+	login       every client connects and logs in at once
+	join        every logged in client joins one room at once
+	chatty      --senders members of a room of every client each say
+	            --messages things at once
+	pm          every Haver client sends --messages private messages to
+	            random other clients
+	disconnect  half the members of a room of every client hang up at once
+
+Each scenario starts a fresh server. For every one, the rate is the lines
+its clients got per second, and latency is from when a line was caused (the
+time stamp in a message, or when the client connected, joined, or the
+hangups began) to when a client read it. Results are saved as JSON to -o."""
+
+import sys, time, random, resource
+from optparse import OptionParser
+
+from twisted.internet          import defer, task, address, error
+from twisted.internet.protocol import ClientFactory
+from twisted.protocols.basic   import LineOnlyReceiver
+from twisted.python            import failure
+
+from haver.server.house     import House
+from haver.server.thing     import Room
+from haver.server.talker    import HaverFactory
+from haver.server.irctalker import IRCFactory
+from haver.server.flood     import UNLIMITED
+from haver.server           import core
+import haver.protocol
+
+# The loop everything runs on, picked by --core.
+loop = None
+
+class Run(object):
+	"""Counts the lines of one kind that clients read, until expected of
+	them have arrived or timeout seconds have passed."""
+
+	def __init__(self, kind, expected, timeout):
+		self.kind      = kind
+		self.expected  = expected
+		self.count     = 0
+		self.latencies = []
+		self.done      = defer.Deferred()
+		self.start     = time.time()
+		self.end       = None
+		self.call      = loop.callLater(timeout, self.finish)
+		if expected == 0:
+			self.finish()
+
+	def got(self, sent):
+		self.count = self.count + 1
+		if sent is not None:
+			self.latencies.append(time.time() - sent)
+		if self.count >= self.expected:
+			self.finish()
+
+	def finish(self):
+		if self.end is None:
+			self.end = time.time()
+			if self.call.active():
+				self.call.cancel()
+			self.done.callback(self)
+
+	def result(self):
+		seconds   = max(self.end - self.start, 1e-6)
+		latencies = sorted(self.latencies)
+		def percentile(p):
+			if not latencies:
+				return None
+			return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 3)
+		return dict(
+			messages = self.count,
+			expected = self.expected,
+			lost     = self.expected - self.count,
+			seconds  = round(seconds, 4),
+			rate     = round(self.count / seconds, 1),
+			p50_ms   = percentile(0.50),
+			p99_ms   = percentile(0.99),
+		)
+
+def stamp():
+	return '%.6f' % time.time()
+
+def sent(msg):
+	"""The time stamp a load client put at the start of msg."""
+	try:
+		return float(msg.split(' ', 1)[0])
+	except ValueError:
+		return None
+
+class HaverClient(LineOnlyReceiver):
+	delimiter = "\n"
+	irc       = False
+	MAX_LENGTH = 1 << 20
+
+	def __init__(self, load, name):
+		self.load    = load
+		self.name    = name
+		self.started = None
+		self.joining = None
+
+	def connectionMade(self):
+		self.sendLine("HAVER\tload/1")
+		self.sendLine("IDENT\t" + self.name)
+
+	def send(self, cmd, *args):
+		self.sendLine(haver.protocol.deparse(cmd, args))
+
+	def join(self, room):
+		self.joining = time.time()
+		self.send('JOIN', room)
+
+	def say(self, room):
+		self.send('IN', room, 'say', stamp() + ' hello')
+
+	def to(self, name):
+		self.send('TO', name, 'say', stamp() + ' psst')
+
+	def lineReceived(self, line):
+		cmd, args = haver.protocol.parse(line)
+		load = self.load
+		if cmd == 'IN':
+			load.event('in', sent(args[3]))
+		elif cmd == 'JOIN':
+			if args[1] == self.name:
+				load.event('join', self.joining)
+			else:
+				load.event('join', None)
+		elif cmd == 'PART' or cmd == 'QUIT':
+			load.event('part', load.run and load.run.start)
+		elif cmd == 'FROM':
+			load.event('from', sent(args[2]))
+		elif cmd == 'HELLO':
+			load.event('hello', self.started)
+		elif cmd == 'PING':
+			self.send('PONG', *args)
+		elif cmd == 'FAIL':
+			load.failures = load.failures + 1
+
+class IRCClient(LineOnlyReceiver):
+	delimiter = "\r\n"
+	irc       = True
+	MAX_LENGTH = 1 << 20
+
+	def __init__(self, load, name):
+		self.load    = load
+		self.name    = name
+		self.started = None
+		self.joining = None
+
+	def connectionMade(self):
+		self.sendLine("NICK " + self.name)
+		self.sendLine("USER %s load haver :Load" % self.name)
+
+	def join(self, room):
+		self.joining = time.time()
+		self.sendLine("JOIN #" + room)
+
+	def say(self, room):
+		self.sendLine("PRIVMSG #%s :%s hello" % (room, stamp()))
+
+	def lineReceived(self, line):
+		load = self.load
+		if line.startswith('PING'):
+			self.sendLine('PONG' + line[4:])
+			return
+		prefix, cmd, rest = (line.split(' ', 2) + ['', ''])[:3]
+		nick = prefix[1:].split('!', 1)[0]
+		if cmd == 'PRIVMSG':
+			target, msg = rest.split(' :', 1)
+			load.event(target[0] == '#' and 'in' or 'from', sent(msg))
+		elif cmd == 'JOIN':
+			if nick == self.name:
+				load.event('join', self.joining)
+			else:
+				load.event('join', None)
+		elif cmd == 'PART' or cmd == 'QUIT':
+			load.event('part', load.run and load.run.start)
+		elif cmd == '001':
+			load.event('hello', self.started)
+
+class Dialer(ClientFactory):
+	def __init__(self, client):
+		self.client = client
+
+	def buildProtocol(self, addr):
+		return self.client
+
+class Pipe(object):
+	"""One end of an in-memory connection. What is written to it reaches the
+	protocol at the other end when the Mover next runs."""
+	disconnecting = False
+
+	def __init__(self, mover, host, peer):
+		self.mover    = mover
+		self.host     = host
+		self.peer     = peer
+		self.other    = None
+		self.protocol = None
+		self.buffer   = []
+		self.closed   = False
+
+	def write(self, data):
+		if data and not self.disconnecting:
+			if not self.buffer:
+				self.mover.add(self)
+			self.buffer.append(data)
+
+	def writeSequence(self, data):
+		self.write("".join(data))
+
+	def loseConnection(self):
+		if not self.disconnecting:
+			self.disconnecting = True
+			self.mover.add(self)
+
+	def registerProducer(self, producer, streaming):
+		pass
+
+	def unregisterProducer(self):
+		pass
+
+	def getPeer(self):
+		return self.peer
+
+	def getHost(self):
+		return self.host
+
+	def move(self):
+		data, self.buffer = ("".join(self.buffer), [])
+		if data and not self.other.closed:
+			self.other.protocol.dataReceived(data)
+		if self.disconnecting:
+			for end in (self, self.other):
+				if not end.closed:
+					end.closed = True
+					end.disconnecting = True
+					end.protocol.connectionLost(failure.Failure(error.ConnectionDone()))
+
+class Mover(object):
+	"""Moves the data written to every Pipe, once per reactor iteration."""
+
+	def __init__(self):
+		self.dirty = []
+		self.call  = None
+
+	def add(self, pipe):
+		self.dirty.append(pipe)
+		if self.call is None:
+			self.call = loop.callLater(0, self.move)
+
+	def move(self):
+		self.call  = None
+		dirty      = self.dirty
+		self.dirty = []
+		for pipe in dirty:
+			pipe.move()
+
+class Load(object):
+	"""A fresh server and its clients, for one scenario."""
+
+	def __init__(self, options):
+		self.options  = options
+		self.house    = House('load')
+		self.house.add(Room('main'))
+		self.haver    = HaverFactory(self.house, flood = UNLIMITED)
+		self.ircf     = IRCFactory(self.house, flood = UNLIMITED)
+		self.clients  = []
+		self.run      = None
+		self.failures = 0
+		self.ports    = []
+		self.mover    = Mover()
+		if not options.memory:
+			backlog = min(max(options.clients, 50), 4096)
+			self.ports = [ loop.listenTCP(0, f, backlog, '127.0.0.1') for f in (self.haver, self.ircf) ]
+
+	def expect(self, kind, expected):
+		self.run = Run(kind, expected, self.options.timeout)
+		return self.run
+
+	def event(self, kind, sent):
+		run = self.run
+		if run is not None and run.kind == kind and run.end is None:
+			run.got(sent)
+
+	def connect(self):
+		"""Start connecting every client; they log in once connected."""
+		share = self.options.irc
+		for i in xrange(self.options.clients):
+			# Spread the IRC clients evenly among the others.
+			if int((i + 1) * share) > int(i * share):
+				client = IRCClient(self, 'irc%d' % i)
+			else:
+				client = HaverClient(self, 'load%d' % i)
+			self.clients.append(client)
+			client.started = time.time()
+			if self.options.memory:
+				self.pipe(client)
+			else:
+				port = self.ports[client.irc].getHost().port
+				loop.connectTCP('127.0.0.1', port, Dialer(client))
+
+	def pipe(self, client):
+		n      = len(self.clients)
+		host   = address.IPv4Address('TCP', '127.0.0.1', 7575)
+		peer   = address.IPv4Address('TCP', '127.0.0.1', 10000 + n)
+		server = (client.irc and self.ircf or self.haver).buildProtocol(peer)
+		ends   = (Pipe(self.mover, host, peer), Pipe(self.mover, peer, host))
+		ends[0].other, ends[0].protocol = (ends[1], server)
+		ends[1].other, ends[1].protocol = (ends[0], client)
+		server.makeConnection(ends[0])
+		client.makeConnection(ends[1])
+
+	def login(self):
+		run = self.expect('hello', self.options.clients)
+		self.connect()
+		return run.done
+
+	def seat(self, name):
+		"""Put every logged in user in room name without a JOIN storm."""
+		room = self.house.lookup('room', name)
+		for user in self.house.lookup_namespace('user').values():
+			room.admit(user)
+
+	@defer.inlineCallbacks
+	def close(self):
+		"""Hang up every client; fires once the server has let them all go."""
+		self.run = None
+		for client in self.clients:
+			if client.transport is not None:
+				client.transport.loseConnection()
+		for port in self.ports:
+			yield port.stopListening()
+		deadline = time.time() + self.options.timeout
+		while self.house.lookup_namespace('user') and time.time() < deadline:
+			yield task.deferLater(loop, 0.05, lambda: None)
+
+@defer.inlineCallbacks
+def login(load):
+	run = yield load.login()
+	defer.returnValue(run)
+
+@defer.inlineCallbacks
+def join(load):
+	yield load.login()
+	n   = len(load.clients)
+	run = load.expect('join', n * (n + 1) // 2)
+	for client in load.clients:
+		client.join('main')
+	yield run.done
+	defer.returnValue(run)
+
+@defer.inlineCallbacks
+def chatty(load):
+	yield load.login()
+	load.seat('main')
+	options = load.options
+	n       = len(load.clients)
+	step    = max(1, n // max(1, options.senders))
+	senders = load.clients[::step][:options.senders]
+	# IRC clients do not hear their own messages.
+	expected = sum([ (n - x.irc) * options.messages for x in senders ])
+	run = load.expect('in', expected)
+	for i in xrange(options.messages):
+		for client in senders:
+			client.say('main')
+	yield run.done
+	defer.returnValue(run)
+
+@defer.inlineCallbacks
+def pm(load):
+	yield load.login()
+	options = load.options
+	rand    = random.Random(1)
+	names   = [ x.name for x in load.clients ]
+	havers  = [ x for x in load.clients if not x.irc ]
+	run = load.expect('from', len(havers) * options.messages)
+	for i in xrange(options.messages):
+		for client in havers:
+			name = rand.choice(names)
+			while name == client.name and len(names) > 1:
+				name = rand.choice(names)
+			client.to(name)
+	yield run.done
+	defer.returnValue(run)
+
+@defer.inlineCallbacks
+def disconnect(load):
+	yield load.login()
+	load.seat('main')
+	n       = len(load.clients)
+	leavers = load.clients[:n // 2]
+	run = load.expect('part', len(leavers) * (n - len(leavers)))
+	for client in leavers:
+		client.transport.loseConnection()
+	yield run.done
+	defer.returnValue(run)
+
+SCENARIOS = [
+	('login',      login),
+	('join',       join),
+	('chatty',     chatty),
+	('pm',         pm),
+	('disconnect', disconnect),
+]
+
+@defer.inlineCallbacks
+def bench(options, names):
+	results = dict(
+		clients   = options.clients,
+		irc       = options.irc,
+		transport = options.memory and 'memory' or 'tcp',
+		core      = options.core,
+		senders   = options.senders,
+		messages  = options.messages,
+		python    = sys.version.split()[0],
+		scenarios = dict(),
+	)
+	try:
+		for name, scenario in SCENARIOS:
+			if name not in names:
+				continue
+			load = Load(options)
+			run  = yield scenario(load)
+			result = run.result()
+			result['failures'] = load.failures
+			results['scenarios'][name] = result
+			sys.stderr.write("%-10s %8d lines %9.1f lines/s  p50 %8s ms  p99 %8s ms  lost %d\n" % (
+				name, result['messages'], result['rate'],
+				result['p50_ms'], result['p99_ms'], result['lost']))
+			yield load.close()
+		if options.output:
+			import json
+			f = open(options.output, 'w')
+			try:
+				json.dump(results, f, indent = 1, sort_keys = True)
+			finally:
+				f.close()
+	finally:
+		loop.stop()
+
+def main(argv):
+	parser = OptionParser(usage = __doc__.strip())
+	parser.add_option('-c', '--clients',  type = 'int',   default = 1000)
+	parser.add_option('--irc',            type = 'float', default = 0.0,
+		help = 'fraction of the clients that speak IRC')
+	parser.add_option('--memory',         action = 'store_true', default = False)
+	parser.add_option('--core',           type = 'choice', choices = core.CORES, default = 'twisted')
+	parser.add_option('--senders',        type = 'int',   default = 10)
+	parser.add_option('--messages',       type = 'int',   default = 10)
+	parser.add_option('--timeout',        type = 'float', default = 120.0)
+	parser.add_option('-o', '--output')
+	options, names = parser.parse_args(argv)
+	known = [ x[0] for x in SCENARIOS ]
+	for name in names:
+		if name not in known:
+			parser.error('unknown scenario %s' % name)
+	if not names:
+		names = known
+
+	if not options.memory:
+		# Both ends of every connection are in this process.
+		soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+		need = 2 * options.clients + 64
+		if soft < need:
+			resource.setrlimit(resource.RLIMIT_NOFILE, (min(need, hard), hard))
+	global loop
+	loop = core.use(options.core)
+	loop.callWhenRunning(bench, options, names)
+	loop.run()
+
+if __name__ == '__main__':
+	main(sys.argv[1:])
@@ -0,0 +1,238 @@
+"""Leveled, per-category logging that costs next to nothing when it is off.
+
+	wire = logger.get('irc.wire')
+	wire.debug('C: %s', line)
+
+A record below its category's level is thrown away before anything is
+formatted. One that passes is handed to the sink as the format string and
+its arguments; the default sink formats it and passes it to twisted's log,
+and a Writer formats and writes it in a thread of its own, so a slow disk
+never holds up the reactor. Arguments should be strings, numbers or other
+values that do not change after the call.
+
+Levels are set per category, and a category's level applies to the ones
+under it (irc applies to irc.wire) unless they have their own:
+
+	logger.configure('info,irc.wire=debug')
+
+Records that could repeat without end, like failures, go through limited(),
+which lets a burst of them through per key and then only counts them."""
+
+import time, threading
+from twisted.python      import log
+from twisted.application import service
+
+DEBUG = 10
+INFO  = 20
+WARN  = 30
+ERROR = 40
+OFF   = 100
+
+LEVELS = dict(debug = DEBUG, info = INFO, warn = WARN, error = ERROR, off = OFF)
+NAMES  = dict([ (v, k.upper()) for k, v in LEVELS.items() ])
+
+class Logger(object):
+	"""Records of one category."""
+	__slots__ = ('category', 'level', 'logs', 'windows')
+
+	def __init__(self, logs, category, level):
+		self.logs     = logs
+		self.category = category
+		self.level    = level
+		# key -> [window start, records in window, records suppressed]
+		self.windows  = dict()
+
+	def enabled(self, level):
+		return level >= self.level
+
+	def debug(self, fmt, *args):
+		if self.level <= DEBUG:
+			self.logs.sink.emit(time.time(), DEBUG, self.category, fmt, args)
+
+	def info(self, fmt, *args):
+		if self.level <= INFO:
+			self.logs.sink.emit(time.time(), INFO, self.category, fmt, args)
+
+	def warn(self, fmt, *args):
+		if self.level <= WARN:
+			self.logs.sink.emit(time.time(), WARN, self.category, fmt, args)
+
+	def error(self, fmt, *args):
+		if self.level <= ERROR:
+			self.logs.sink.emit(time.time(), ERROR, self.category, fmt, args)
+
+	def limited(self, level, key, fmt, *args):
+		"""Emit at most logs.burst records for key per logs.window seconds.
+		Once a window is over, say how many were held back."""
+		if level < self.level:
+			return
+		now    = time.time()
+		window = self.windows.get(key)
+		if window is None or now - window[0] >= self.logs.window:
+			if window is not None and window[2]:
+				self.logs.sink.emit(now, level, self.category,
+					'%d more like %s suppressed', (window[2], key))
+			window = self.windows[key] = [now, 0, 0]
+		if window[1] < self.logs.burst:
+			window[1] = window[1] + 1
+			self.logs.sink.emit(now, level, self.category, fmt, args)
+		else:
+			window[2] = window[2] + 1
+
+def format(when, level, category, fmt, args):
+	if args:
+		try:
+			fmt = fmt % args
+		except (TypeError, ValueError), e:
+			fmt = '%s %% %r (%s)' % (fmt, args, e)
+	return '%s %s: %s' % (NAMES.get(level, level), category, fmt)
+
+class TwistedSink(object):
+	"""Formats each record and hands it to twisted's log, as it comes."""
+
+	def emit(self, when, level, category, fmt, args):
+		log.msg(format(when, level, category, fmt, args))
+
+class Writer(service.Service):
+	"""Formats and writes records to path in a thread of its own.
+
+	At most limit records wait for the thread; beyond that they are dropped,
+	and counted in the next line written."""
+
+	def __init__(self, path, limit = 100000):
+		self.path     = path
+		self.limit    = limit
+		self.pending  = []
+		self.dropped  = 0
+		self.stopping = False
+		self.lock     = threading.Condition()
+		self.thread   = None
+		self.file     = None
+
+	def emit(self, when, level, category, fmt, args):
+		self.lock.acquire()
+		try:
+			if len(self.pending) >= self.limit:
+				self.dropped = self.dropped + 1
+				return
+			if not self.pending:
+				self.lock.notify()
+			self.pending.append((when, level, category, fmt, args))
+		finally:
+			self.lock.release()
+
+	def startService(self):
+		service.Service.startService(self)
+		self.stopping = False
+		self.file     = open(self.path, 'ab')
+		self.thread   = threading.Thread(target = self.run, name = 'logger')
+		self.thread.setDaemon(True)
+		self.thread.start()
+
+	def stopService(self):
+		"""Write out everything emitted so far and stop the writer."""
+		service.Service.stopService(self)
+		self.lock.acquire()
+		try:
+			self.stopping = True
+			self.lock.notify()
+		finally:
+			self.lock.release()
+		if self.thread is not None:
+			self.thread.join()
+			self.thread = None
+		self.file.close()
+
+	def run(self):
+		while True:
+			self.lock.acquire()
+			try:
+				while not self.pending and not self.stopping:
+					self.lock.wait()
+				records, self.pending = (self.pending, [])
+				dropped, self.dropped = (self.dropped, 0)
+				stopping = self.stopping
+			finally:
+				self.lock.release()
+			try:
+				self.write(records, dropped)
+			except (IOError, OSError), e:
+				log.msg('Cannot write log %s: %s' % (self.path, e))
+			if stopping:
+				break
+
+	def write(self, records, dropped):
+		lines = []
+		for record in records:
+			stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record[0]))
+			lines.append('%s %s\n' % (stamp, format(*record)))
+		if dropped:
+			lines.append('%s WARN logger: %d records dropped\n' %
+				(time.strftime('%Y-%m-%d %H:%M:%S'), dropped))
+		self.file.writelines(lines)
+		self.file.flush()
+
+class Logs(object):
+	"""Every category's Logger, their levels, and where records go."""
+
+	def __init__(self, level = INFO, sink = None):
+		if sink is None:
+			sink = TwistedSink()
+		self.level   = level
+		self.sink    = sink
+		self.levels  = dict()
+		self.loggers = dict()
+		self.burst   = 10
+		self.window  = 10.0
+
+	def get(self, category):
+		try:
+			return self.loggers[category]
+		except KeyError:
+			logger = self.loggers[category] = Logger(self, category, self.levelOf(category))
+			return logger
+
+	def levelOf(self, category):
+		"""The level of category, or of the nearest category above it that has one."""
+		name = category
+		while True:
+			if name in self.levels:
+				return self.levels[name]
+			if '.' not in name:
+				return self.level
+			name = name.rsplit('.', 1)[0]
+
+	def setLevel(self, level, category = None):
+		if category is None:
+			self.level = level
+		else:
+			self.levels[category] = level
+		for logger in self.loggers.values():
+			logger.level = self.levelOf(logger.category)
+
+	def configure(self, spec):
+		"""Set levels from a spec like 'info,irc.wire=debug,haver.fail=warn'."""
+		for part in spec.split(','):
+			part = part.strip()
+			if not part:
+				continue
+			if '=' in part:
+				category, name = part.split('=', 1)
+				self.setLevel(LEVELS[name.strip().lower()], category.strip())
+			else:
+				self.setLevel(LEVELS[part.lower()])
+
+logs = None
+
+def shared():
+	"""Return the process-wide Logs, creating it on first use."""
+	global logs
+	if logs is None:
+		logs = Logs()
+	return logs
+
+def get(category):
+	return shared().get(category)
+
+def configure(spec):
+	shared().configure(spec)
@@ -0,0 +1,65 @@
+#!/usr/bin/python
+import unittest, os, tempfile, shutil
+from haver.server import logger
+
+class Sink(object):
+	def __init__(self):
+		self.records = []
+
+	def emit(self, when, level, category, fmt, args):
+		self.records.append(logger.format(when, level, category, fmt, args))
+
+class Costly(object):
+	formatted = 0
+
+	def __str__(self):
+		Costly.formatted = Costly.formatted + 1
+		return 'costly'
+
+class TestLogs(unittest.TestCase):
+	def setUp(self):
+		self.sink = Sink()
+		self.logs = logger.Logs(logger.INFO, self.sink)
+
+	def testLevelsAreInherited(self):
+		wire = self.logs.get('irc.wire')
+		fail = self.logs.get('irc.fail')
+		wire.debug('C: %s', Costly())
+		self.assertEqual(Costly.formatted, 0)
+		self.logs.configure('warn,irc=debug,irc.fail=off')
+		wire.debug('C: %s', Costly())
+		fail.error('never')
+		self.logs.get('haver').info('hidden')
+		self.assertEqual(self.sink.records, ['DEBUG irc.wire: C: costly'])
+
+	def testLimited(self):
+		self.logs.burst  = 2
+		self.logs.window = 1000
+		fail = self.logs.get('haver.fail')
+		for i in range(5):
+			fail.limited(logger.INFO, 'unknown.thing', 'failed %d', i)
+		fail.limited(logger.INFO, 'arity', 'arity')
+		self.assertEqual(self.sink.records, ['INFO haver.fail: failed 0',
+			'INFO haver.fail: failed 1', 'INFO haver.fail: arity'])
+		self.logs.window = 0
+		fail.limited(logger.INFO, 'unknown.thing', 'failed again')
+		self.assertEqual(self.sink.records[3:], ['INFO haver.fail: 3 more like unknown.thing suppressed',
+			'INFO haver.fail: failed again'])
+
+	def testWriter(self):
+		dir    = tempfile.mkdtemp()
+		path   = os.path.join(dir, 'haverd.log')
+		writer = logger.Writer(path)
+		self.logs.sink = writer
+		try:
+			writer.startService()
+			self.logs.get('haver').info('New client from %s', '10.0.0.1')
+			writer.stopService()
+			lines = open(path).readlines()
+			self.assertEqual(len(lines), 1)
+			self.assertTrue(lines[0].endswith(' INFO haver: New client from 10.0.0.1\n'))
+		finally:
+			shutil.rmtree(dir)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,264 @@
+"""Counters, gauges and histograms describing a running server.
+
+Everything is kept in one Registry per process. Recording is meant to stay
+on under full load: the hot paths hold on to their Counter or Histogram and
+only add to plain numbers, and anything that can be read off the server's
+own state (queue depths, how many are connected) is a Gauge computed when
+the metrics are asked for, by the STATS command or a Reporter writing them
+out in the Prometheus text format."""
+
+import os
+from bisect import bisect_left
+from twisted.internet    import task
+from haver.server        import core
+from twisted.application import service
+
+# Upper bounds, in seconds, of the latency buckets.
+SECONDS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+	0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Upper bounds of the fan-out buckets, in recipients.
+FANOUT  = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+
+class Counter(object):
+	"""A number that only goes up."""
+	__slots__ = ('value',)
+
+	def __init__(self):
+		self.value = 0
+
+	def inc(self, n = 1):
+		self.value = self.value + n
+
+	def samples(self, name, labels):
+		yield name, labels, self.value
+
+class Gauge(object):
+	"""A number that goes up and down, or that func works out when asked."""
+	__slots__ = ('value', 'func')
+
+	def __init__(self, func = None):
+		self.value = 0
+		self.func  = func
+
+	def inc(self, n = 1):
+		self.value = self.value + n
+
+	def dec(self, n = 1):
+		self.value = self.value - n
+
+	def samples(self, name, labels):
+		if self.func is not None:
+			yield name, labels, self.func()
+		else:
+			yield name, labels, self.value
+
+class Histogram(object):
+	"""How many observations fell at or under each of bounds."""
+	__slots__ = ('bounds', 'counts', 'sum', 'count')
+
+	def __init__(self, bounds = SECONDS):
+		self.bounds = bounds
+		# The last count is for anything over the largest bound.
+		self.counts = [0] * (len(bounds) + 1)
+		self.sum    = 0
+		self.count  = 0
+
+	def observe(self, value):
+		self.counts[bisect_left(self.bounds, value)] += 1
+		self.sum   = self.sum + value
+		self.count = self.count + 1
+
+	def samples(self, name, labels):
+		total = 0
+		for bound, n in zip(self.bounds, self.counts):
+			total = total + n
+			yield name + '_bucket', labels + (('le', '%g' % bound),), total
+		yield name + '_bucket', labels + (('le', '+Inf'),), self.count
+		yield name + '_sum', labels, self.sum
+		yield name + '_count', labels, self.count
+
+class Meter(object):
+	"""The traffic of one kind of listener."""
+	__slots__ = ('received', 'sent', 'dropped', 'connected')
+
+	def __init__(self, registry, listener):
+		self.received  = registry.counter('haver_received_bytes_total',
+			'Bytes read from clients', listener = listener)
+		self.sent      = registry.counter('haver_sent_bytes_total',
+			'Bytes written to clients', listener = listener)
+		self.dropped   = registry.counter('haver_dropped_lines_total',
+			'Chat lines thrown away because a client was not reading', listener = listener)
+		self.connected = registry.gauge('haver_connected_clients',
+			'Clients connected now', listener = listener)
+
+class Commands(object):
+	"""How long the commands of one protocol take, and how they fail. Only
+	commands the server knows should be timed, so that clients cannot make
+	up new metrics."""
+
+	def __init__(self, registry, protocol):
+		self.registry = registry
+		self.protocol = protocol
+		self.timers   = dict()
+		self.fails    = dict()
+
+	def timer(self, cmd):
+		try:
+			return self.timers[cmd]
+		except KeyError:
+			timer = self.timers[cmd] = self.registry.histogram('haver_command_seconds',
+				'Time taken to handle a command', protocol = self.protocol, command = cmd)
+			return timer
+
+	def failed(self, name):
+		try:
+			counter = self.fails[name]
+		except KeyError:
+			counter = self.fails[name] = self.registry.counter('haver_failures_total',
+				'Commands that failed, by failure', protocol = self.protocol, failure = name)
+		counter.inc()
+
+class Registry(object):
+	"""Every metric of the process, by name and labels."""
+
+	def __init__(self):
+		# name -> (kind, help, {labels: metric})
+		self.families = dict()
+
+	def get(self, kind, make, name, help, labels):
+		labels = tuple(sorted(labels.items()))
+		try:
+			family = self.families[name]
+		except KeyError:
+			family = self.families[name] = (kind, help, dict())
+		try:
+			return family[2][labels]
+		except KeyError:
+			metric = family[2][labels] = make()
+			return metric
+
+	def counter(self, name, help, **labels):
+		return self.get('counter', Counter, name, help, labels)
+
+	def histogram(self, name, help, bounds = SECONDS, **labels):
+		return self.get('histogram', lambda: Histogram(bounds), name, help, labels)
+
+	def gauge(self, name, help, func = None, **labels):
+		metric = self.get('gauge', Gauge, name, help, labels)
+		if func is not None:
+			metric.func = func
+		return metric
+
+	def meter(self, listener):
+		return Meter(self, listener)
+
+	def samples(self):
+		"""Yield (name, labels, value) for every sample, ordered by name."""
+		for name in sorted(self.families):
+			kind, help, metrics = self.families[name]
+			for labels in sorted(metrics):
+				for sample in metrics[labels].samples(name, labels):
+					yield sample
+
+	def text(self):
+		"""The Prometheus text exposition of every metric."""
+		lines = []
+		for name in sorted(self.families):
+			kind, help, metrics = self.families[name]
+			lines.append('# HELP %s %s\n' % (name, help))
+			lines.append('# TYPE %s %s\n' % (name, kind))
+			for labels in sorted(metrics):
+				for sample in metrics[labels].samples(name, labels):
+					lines.append('%s %s\n' % (key(sample[0], sample[1]), number(sample[2])))
+		return ''.join(lines)
+
+def watch(registry, house, idle):
+	"""Add gauges for the things in house and the queues of the talkers idle
+	is watching."""
+	registry.gauge('haver_users', 'Users logged in, here or on linked servers',
+		lambda: len(house.lookup_namespace('user')))
+	registry.gauge('haver_rooms', 'Rooms open',
+		lambda: len(house.lookup_namespace('room')))
+	registry.gauge('haver_queued_lines', 'Lines waiting for clients that are not reading',
+		lambda: sum([ len(x.outbound) for x in idle.where ]))
+	registry.gauge('haver_queued_lines_max', 'Lines waiting for the furthest behind client',
+		lambda: max([0] + [ len(x.outbound) for x in idle.where ]))
+
+def key(name, labels):
+	"""name{label="value",...} as Prometheus writes a sample."""
+	if not labels:
+		return name
+	pairs = [ '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in labels ]
+	return '%s{%s}' % (name, ','.join(pairs))
+
+def number(value):
+	if isinstance(value, float):
+		return repr(value)
+	return str(value)
+
+class Reporter(service.Service):
+	"""Measures how late the reactor runs its timers, and every interval
+	seconds writes registry to path in the Prometheus text format, for a
+	node exporter's textfile collector to pick up."""
+
+	def __init__(self, registry, path = None, interval = 15.0, probe = 0.5, clock = None):
+		if clock is None:
+			clock = core.clock()
+		self.registry = registry
+		self.path     = path
+		self.interval = interval
+		self.probe    = probe
+		self.clock    = clock
+		self.expected = None
+		self.call     = None
+		self.loop     = None
+		self.lag      = registry.histogram('haver_reactor_lag_seconds',
+			'How late the reactor ran a timer')
+		self.last     = registry.gauge('haver_reactor_last_lag_seconds',
+			'How late the reactor ran the last timer')
+
+	def startService(self):
+		service.Service.startService(self)
+		self.tick()
+		if self.path is not None:
+			self.loop = task.LoopingCall(self.write)
+			self.loop.clock = self.clock
+			self.loop.start(self.interval, now = False)
+
+	def stopService(self):
+		service.Service.stopService(self)
+		if self.call is not None:
+			self.call.cancel()
+			self.call = None
+		if self.loop is not None:
+			self.loop.stop()
+			self.loop = None
+			self.write()
+
+	def tick(self):
+		"""Note how long past its time this call came, and ask for the next."""
+		now = self.clock.seconds()
+		if self.expected is not None:
+			lag = max(0.0, now - self.expected)
+			self.lag.observe(lag)
+			self.last.value = lag
+		self.expected = now + self.probe
+		self.call     = self.clock.callLater(self.probe, self.tick)
+
+	def write(self):
+		new = self.path + '.new'
+		f = open(new, 'wb')
+		try:
+			f.write(self.registry.text())
+		finally:
+			f.close()
+		os.rename(new, self.path)
+
+registry = None
+
+def shared():
+	"""Return the process-wide Registry, creating it on first use."""
+	global registry
+	if registry is None:
+		registry = Registry()
+	return registry
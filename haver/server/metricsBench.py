@@ -0,0 +1,54 @@
+#!/usr/bin/python
+"""Benchmark for the cost of recording metrics: a Counter.inc, a
+Histogram.observe, and what the talker adds to each command (two clock reads
+and an observe), next to the cost of a whole IN command to a room of members.
+
+	python metricsBench.py [members] [commands]
+"""
+import sys, time
+from haver.server.house   import House
+from haver.server.thing   import Room
+from haver.server.talker  import HaverFactory, commands
+from haver.server.metrics import Counter, Histogram
+from haver.server         import outbound
+from haver.server.thingBench import Transport
+
+def each(func, count):
+	"""Microseconds per call of func."""
+	start = time.time()
+	for i in xrange(count):
+		func()
+	return (time.time() - start) * 1e6 / count
+
+def timed():
+	start = time.time()
+	commands.timer('IN').observe(time.time() - start)
+
+def main(members, count):
+	counter   = Counter()
+	histogram = Histogram()
+	print "Counter.inc        %6.3f us" % each(counter.inc, count)
+	print "Histogram.observe  %6.3f us" % each(lambda: histogram.observe(0.0003), count)
+	print "timed command      %6.3f us" % each(timed, count)
+
+	house   = House('bench')
+	house.add(Room('main'))
+	factory = HaverFactory(house)
+	talkers = []
+	for i in xrange(members):
+		transport = Transport(i)
+		talker    = factory.buildProtocol(transport.peer)
+		talker.makeConnection(transport)
+		talker.lineReceived("HAVER\tbench/1")
+		talker.lineReceived("IDENT\tuser%d" % i)
+		talker.lineReceived("JOIN\tmain")
+		talkers.append(talker)
+	line = "IN\tmain\tsay\thello"
+	def say():
+		talkers[0].lineReceived(line)
+		outbound.shared().flush()
+	print "IN to %4d members %6.3f us" % (members, each(say, count / 10))
+
+if __name__ == '__main__':
+	args = [ int(x) for x in sys.argv[1:] ]
+	main(*(args + [10, 1000000][len(args):]))
@@ -0,0 +1,60 @@
+#!/usr/bin/python
+import unittest
+from twisted.internet import task
+from haver.server.metrics import Registry, Reporter, key
+
+class TestRegistry(unittest.TestCase):
+	def setUp(self):
+		self.registry = Registry()
+
+	def sample(self, name, **labels):
+		for x, y, value in self.registry.samples():
+			if key(x, y) == key(name, tuple(sorted(labels.items()))):
+				return value
+		self.fail('no sample %s' % key(name, tuple(sorted(labels.items()))))
+
+	def testSameLabelsSameMetric(self):
+		a = self.registry.counter('hits', 'Hits', room = 'main')
+		b = self.registry.counter('hits', 'Hits', room = 'main')
+		c = self.registry.counter('hits', 'Hits', room = 'lobby')
+		self.assertTrue(a is b)
+		a.inc()
+		b.inc(2)
+		self.assertEqual(self.sample('hits', room = 'main'), 3)
+		self.assertEqual(self.sample('hits', room = 'lobby'), 0)
+
+	def testHistogram(self):
+		h = self.registry.histogram('took', 'Took', (1, 5, 10))
+		for x in [0.5, 1, 3, 7, 100]:
+			h.observe(x)
+		self.assertEqual(self.sample('took_bucket', le = '1'), 2)
+		self.assertEqual(self.sample('took_bucket', le = '5'), 3)
+		self.assertEqual(self.sample('took_bucket', le = '10'), 4)
+		self.assertEqual(self.sample('took_bucket', le = '+Inf'), 5)
+		self.assertEqual(self.sample('took_count'), 5)
+		self.assertEqual(self.sample('took_sum'), 111.5)
+
+	def testText(self):
+		self.registry.gauge('users', 'Users', lambda: 42)
+		self.registry.counter('fails', 'Fails', failure = 'say "hi"').inc()
+		self.assertEqual(self.registry.text(),
+			'# HELP fails Fails\n'
+			'# TYPE fails counter\n'
+			'fails{failure="say \\"hi\\""} 1\n'
+			'# HELP users Users\n'
+			'# TYPE users gauge\n'
+			'users 42\n')
+
+	def testReactorLag(self):
+		clock    = task.Clock()
+		reporter = Reporter(self.registry, probe = 0.5, clock = clock)
+		reporter.startService()
+		clock.advance(0.5)
+		clock.advance(2.5)
+		self.assertEqual(self.sample('haver_reactor_lag_seconds_count'), 2)
+		self.assertEqual(self.sample('haver_reactor_last_lag_seconds'), 2.0)
+		reporter.stopService()
+		self.assertEqual(clock.getDelayedCalls(), [])
+
+if __name__ == '__main__':
+    unittest.main()
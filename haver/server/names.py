@@ -0,0 +1,83 @@
+"""The member list of a room, kept ready to send in lines of bounded size.
+
+An IRC server says who is in a channel with 353 lines of at most 512 bytes.
+Names keeps a room's member names in chunks that each fit in one such
+line. A room gets its Names the first time someone asks for them; from then
+on Room.admit and Room.evict keep it up to date one name at a time, so
+nobody has to walk the whole room again."""
+
+class Names(object):
+	"""names split into chunks of at most budget bytes, counting the spaces
+	between them. A name longer than budget gets a chunk of its own."""
+
+	def __init__(self, names, budget):
+		self.budget = budget
+		self.chunks = []
+		# Bytes in each chunk, counting a space after every name.
+		self.sizes  = []
+		# Each chunk joined by spaces, or None until it is asked for again.
+		self.texts  = []
+		self.where  = dict()
+		self.used   = 0
+		for name in names:
+			self.add(name)
+
+	def __len__(self):
+		return len(self.where)
+
+	def __iter__(self):
+		for chunk in self.chunks:
+			for name in chunk:
+				yield name
+
+	def add(self, name):
+		if name in self.where:
+			return
+		size = len(name) + 1
+		i    = len(self.chunks) - 1
+		if i < 0 or self.sizes[i] + size - 1 > self.budget:
+			self.chunks.append([])
+			self.sizes.append(0)
+			self.texts.append(None)
+			i = i + 1
+		self.chunks[i].append(name)
+		self.sizes[i] = self.sizes[i] + size
+		self.texts[i] = None
+		self.where[name] = i
+		self.used = self.used + size
+
+	def discard(self, name):
+		i = self.where.pop(name, None)
+		if i is None:
+			return
+		self.chunks[i].remove(name)
+		self.sizes[i] = self.sizes[i] - len(name) - 1
+		self.texts[i] = None
+		self.used = self.used - len(name) - 1
+		# Names leave holes that later ones do not fill. Once the chunks are
+		# mostly holes, pack them again.
+		if len(self.chunks) > 2 * (self.used // max(self.budget, 1)) + 2:
+			self.pack()
+
+	def pack(self):
+		names = list(self)
+		self.chunks = []
+		self.sizes  = []
+		self.texts  = []
+		self.where  = dict()
+		self.used   = 0
+		for name in names:
+			self.add(name)
+
+	def lines(self):
+		"""The chunks, each joined by spaces, skipping empty ones."""
+		texts = self.texts
+		for i in xrange(len(self.chunks)):
+			if texts[i] is None:
+				texts[i] = ' '.join(self.chunks[i])
+			if texts[i]:
+				yield texts[i]
+
+def split(names, budget):
+	"""Join names into lines of at most budget bytes, without caching them."""
+	return list(Names(names, budget).lines())
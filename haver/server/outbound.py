@@ -0,0 +1,226 @@
+from collections import deque
+from zope.interface import classImplements
+from twisted.internet.interfaces import IPushProducer
+from haver.server import core
+
+# What the server does when a client is not reading fast enough to keep its
+# queue below the limit.
+#   drop:     discard new chat until the queue drains
+#   collapse: discard the oldest queued chat to make room for new traffic
+#   bye:      disconnect the client with BYE slow
+POLICIES = ('drop', 'collapse', 'bye')
+
+class Coalescer(object):
+	"""Flushes every Outbound with pending lines once, at the end of the
+	current reactor iteration."""
+	def __init__(self, clock = None):
+		if clock is None:
+			clock = core.clock()
+		self.clock = clock
+		self.dirty = []
+		self.call  = None
+
+	def add(self, outbound):
+		self.dirty.append(outbound)
+		if self.call is None:
+			self.call = self.clock.callLater(0, self.flush)
+
+	def flush(self):
+		self.call  = None
+		dirty      = self.dirty
+		self.dirty = []
+		for outbound in dirty:
+			outbound.flush()
+
+coalescer = None
+
+def shared():
+	"""Return the server-wide Coalescer, creating it on first use."""
+	global coalescer
+	if coalescer is None:
+		coalescer = Coalescer()
+	return coalescer
+
+class Outbound(object):
+	"""A bounded queue of lines waiting to be written to one connection.
+
+	It is registered with the transport as a streaming producer. While the
+	transport is writing freely, lines collect in pending and are handed over
+	in one writeSequence when the coalescer flushes at the end of the reactor
+	iteration; a flushing write (e.g. PING) hands them over at once. Once the
+	transport pauses us because its own buffer is full, lines wait here until
+	resumeProducing is called.
+	Urgent lines (control traffic, replies to the client's own tagged
+	commands) go in a lane that is always written before queued normal lines.
+	When the queue hits its limit, the policy decides what gets lost. Only
+	chat is ever discarded. If nothing can be discarded, overflow() is called
+	to get rid of the client.
+	The two lanes only exist while something is queued, as most connections
+	never fall behind.
+	Once compress() has been called, what is handed over is deflated first,
+	a flush's worth or up to CHUNK queued lines at a time."""
+	__slots__ = ('transport', 'coalescer', 'pending', 'overflow', 'limit', 'policy',
+		'urgent', 'normal', 'chat', 'paused', 'dropped', 'meter', 'deflater')
+
+	# Queued lines deflated together when a compressed connection catches up.
+	CHUNK = 64
+
+	def __init__(self, transport, overflow, limit = 1000, policy = 'drop', coalescer = None, meter = None):
+		assert policy in POLICIES
+		if coalescer is None:
+			coalescer = shared()
+		self.transport = transport
+		self.coalescer = coalescer
+		self.pending   = []
+		self.overflow  = overflow
+		self.limit     = limit
+		self.policy    = policy
+		self.urgent    = None
+		self.normal    = None
+		self.chat      = 0
+		self.paused    = False
+		self.dropped   = 0
+		self.meter     = meter
+		self.deflater  = None
+		transport.registerProducer(self, True)
+
+	def __len__(self):
+		if self.urgent is None:
+			return 0
+		return len(self.urgent) + len(self.normal)
+
+	depth = property(__len__, doc = "Number of lines waiting to be written")
+
+	def write(self, line, urgent = False, chat = False, flush = False):
+		if not self.paused and not self.urgent and not self.normal:
+			if not self.pending:
+				self.coalescer.add(self)
+			self.pending.append(line)
+			if flush:
+				self.flush()
+			return
+		if self.urgent is None:
+			self.urgent = deque()
+			self.normal = deque()
+		if len(self) >= self.limit and not self.makeRoom(chat):
+			return
+		if urgent:
+			self.urgent.append(line)
+		else:
+			self.normal.append((line, chat))
+			if chat:
+				self.chat = self.chat + 1
+
+	def makeRoom(self, chat):
+		"""Apply the policy to a full queue. Return whether the new line fits."""
+		if self.policy == 'drop' and chat:
+			self.drop()
+			return False
+		if self.policy != 'bye' and self.evictChat():
+			return True
+		if self.policy == 'collapse' and chat:
+			self.drop()
+			return False
+		self.clear()
+		self.overflow()
+		return False
+
+	def evictChat(self):
+		"""Drop the oldest queued chat line, if there is one."""
+		if self.chat == 0:
+			return False
+		normal = self.normal
+		for i in xrange(len(normal)):
+			if normal[i][1]:
+				del normal[i]
+				self.chat = self.chat - 1
+				self.drop()
+				return True
+		return False
+
+	def drop(self):
+		self.dropped = self.dropped + 1
+		if self.meter is not None:
+			self.meter.dropped.inc()
+
+	def flush(self):
+		"""Hand every pending line to the transport."""
+		if self.pending:
+			pending      = self.pending
+			self.pending = []
+			if self.deflater is not None:
+				data = self.deflater.pack("".join(pending))
+				self.transport.write(data)
+				if self.meter is not None:
+					self.meter.sent.inc(len(data))
+				return
+			self.transport.writeSequence(pending)
+			if self.meter is not None:
+				self.meter.sent.inc(sum(map(len, pending)))
+
+	def compress(self, deflater):
+		"""Hand over what has been written so far as it is, and deflate
+		everything after it with deflater."""
+		self.flush()
+		assert self.urgent is None, 'cannot compress lines already queued'
+		self.deflater = deflater
+
+	def clear(self):
+		del self.pending[:]
+		self.urgent = None
+		self.normal = None
+		self.chat   = 0
+
+	def pauseProducing(self):
+		self.paused = True
+
+	def take(self):
+		"""Take the next queued line, or None once both lanes are empty."""
+		if self.urgent:
+			return self.urgent.popleft()
+		if self.normal:
+			line, chat = self.normal.popleft()
+			if chat:
+				self.chat = self.chat - 1
+			return line
+		self.urgent = None
+		self.normal = None
+		return None
+
+	def resumeProducing(self):
+		self.paused = False
+		write = self.transport.write
+		sent  = 0
+		if self.deflater is not None:
+			while not self.paused and self.urgent is not None:
+				lines = []
+				while len(lines) < self.CHUNK:
+					line = self.take()
+					if line is None:
+						break
+					lines.append(line)
+				if lines:
+					data = self.deflater.pack("".join(lines))
+					write(data)
+					sent = sent + len(data)
+		else:
+			while not self.paused:
+				if self.urgent:
+					line = self.urgent.popleft()
+				elif self.normal:
+					line, chat = self.normal.popleft()
+					if chat:
+						self.chat = self.chat - 1
+				else:
+					self.urgent = None
+					self.normal = None
+					break
+				write(line)
+				sent = sent + len(line)
+		if self.meter is not None:
+			self.meter.sent.inc(sent)
+
+	def stopProducing(self):
+		self.clear()
+
+classImplements(Outbound, IPushProducer)
@@ -0,0 +1,116 @@
+#!/usr/bin/python
+"""Benchmark for per-iteration write coalescing over loopback TCP.
+
+Connects members to one room, then has several of them say something in the
+same reactor iteration. Reports, per broadcast, how many writes the talkers
+handed to their transports and how many send() calls the server made, with
+coalescing on and with every line written as soon as it is sent.
+
+	python outboundBench.py [members] [senders]
+"""
+import sys, time
+from twisted.internet import reactor, protocol, tcp, abstract
+from haver.server.house import House
+from haver.server.thing import Room
+from haver.server.talker import HaverFactory
+from haver.server import outbound
+
+counts = dict(writes = 0, sends = 0)
+
+def counted(name, func):
+	def code(self, *args):
+		if isinstance(self, tcp.Server):
+			counts[name] = counts[name] + 1
+		return func(self, *args)
+	return code
+
+abstract.FileDescriptor.write         = counted('writes', abstract.FileDescriptor.write)
+abstract.FileDescriptor.writeSequence = counted('writes', abstract.FileDescriptor.writeSequence)
+tcp.Connection.writeSomeData          = counted('sends', tcp.Connection.writeSomeData)
+
+class Member(protocol.Protocol):
+	def connectionMade(self):
+		self.factory.members.append(self)
+		name = 'member%d' % len(self.factory.members)
+		self.transport.write("HAVER\tbench/1\nIDENT\t%s\nJOIN\tmain\n" % name)
+
+	def dataReceived(self, data):
+		self.factory.received(data.count("\n"))
+
+class Members(protocol.ClientFactory):
+	protocol = Member
+
+	def __init__(self):
+		self.members = []
+		self.lines   = 0
+		self.target  = None
+		self.done    = None
+
+	def received(self, lines):
+		self.lines = self.lines + lines
+		if self.target is not None and self.lines >= self.target:
+			self.target = None
+			self.done()
+
+def run(members, senders, coalesce):
+	if not coalesce:
+		write = outbound.Outbound.write
+		outbound.Outbound.write = lambda self, line, urgent = False, chat = False, flush = False: \
+			write(self, line, urgent, chat, True)
+
+	house   = House('bench')
+	house.add(Room('main'))
+	factory = HaverFactory(house)
+	talkers = []
+	build   = factory.buildProtocol
+	def keep(addr):
+		talker = build(addr)
+		talkers.append(talker)
+		return talker
+	factory.buildProtocol = keep
+	port    = reactor.listenTCP(0, factory, backlog = members, interface = '127.0.0.1')
+	clients = Members()
+	for i in range(members):
+		reactor.connectTCP('127.0.0.1', port.getHost().port, clients)
+
+	times   = []
+	results = dict()
+	def burst():
+		for talker in talkers[:senders]:
+			talker.invoke('IN', ['main', 'say', 'hello from ' + talker.user.name])
+	def joined():
+		clients.target   = clients.lines + senders * members
+		clients.done     = finished
+		counts['writes'] = counts['sends'] = 0
+		times.append(time.time())
+		reactor.callLater(0, burst)
+	def finished():
+		times.append(time.time())
+		# Connections closing on shutdown write PARTs; leave those out.
+		results.update(counts)
+		reactor.stop()
+
+	# Everyone has joined once each member has had HAVER, HELLO, its own JOIN
+	# and the JOINs of everyone who joined after it.
+	clients.target = 2 * members + members * (members + 1) / 2
+	clients.done   = joined
+	reactor.run()
+	elapsed = times[1] - times[0]
+
+	print "%-10s %5d members %3d senders: %7.1f writes/broadcast %7.1f sends/broadcast %8.3fs" % (
+		coalesce and 'coalesced' or 'immediate', members, senders,
+		float(results['writes']) / senders, float(results['sends']) / senders, elapsed)
+
+if __name__ == '__main__':
+	members  = 500
+	senders  = 10
+	coalesce = True
+	args = sys.argv[1:]
+	if '--immediate' in args:
+		args.remove('--immediate')
+		coalesce = False
+	if len(args) > 0:
+		members = int(args[0])
+	if len(args) > 1:
+		senders = int(args[1])
+	run(members, senders, coalesce)
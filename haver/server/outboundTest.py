@@ -0,0 +1,135 @@
+#!/usr/bin/python
+import unittest, zlib
+from twisted.internet import task
+from twisted.test import proto_helpers
+from haver.server.outbound import Outbound, Coalescer
+from haver.server.deflate  import Deflater
+
+class Transport(proto_helpers.StringTransport):
+	def __init__(self):
+		proto_helpers.StringTransport.__init__(self)
+		self.writes = 0
+
+	def write(self, data):
+		self.writes = self.writes + 1
+		proto_helpers.StringTransport.write(self, data)
+
+	def writeSequence(self, data):
+		self.writes = self.writes + 1
+		proto_helpers.StringTransport.write(self, "".join(data))
+
+class TestOutbound(unittest.TestCase):
+	def setUp(self):
+		self.transport = Transport()
+		self.overflows = []
+		self.clock     = task.Clock()
+		self.coalescer = Coalescer(self.clock)
+
+	def outbound(self, policy):
+		out = Outbound(self.transport, lambda: self.overflows.append(1), 3, policy, self.coalescer)
+		self.assertTrue(self.transport.producer is out)
+		self.assertTrue(self.transport.streaming)
+		return out
+
+	def testCoalescedUntilEndOfIteration(self):
+		out = self.outbound('drop')
+		other = Outbound(Transport(), None, 3, 'drop', self.coalescer)
+		out.write("a\n")
+		out.write("b\n", chat = True)
+		other.write("c\n")
+		self.assertEqual(self.transport.value(), "")
+		self.assertEqual(out.depth, 0)
+		self.clock.advance(0)
+		self.assertEqual(self.transport.value(), "a\nb\n")
+		self.assertEqual(self.transport.writes, 1)
+		self.assertEqual(other.transport.value(), "c\n")
+
+	def testFlushingWriteBypassesCoalescer(self):
+		out = self.outbound('drop')
+		out.write("a\n")
+		out.write("PING\n", urgent = True, flush = True)
+		self.assertEqual(self.transport.value(), "a\nPING\n")
+		self.clock.advance(0)
+		self.assertEqual(self.transport.writes, 1)
+
+	def testUrgentLaneJumpsQueue(self):
+		out = self.outbound('drop')
+		out.pauseProducing()
+		out.write("chat\n", chat = True)
+		out.write("PING\n", urgent = True)
+		self.assertEqual(out.depth, 2)
+		self.assertEqual(self.transport.value(), "")
+		out.resumeProducing()
+		self.assertEqual(self.transport.value(), "PING\nchat\n")
+		self.assertEqual(out.depth, 0)
+
+	def testDropPolicy(self):
+		out = self.outbound('drop')
+		out.pauseProducing()
+		for line in ["1\n", "2\n", "3\n", "4\n"]:
+			out.write(line, chat = True)
+		self.assertEqual((out.depth, out.dropped), (3, 1))
+		out.write("JOIN\n")
+		self.assertEqual((out.depth, out.dropped), (3, 2))
+		out.resumeProducing()
+		self.assertEqual(self.transport.value(), "2\n3\nJOIN\n")
+		self.assertEqual(self.overflows, [])
+
+	def testCollapsePolicy(self):
+		out = self.outbound('collapse')
+		out.pauseProducing()
+		for line in ["1\n", "2\n", "3\n", "4\n", "5\n"]:
+			out.write(line, chat = True)
+		out.resumeProducing()
+		self.assertEqual(self.transport.value(), "3\n4\n5\n")
+		self.assertEqual(out.dropped, 2)
+
+	def testOverflowWhenNothingToDrop(self):
+		out = self.outbound('drop')
+		out.pauseProducing()
+		for line in ["1\n", "2\n", "3\n", "4\n"]:
+			out.write(line)
+		self.assertEqual(self.overflows, [1])
+		self.assertEqual(out.depth, 0)
+
+	def testByePolicy(self):
+		out = self.outbound('bye')
+		out.pauseProducing()
+		for line in ["1\n", "2\n", "3\n", "4\n"]:
+			out.write(line, chat = True)
+		self.assertEqual(self.overflows, [1])
+
+	def testPausedAgainWhileDraining(self):
+		out = self.outbound('drop')
+		out.pauseProducing()
+		out.write("1\n")
+		out.write("2\n")
+		write = self.transport.write
+		def pausing(data):
+			write(data)
+			out.pauseProducing()
+		self.transport.write = pausing
+		out.resumeProducing()
+		self.assertEqual(self.transport.value(), "1\n")
+		self.assertEqual(out.depth, 1)
+
+	def testCompressedInChunks(self):
+		out = self.outbound('drop')
+		out.limit = 1000
+		out.write("HAVER\n")
+		out.compress(Deflater())
+		self.assertEqual(self.transport.value(), "HAVER\n")
+		self.transport.clear()
+		out.pauseProducing()
+		for i in range(out.CHUNK + 1):
+			out.write("IN\tmain\tal\tsay\t%d\n" % i, chat = True)
+		self.transport.writes = 0
+		out.resumeProducing()
+		self.assertEqual(self.transport.writes, 2)
+		self.assertEqual(out.depth, 0)
+		lines = zlib.decompressobj().decompress(self.transport.value()).split("\n")
+		self.assertEqual(len(lines), out.CHUNK + 2)
+		self.assertEqual(lines[-2], "IN\tmain\tal\tsay\t%d" % out.CHUNK)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,192 @@
+"""Links between haverd nodes, so that users on different servers share rooms.
+
+Peers speak the link protocol of haver.server.link, after each has said
+
+	PEER   node version nonce
+	AUTH   proof
+
+where node is its host name, nonce is fresh random hex, and proof is the
+HMAC-SHA256, keyed with the secret all the nodes share, of the other side's
+nonce, a tab and node. A node only links to the nodes it was told of, and
+only once they have sent the right proof; it refuses anyone else, and a
+second link to the same peer, with BYE and drops the connection. Links must
+form a tree: each node passes what it hears from one peer on to the others,
+and a loop would echo forever.
+
+No node is in charge. When two nodes both have a user by the same name, the
+one that logged in first wins on every node, ties going to the node whose
+name sorts first. The node the loser is on disconnects it with BYE
+collision, so peers never KILL each other's users.
+
+A peer may only change a room as its own users could: close it or turn its
+history on or off when the room's owner is logged in through that peer. It
+may change a room's owner and secure flag only as merging the room with its
+own would, to an owner that sorts first and to secure."""
+
+import os, hmac, hashlib
+
+from twisted.python            import log
+from twisted.internet.protocol import Factory
+
+from haver.server.errors import Fail
+from haver.server.link   import LinkTalker, LinkClientFactory, home, shared
+import haver.server
+
+def rank(user):
+	return (user.stamp, home(user))
+
+def proof(secret, nonce, node):
+	return hmac.new(secret, nonce + "\t" + node, hashlib.sha256).hexdigest()
+
+class PeerTalker(LinkTalker):
+	# The peer, once it has proved who it is.
+	node    = None
+	# Who it said it was in PEER.
+	claimed = None
+
+	def connectionMade(self):
+		self.mesh   = self.factory.mesh
+		self.house  = self.mesh.house
+		self.nonce  = os.urandom(16).encode('hex')
+		# Rooms this peer opened here; it may set their history while syncing.
+		self.opened = set()
+		self.send('PEER', self.house.host, haver.server.version, self.nonce)
+
+	def connectionLost(self, reason):
+		if self.node is not None:
+			log.msg('Lost link to peer %s' % self.node)
+			self.mesh.detach(self)
+
+	def lineReceived(self, line):
+		if self.node is None and line.split("\t", 1)[0] not in ('PEER', 'AUTH', 'BYE'):
+			log.msg('Peer %s spoke before proving who it is' % str(self.transport.getPeer()))
+			self.transport.loseConnection()
+			return
+		LinkTalker.lineReceived(self, line)
+
+	def L_PEER(self, node, version, nonce = None):
+		if self.claimed is not None:
+			return
+		if node == self.house.host:
+			self.bye('myself')
+		elif node not in self.factory.nodes:
+			self.bye('unknown.peer')
+		elif not nonce:
+			self.bye('no.secret')
+		elif self.linked(node):
+			self.bye('existing.peer')
+		else:
+			self.claimed = node
+			self.version = version
+			self.send('AUTH', proof(self.factory.secret, nonce, self.house.host))
+
+	def L_AUTH(self, given):
+		if self.claimed is None or self.node is not None:
+			return
+		expected = proof(self.factory.secret, self.nonce, self.claimed)
+		if not hmac.compare_digest(given, expected):
+			self.bye('bad.secret')
+		elif self.linked(self.claimed):
+			self.bye('existing.peer')
+		else:
+			log.msg('Linked to peer %s (%s) at %s' % (self.claimed, self.version, str(self.transport.getPeer())))
+			self.node = self.claimed
+			self.mesh.attach(self)
+
+	def linked(self, node):
+		return node in [ getattr(x, 'node', None) for x in self.mesh.links ]
+
+	def L_BYE(self, why, *rest):
+		log.msg('Peer %s refused link: %s' % (str(self.transport.getPeer()), why))
+		self.transport.loseConnection()
+
+	def bye(self, why):
+		log.msg('Refusing link from %s: %s' % (str(self.transport.getPeer()), why))
+		self.send('BYE', why)
+		self.transport.loseConnection()
+
+	def L_USER(self, name, secure, address, version, stamp, node):
+		house = self.house
+		try:
+			existing = house.lookup('user', name)
+		except Fail:
+			existing = None
+		if existing is not None:
+			if rank(existing) <= (float(stamp), node):
+				# Ours wins. The other side will decide the same when it
+				# hears about ours.
+				return
+			if existing.talker is not None:
+				existing.talker.disconnect('collision')
+			else:
+				self.mesh.drop(existing, 'collision')
+		LinkTalker.L_USER(self, name, secure, address, version, stamp, node)
+
+	def L_KILL(self, name, reason):
+		log.msg('Peer %s asked to KILL %s, which peers do not do' % (self.node, name))
+
+	def L_ROOM(self, name, owner, secure):
+		"""Rooms of the same name are the same room. If the nodes disagree
+		about it, both keep the owner that sorts first and it is secure if
+		either says so."""
+		house = self.house
+		try:
+			room = house.lookup('room', name)
+		except Fail:
+			LinkTalker.L_ROOM(self, name, owner, secure)
+			self.opened.add(house.lookup('room', name).key)
+			return
+		self.L_SET(name, 'owner', owner)
+		self.L_SET(name, 'secure', secure)
+
+	def L_CLOSE(self, name):
+		room = self.house.lookup('room', name)
+		if not self.speaksFor(room):
+			log.msg('Peer %s may not close %s' % (self.node, room.name))
+			return
+		LinkTalker.L_CLOSE(self, name)
+
+	def L_SET(self, name, key, value):
+		room = self.house.lookup('room', name)
+		if key == 'owner':
+			allowed = value < room.owner
+		elif key == 'secure':
+			allowed = value == 'yes' and room.secure != 'yes'
+		else:
+			allowed = self.speaksFor(room) or room.key in self.opened
+		if allowed:
+			LinkTalker.L_SET(self, name, key, value)
+
+	def L_SYNCED(self):
+		self.opened.clear()
+		LinkTalker.L_SYNCED(self)
+
+	def speaksFor(self, room):
+		"""Whether the owner of room is logged in through this peer."""
+		try:
+			user = self.house.lookup('user', room.owner)
+		except Fail:
+			return False
+		return self.owns(user)
+
+class PeerFactory(Factory):
+	"""Accepts links from the nodes named in nodes that know secret."""
+	protocol = PeerTalker
+
+	def __init__(self, house, nodes, secret):
+		if not nodes or not secret:
+			raise ValueError('peer links need the nodes allowed and a secret')
+		self.mesh   = shared(house)
+		self.nodes  = frozenset(nodes)
+		self.secret = secret
+
+class PeerClientFactory(LinkClientFactory):
+	"""Keeps this node linked to another, relinking whenever the link drops."""
+	protocol = PeerTalker
+
+	def __init__(self, house, nodes, secret):
+		if not nodes or not secret:
+			raise ValueError('peer links need the nodes allowed and a secret')
+		LinkClientFactory.__init__(self, shared(house))
+		self.nodes  = frozenset(nodes)
+		self.secret = secret
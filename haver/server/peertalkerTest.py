@@ -0,0 +1,191 @@
+#!/usr/bin/python
+import unittest, os, sys, time, subprocess, tempfile
+from twisted.test.proto_helpers import StringTransport
+from haver.server.clusterTest import Client, freeport, root
+from haver.server.house       import House
+from haver.server.thing       import Room
+from haver.server.link        import RemoteUser
+from haver.server.peertalker  import PeerFactory, proof
+from haver.protocol           import parse, deparse
+
+NODES = ['a.test', 'b.test', 'c.test']
+
+class TestAuth(unittest.TestCase):
+	def setUp(self):
+		self.house   = House('a.test')
+		self.house.add(Room('main', 'zed'))
+		self.factory = PeerFactory(self.house, NODES, 'sekrit')
+
+	def link(self, *lines):
+		peer = self.factory.buildProtocol(('127.0.0.1', 0))
+		peer.makeConnection(StringTransport())
+		for cmd, args in lines:
+			peer.lineReceived(deparse(cmd, args))
+		return peer
+
+	def said(self, peer):
+		return [ parse(line) for line in peer.transport.value().splitlines() ]
+
+	def nonce(self, peer):
+		cmd, args = self.said(peer)[0]
+		self.assertEqual((cmd, args[0]), ('PEER', 'a.test'))
+		return args[2]
+
+	def authed(self, node = 'b.test'):
+		peer = self.link(('PEER', (node, '0.1', 'cafe')))
+		peer.lineReceived(deparse('AUTH', (proof('sekrit', self.nonce(peer), node),)))
+		self.assertEqual(peer.node, node)
+		return peer
+
+	def testWrongSecretRefused(self):
+		peer = self.link(('PEER', ('b.test', '0.1', 'cafe')))
+		self.assertTrue(('AUTH', [proof('sekrit', 'cafe', 'a.test')]) in self.said(peer))
+		peer.lineReceived(deparse('AUTH', (proof('guess', self.nonce(peer), 'b.test'),)))
+		self.assertTrue(('BYE', ['bad.secret']) in self.said(peer))
+		self.assertTrue(peer.transport.disconnecting)
+		self.assertEqual(self.factory.mesh.links, [])
+
+	def testUnknownOrSecretlessRefused(self):
+		peer = self.link(('PEER', ('evil.test', '0.1', 'cafe')))
+		self.assertEqual(self.said(peer)[1:], [('BYE', ['unknown.peer'])])
+		peer = self.link(('PEER', ('b.test', '0.1')))
+		self.assertEqual(self.said(peer)[1:], [('BYE', ['no.secret'])])
+		self.assertEqual(self.factory.mesh.links, [])
+
+	def testNothingHeardBeforeAuth(self):
+		peer = self.link(('PEER', ('b.test', '0.1', 'cafe')),
+			('USER', ('mallory', 'no', 'x', 'x', '0.0', 'b.test')))
+		self.assertTrue(peer.transport.disconnecting)
+		self.assertRaises(Exception, self.house.lookup, 'user', 'mallory')
+
+	def testNoKill(self):
+		peer = self.authed()
+		user = RemoteUser('bob', None, 0.0, 'c.test')
+		user.talker  = self
+		user.secure  = 'no'
+		user.address = user.version = 'x'
+		self.house.add(user)
+		peer.lineReceived(deparse('KILL', ('bob', 'collision')))
+		self.assertEqual(self.house.lookup('user', 'bob'), user)
+
+	def disconnect(self, reason):
+		self.fail('peer killed a user')
+
+	def testOnlyOwnersChangeRooms(self):
+		peer = self.authed()
+		peer.lineReceived(deparse('SET', ('main', 'history', 'yes')))
+		peer.lineReceived(deparse('SET', ('main', 'owner', 'zzz')))
+		peer.lineReceived(deparse('SET', ('main', 'secure', 'no')))
+		peer.lineReceived(deparse('CLOSE', ('main',)))
+		room = self.house.lookup('room', 'main')
+		self.assertEqual((room.owner, room.history), ('zed', 'no'))
+
+		peer.lineReceived(deparse('USER', ('zed', 'no', 'x', 'x', '0.0', 'b.test')))
+		peer.lineReceived(deparse('SET', ('main', 'history', 'yes')))
+		self.assertEqual(room.history, 'yes')
+		peer.lineReceived(deparse('CLOSE', ('main',)))
+		self.assertEqual(self.house.lookup_namespace('room'), {})
+
+class TestPeers(unittest.TestCase):
+	def setUp(self):
+		self.null    = open(os.devnull, 'w')
+		self.nodes   = dict()
+		self.clients = []
+		fd, self.secret = tempfile.mkstemp()
+		os.write(fd, 'sekrit\n')
+		os.close(fd)
+
+	def tearDown(self):
+		for client in self.clients:
+			client.close()
+		for name in self.nodes.keys():
+			self.stop(name)
+		self.null.close()
+		os.remove(self.secret)
+
+	def start(self, name, haver, link, *peers):
+		env = dict(os.environ)
+		env['PYTHONPATH'] = root
+		argv = [sys.executable, '-m', 'haver.server.cluster', 'node', '--host', name,
+			'--haver', str(haver), '--irc', '0', '--link', str(link), '--secret-file', self.secret]
+		for node in NODES:
+			argv = argv + ['--node', node]
+		for peer in peers:
+			argv = argv + ['--peer', '127.0.0.1:%d' % peer]
+		self.nodes[name] = subprocess.Popen(argv, stdout = self.null, stderr = self.null, env = env)
+
+	def stop(self, name):
+		proc = self.nodes.pop(name)
+		proc.terminate()
+		proc.wait()
+
+	def client(self, port, name = None):
+		client = Client(port, name)
+		self.clients.append(client)
+		return client
+
+	def waitFor(self, client, name):
+		"""Wait until client's node knows about user name."""
+		deadline = time.time() + 15
+		while True:
+			client.send('USERS')
+			if name in client.expect('USERS'):
+				return
+			self.assertTrue(time.time() < deadline, 'never heard of %s' % name)
+			time.sleep(0.1)
+
+	def testChain(self):
+		ports = [ freeport() for i in range(5) ]
+		self.start('a.test', ports[0], ports[1])
+		self.start('b.test', ports[2], ports[3], ports[1])
+		self.start('c.test', ports[4], 0, ports[3])
+		alice = self.client(ports[0], 'alice')
+		carol = self.client(ports[4], 'carol')
+		self.waitFor(alice, 'carol')
+		alice.send('JOIN', 'main')
+		alice.expect('JOIN', 'main', 'alice')
+		carol.send('JOIN', 'main')
+		alice.expect('JOIN', 'main', 'carol')
+		alice.send('IN', 'main', 'say', 'hello')
+		carol.expect('IN', 'main', 'alice', 'say', 'hello')
+		carol.send('TO', 'alice', 'say', 'psst')
+		alice.expect('FROM', 'carol', 'say', 'psst')
+
+	def testDropAndResync(self):
+		ports = [ freeport() for i in range(3) ]
+		self.start('a.test', ports[0], ports[1])
+		self.start('b.test', ports[2], 0, ports[1])
+		alice = self.client(ports[0], 'alice')
+		bob   = self.client(ports[2], 'bob')
+		self.waitFor(bob, 'alice')
+		alice.send('JOIN', 'main')
+		alice.expect('JOIN', 'main', 'alice')
+		bob.send('JOIN', 'main')
+		bob.expect('JOIN', 'main', 'bob')
+
+		self.stop('a.test')
+		bob.expect('PART', 'main', 'alice', 'quit', 'netsplit')
+		dave = self.client(ports[2], 'dave')
+
+		self.start('a.test', ports[0], ports[1])
+		amy = self.client(ports[0], 'amy')
+		self.waitFor(amy, 'bob')
+		amy.send('USERSOF', 'main')
+		self.assertEqual(amy.expect('USERSOF', 'main')[1:], ['bob'])
+		amy.send('JOIN', 'main')
+		bob.expect('JOIN', 'main', 'amy')
+
+		# dave logged in to b first, so b's dave wins wherever the clash is seen.
+		other = self.client(ports[0])
+		other.send('IDENT', 'dave')
+		cmd, args = other.read()
+		if cmd == 'HELLO':
+			self.assertEqual(other.expect('BYE'), ['collision'])
+		else:
+			self.assertEqual((cmd, args[1]), ('FAIL', 'existing.thing'))
+		dave.send('POKE', 'still')
+		dave.expect('OUCH', 'still')
+		self.waitFor(amy, 'dave')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+"""Telling rooms about users who quit, once per co-member.
+
+A user who quits leaves every room at once. Clients that sent the quit
+extension in HAVER are told with one QUIT however many rooms they shared
+with the user; others get a PART for each room, as always. The rooms drop
+the user straight away, but their members are told at the end of the
+reactor iteration, so when many users drop together (a netsplit, a load
+balancer restart) each member hears of each of them once, in one pass.
+Anything else sent to a room, or anyone admitted to one, first flushes
+what is waiting, so nobody hears of things out of order."""
+
+from haver.protocol import Frame
+from haver.server   import core
+
+class Departures(object):
+	def __init__(self, clock = None):
+		if clock is None:
+			clock = core.clock()
+		self.clock   = clock
+		# (room, user, PART frame, QUIT frame), in the order they left.
+		self.pending = []
+		self.frames  = dict()
+		self.call    = None
+
+	def quit(self, user, why):
+		"""Take user out of every room it is in."""
+		for room in list(user.rooms):
+			self.part(room, user, why)
+
+	def part(self, room, user, why):
+		"""Take user out of room, telling its members later."""
+		room.evict(user)
+		part = Frame('PART', (room.name, user.name, 'quit', why))
+		quit = self.frames.get(user)
+		if quit is None:
+			quit = self.frames[user] = Frame('QUIT', (user.name, why))
+		self.pending.append((room, user, part, quit))
+		if room.house is not None:
+			room.house.broadcast(room, part)
+		if self.call is None:
+			self.call = self.clock.callLater(0, self.fire)
+
+	def fire(self):
+		self.call = None
+		self.flush()
+
+	def flush(self):
+		"""Tell the members of every room left since the last flush."""
+		pending, self.pending = (self.pending, [])
+		self.frames = dict()
+		told = dict()
+		for room, user, part, quit in pending:
+			seen = told.get(user)
+			if seen is None:
+				seen = told[user] = set()
+			for member in room.users:
+				talker = member.talker
+				if talker is None:
+					continue
+				if talker.quits:
+					if member not in seen:
+						seen.add(member)
+						talker.sendFrame(quit)
+				else:
+					talker.sendFrame(part)
+
+departures = None
+
+def shared():
+	"""Return the process-wide Departures, creating it on first use."""
+	global departures
+	if departures is None:
+		departures = Departures()
+	return departures
+
+def settle():
+	"""Flush departures still waiting for the end of the iteration."""
+	if departures is not None and departures.pending:
+		departures.flush()
@@ -0,0 +1,59 @@
+#!/usr/bin/python
+import unittest
+from twisted.internet import address
+from twisted.test.proto_helpers import StringTransport
+from haver.server.house  import House
+from haver.server.talker import HaverFactory
+from haver.server        import outbound, quits
+
+class TestQuits(unittest.TestCase):
+	def setUp(self):
+		self.factory = HaverFactory(House('test'))
+
+	def connect(self, name, extensions = ''):
+		transport = StringTransport(peerAddress = address.IPv4Address('TCP', '10.0.0.1', 1))
+		talker    = self.factory.buildProtocol(transport.getPeer())
+		talker.makeConnection(transport)
+		talker.dataReceived("HAVER\ttest/1\t%s\nIDENT\t%s\n" % (extensions, name))
+		for room in ('one', 'two', 'three'):
+			if name == 'al':
+				talker.dataReceived("OPEN\t%s\n" % room)
+			talker.dataReceived("JOIN\t%s\n" % room)
+		return talker
+
+	def read(self, talker):
+		quits.shared().flush()
+		outbound.shared().flush()
+		data = talker.transport.value()
+		talker.transport.clear()
+		return data.split("\n")[:-1]
+
+	def testAdvertised(self):
+		al = self.connect('al')
+		self.assertTrue('quit' in self.read(al)[0].split("\t")[3].split(','))
+
+	def testOneQuitPerCoMember(self):
+		al  = self.connect('al', 'quit')
+		bo  = self.connect('bo')
+		cy  = self.connect('cy')
+		self.read(al), self.read(bo)
+		cy.connectionLost(None)
+		self.assertEqual(self.read(al), ["QUIT\tcy\tclosed"])
+		self.assertEqual(sorted(self.read(bo)),
+			[ "PART\t%s\tcy\tquit\tclosed" % x for x in ('one', 'three', 'two') ])
+
+	def testMassDisconnectInOrder(self):
+		al = self.connect('al', 'quit')
+		cy = self.connect('cy')
+		di = self.connect('di')
+		self.read(al)
+		cy.connectionLost(None)
+		di.connectionLost(None)
+		# Someone joining in the same iteration is announced after them.
+		self.connect('cy')
+		lines = self.read(al)
+		self.assertEqual(lines[:2], ["QUIT\tcy\tclosed", "QUIT\tdi\tclosed"])
+		self.assertEqual(lines[2], "JOIN\tone\tcy")
+
+if __name__ == '__main__':
+    unittest.main()
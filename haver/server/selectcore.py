@@ -0,0 +1,424 @@
+"""A network core without twisted's reactor: one loop on epoll (or poll
+where there is no epoll), timers in a heap, and TCP transports with the
+parts of twisted's ITransport that the talkers use.
+
+Loop answers to the same calls as the reactor does for the things the
+server and loadBench do with it (callLater, seconds, listenTCP,
+connectTCP, callWhenRunning, run, stop), so twisted's protocols and
+factories, Deferreds and LoopingCalls work on it unchanged. There is no
+TLS; see haver.server.core for picking a core."""
+
+import socket, errno, heapq, select, signal, time
+from twisted.internet import address, error
+from twisted.python   import failure, log
+
+READ  = select.POLLIN | select.POLLPRI
+WRITE = select.POLLOUT
+GONE  = select.POLLERR | select.POLLHUP
+
+# Errors that only mean "not now".
+AGAIN = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+class Call(object):
+	"""A timer, as returned by Loop.callLater."""
+	__slots__ = ('time', 'func', 'args', 'kw', 'cancelled', 'called')
+
+	def __init__(self, when, func, args, kw):
+		self.time      = when
+		self.func      = func
+		self.args      = args
+		self.kw        = kw
+		self.cancelled = False
+		self.called    = False
+
+	def getTime(self):
+		return self.time
+
+	def active(self):
+		return not (self.cancelled or self.called)
+
+	def cancel(self):
+		if self.cancelled:
+			raise error.AlreadyCancelled()
+		if self.called:
+			raise error.AlreadyCalled()
+		self.cancelled = True
+
+class Poller(object):
+	"""epoll or poll, taking timeouts in seconds, or None to wait forever."""
+
+	def __init__(self):
+		if hasattr(select, 'epoll'):
+			self.poller = select.epoll()
+			self.scale  = 1.0
+			self.never  = -1
+		else:
+			self.poller = select.poll()
+			self.scale  = 1000.0
+			self.never  = None
+
+	def register(self, fd, mask):
+		self.poller.register(fd, mask)
+
+	def modify(self, fd, mask):
+		self.poller.modify(fd, mask)
+
+	def unregister(self, fd):
+		self.poller.unregister(fd)
+
+	def poll(self, timeout):
+		if timeout is None:
+			return self.poller.poll(self.never)
+		return self.poller.poll(timeout * self.scale)
+
+class Loop(object):
+	def __init__(self):
+		self.poller   = Poller()
+		self.handlers = dict()
+		self.timers   = []
+		self.seq      = 0
+		self.running  = False
+		self.starting = []
+		# Connections with something to send, tried before the next wait.
+		self.dirty    = []
+
+	def seconds(self):
+		return time.time()
+
+	def callLater(self, delay, func, *args, **kw):
+		call = Call(time.time() + delay, func, args, kw)
+		heapq.heappush(self.timers, (call.time, self.seq, call))
+		self.seq = self.seq + 1
+		return call
+
+	def callWhenRunning(self, func, *args, **kw):
+		if self.running:
+			func(*args, **kw)
+		else:
+			self.starting.append((func, args, kw))
+
+	def listenTCP(self, port, factory, backlog = 50, interface = ''):
+		return Port(self, port, factory, backlog, interface)
+
+	def connectTCP(self, host, port, factory, timeout = 30, bindAddress = None):
+		return Client(self, host, port, factory)
+
+	def add(self, handler, mask):
+		self.handlers[handler.fileno] = handler
+		self.poller.register(handler.fileno, mask)
+
+	def modify(self, handler, mask):
+		self.poller.modify(handler.fileno, mask)
+
+	def remove(self, handler):
+		if self.handlers.pop(handler.fileno, None) is not None:
+			self.poller.unregister(handler.fileno)
+
+	def run(self):
+		"""Run until stop() is called, or SIGINT or SIGTERM arrive."""
+		self.running = True
+		saved = []
+		for signum in (signal.SIGINT, signal.SIGTERM):
+			saved.append((signum, signal.signal(signum, lambda signum, frame: self.stop())))
+		try:
+			starting, self.starting = (self.starting, [])
+			for func, args, kw in starting:
+				func(*args, **kw)
+			while self.running:
+				self.runUntilCurrent()
+				self.send()
+				if self.running:
+					self.doIteration(self.timeout())
+		finally:
+			for signum, handler in saved:
+				signal.signal(signum, handler)
+
+	def stop(self):
+		self.running = False
+
+	def send(self):
+		"""Try to send what every connection has written. Only those the
+		socket cannot take it all from wait to be told they are writable."""
+		dirty, self.dirty = (self.dirty, [])
+		for connection in dirty:
+			connection.queued = False
+			connection.doWrite()
+
+	def timeout(self):
+		if self.dirty:
+			return 0.0
+		timers = self.timers
+		while timers and timers[0][2].cancelled:
+			heapq.heappop(timers)
+		if not timers:
+			return None
+		return max(0.0, timers[0][0] - time.time())
+
+	def runUntilCurrent(self):
+		"""Run the timers that are due. Timers they set, even for now, wait
+		for the next iteration, as they do with the reactor."""
+		timers = self.timers
+		now    = time.time()
+		due    = []
+		while timers and timers[0][0] <= now:
+			due.append(heapq.heappop(timers)[2])
+		for call in due:
+			if call.cancelled:
+				continue
+			call.called = True
+			try:
+				call.func(*call.args, **call.kw)
+			except:
+				log.err()
+
+	def doIteration(self, timeout):
+		try:
+			events = self.poller.poll(timeout)
+		except (IOError, OSError, select.error), e:
+			if e.args[0] == errno.EINTR:
+				return
+			raise
+		handlers = self.handlers
+		for fd, mask in events:
+			handler = handlers.get(fd)
+			if handler is not None and mask & (READ | GONE):
+				handler.doRead()
+			handler = handlers.get(fd)
+			if handler is not None and mask & WRITE:
+				handler.doWrite()
+
+def peerOf(sock):
+	host, port = sock.getpeername()[:2]
+	return address.IPv4Address('TCP', host, port)
+
+def hostOf(sock):
+	host, port = sock.getsockname()[:2]
+	return address.IPv4Address('TCP', host, port)
+
+class Connection(object):
+	"""A connected socket and the protocol it talks to.
+
+	Written data is buffered and sent once the loop has run everything that
+	was ready, before it waits again; what the socket will not take is sent
+	when it says it is writable. Like
+	twisted's, once more than bufferSize bytes are waiting a registered
+	producer is paused, and it is resumed when they have all gone."""
+	bufferSize = 65536
+
+	def __init__(self, loop, sock, protocol):
+		sock.setblocking(False)
+		self.loop          = loop
+		self.socket        = sock
+		self.fileno        = sock.fileno()
+		self.protocol      = protocol
+		self.host          = hostOf(sock)
+		self.peer          = peerOf(sock)
+		self.buffer        = []
+		self.buffered      = 0
+		self.writing       = False
+		self.queued        = False
+		self.producer      = None
+		self.paused        = False
+		self.disconnecting = False
+		self.disconnected  = False
+		loop.add(self, READ)
+		protocol.makeConnection(self)
+
+	def getPeer(self):
+		return self.peer
+
+	def getHost(self):
+		return self.host
+
+	def registerProducer(self, producer, streaming):
+		self.producer = producer
+
+	def unregisterProducer(self):
+		self.producer = None
+
+	def write(self, data):
+		if not data or self.disconnected:
+			return
+		self.buffer.append(data)
+		self.buffered = self.buffered + len(data)
+		self.wake()
+		if self.producer is not None and not self.paused and self.buffered > self.bufferSize:
+			self.paused = True
+			self.producer.pauseProducing()
+
+	def writeSequence(self, data):
+		self.write("".join(data))
+
+	def loseConnection(self):
+		"""Close once everything written so far has been sent."""
+		if self.disconnected or self.disconnecting:
+			return
+		self.disconnecting = True
+		self.wake()
+
+	def wake(self):
+		if not self.writing and not self.queued:
+			self.queued = True
+			self.loop.dirty.append(self)
+
+	def waitWritable(self):
+		if not self.writing:
+			self.writing = True
+			self.loop.modify(self, READ | WRITE)
+
+	def doRead(self):
+		try:
+			data = self.socket.recv(65536)
+		except socket.error, e:
+			if e.args[0] in AGAIN:
+				return
+			self.close(error.ConnectionLost(e))
+			return
+		if not data:
+			self.close(error.ConnectionDone())
+			return
+		try:
+			self.protocol.dataReceived(data)
+		except:
+			log.err()
+			self.close(error.ConnectionLost())
+
+	def doWrite(self):
+		if self.disconnected:
+			return
+		if self.buffer:
+			if len(self.buffer) == 1:
+				data = self.buffer[0]
+			else:
+				data = "".join(self.buffer)
+			try:
+				sent = self.socket.send(data)
+			except socket.error, e:
+				if e.args[0] in AGAIN:
+					self.waitWritable()
+					return
+				self.close(error.ConnectionLost(e))
+				return
+			if sent < len(data):
+				self.buffer   = [data[sent:]]
+				self.buffered = len(data) - sent
+				self.waitWritable()
+				return
+			self.buffer   = []
+			self.buffered = 0
+			if self.paused:
+				self.paused = False
+				self.producer.resumeProducing()
+				if self.buffer:
+					return
+		if self.disconnecting:
+			self.close(error.ConnectionDone())
+		elif self.writing:
+			self.writing = False
+			self.loop.modify(self, READ)
+
+	def close(self, reason):
+		if self.disconnected:
+			return
+		self.disconnected  = True
+		self.disconnecting = True
+		self.loop.remove(self)
+		self.socket.close()
+		producer, self.producer = (self.producer, None)
+		if producer is not None:
+			producer.stopProducing()
+		self.protocol.connectionLost(failure.Failure(reason))
+		self.lost(reason)
+
+	def lost(self, reason):
+		pass
+
+class Port(object):
+	"""A listening socket, handing each connection to factory."""
+	accepts = 100
+
+	def __init__(self, loop, port, factory, backlog, interface):
+		sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+		sock.bind((interface, port))
+		sock.listen(backlog)
+		sock.setblocking(False)
+		self.loop    = loop
+		self.socket  = sock
+		self.fileno  = sock.fileno()
+		self.factory = factory
+		factory.doStart()
+		loop.add(self, READ)
+
+	def getHost(self):
+		return hostOf(self.socket)
+
+	def doRead(self):
+		for i in xrange(self.accepts):
+			try:
+				sock, peer = self.socket.accept()
+			except socket.error, e:
+				if e.args[0] in AGAIN:
+					return
+				if e.args[0] in (errno.EMFILE, errno.ENFILE, errno.ENOBUFS, errno.ENOMEM, errno.ECONNABORTED):
+					log.msg('Could not accept new connection: %s' % e)
+					return
+				raise
+			protocol = self.factory.buildProtocol(address.IPv4Address('TCP', peer[0], peer[1]))
+			if protocol is None:
+				sock.close()
+				continue
+			Connection(self.loop, sock, protocol)
+
+	def doWrite(self):
+		pass
+
+	def stopListening(self):
+		if self.socket is not None:
+			self.loop.remove(self)
+			self.socket.close()
+			self.socket = None
+			self.factory.doStop()
+
+class Client(object):
+	"""An outgoing connection to host and port for a twisted ClientFactory."""
+
+	def __init__(self, loop, host, port, factory):
+		self.loop    = loop
+		self.factory = factory
+		self.socket  = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+		self.socket.setblocking(False)
+		self.fileno  = self.socket.fileno()
+		factory.doStart()
+		factory.startedConnecting(self)
+		code = self.socket.connect_ex((host, port))
+		if code not in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+			loop.callLater(0, self.failed, code)
+		else:
+			loop.add(self, WRITE)
+
+	def doRead(self):
+		self.doWrite()
+
+	def doWrite(self):
+		self.loop.remove(self)
+		code = self.socket.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+		if code:
+			self.failed(code)
+			return
+		protocol = self.factory.buildProtocol(peerOf(self.socket))
+		if protocol is None:
+			self.socket.close()
+			return
+		connection = Connection(self.loop, self.socket, protocol)
+		connection.lost = self.lost
+
+	def failed(self, code):
+		self.socket.close()
+		reason = error.ConnectError(string = errno.errorcode.get(code, str(code)))
+		self.factory.clientConnectionFailed(self, failure.Failure(reason))
+		self.factory.doStop()
+
+	def lost(self, reason):
+		self.factory.clientConnectionLost(self, failure.Failure(reason))
+		self.factory.doStop()
@@ -0,0 +1,74 @@
+#!/usr/bin/python
+import unittest
+from twisted.internet.protocol import ClientFactory
+from twisted.protocols.basic    import LineOnlyReceiver
+from haver.server.selectcore import Loop
+from haver.server.house      import House
+from haver.server.thing      import Room
+from haver.server.talker     import HaverFactory
+from haver.server.idle       import IdleWheel
+from haver.server            import outbound, quits
+
+class Client(LineOnlyReceiver):
+	delimiter = "\n"
+
+	def __init__(self, name, lines):
+		self.name  = name
+		self.lines = lines
+
+	def connectionMade(self):
+		self.sendLine("HAVER\ttest/1\nIDENT\t%s\nJOIN\tmain" % self.name)
+
+	def lineReceived(self, line):
+		self.lines.append((self.name, line))
+
+class Dialer(ClientFactory):
+	def __init__(self, client):
+		self.client = client
+
+	def buildProtocol(self, addr):
+		return self.client
+
+class TestSelectCore(unittest.TestCase):
+	def setUp(self):
+		self.loop  = Loop()
+		self.saved = (outbound.coalescer, quits.departures)
+		outbound.coalescer = outbound.Coalescer(self.loop)
+		quits.departures   = quits.Departures(self.loop)
+		house = House('test')
+		house.add(Room('main'))
+		self.factory = HaverFactory(house, idle = IdleWheel(clock = self.loop))
+		self.port    = self.loop.listenTCP(0, self.factory, interface = '127.0.0.1')
+
+	def tearDown(self):
+		self.port.stopListening()
+		outbound.coalescer, quits.departures = self.saved
+
+	def testTimers(self):
+		calls = []
+		self.loop.callLater(0.02, calls.append, 2)
+		self.loop.callLater(0, calls.append, 1)
+		self.loop.callLater(0.01, calls.append, 3).cancel()
+		self.loop.callLater(0.05, self.loop.stop)
+		self.loop.run()
+		self.assertEqual(calls, [1, 2])
+
+	def testServesHaver(self):
+		lines = []
+		port  = self.port.getHost().port
+		for name in ('al', 'bo'):
+			self.loop.connectTCP('127.0.0.1', port, Dialer(Client(name, lines)))
+		def check():
+			# Whoever joined first hears the other join too.
+			if ('al', "JOIN\tmain\tbo") in lines or ('bo', "JOIN\tmain\tal") in lines:
+				self.loop.stop()
+			else:
+				self.loop.callLater(0.01, check)
+		self.loop.callLater(0, check)
+		self.loop.callLater(5, self.loop.stop)
+		self.loop.run()
+		self.assertTrue(('al', "HELLO\tal\t127.0.0.1") in lines)
+		self.assertTrue(('bo', "JOIN\tmain\tbo") in lines)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,12 +1,80 @@
+"""TLS contexts for the Haver listener.
+
+SSLContextFactory builds one context and hands it to every connection, so
+the sessions it caches and the tickets it issues stay good across
+connections, and a client that reconnects resumes its session instead of
+doing a full handshake. Only TLS 1.2 and later are offered, and TLS 1.2
+only with forward secret AEAD ciphers.
+
+The certificate chain and key come from one PEM file. getContext looks at
+it again at most every interval seconds, and when it has changed builds a
+new context from it for the connections made from then on. Connections
+already made keep the context they started with, so none are dropped,
+but sessions from before a reload cannot be resumed after it. A file that
+will not load (one still being written, say) is logged and the old
+context kept until the file changes again."""
+
+import os, time
 from OpenSSL import SSL
+from haver.server import logger
+
+CIPHERS = 'ECDHE+AESGCM:ECDHE+CHACHA20:DHE+AESGCM:DHE+CHACHA20:!aNULL:!MD5:!DSS'
+
+log = logger.get('ssl')
 
 class SSLContextFactory:
+	def __init__(self, path = 'server.pem', interval = 5.0, timeout = 3600):
+		self.path     = path
+		self.interval = interval
+		# How long, in seconds, a session can be resumed for.
+		self.timeout  = timeout
+		self.context  = None
+		# What the file looked like when context was built from it.
+		self.stamp    = None
+		self.checked  = 0.0
+
 	def getContext(self):
-		"""Create an SSL context.
+		"""The context for a new connection."""
+		now = time.time()
+		if self.context is None or now - self.checked >= self.interval:
+			self.checked = now
+			self.reload()
+		return self.context
+
+	def reload(self):
+		"""Build a new context if the file has changed since the last one.
+		Only the first load raises if the file will not load."""
+		try:
+			info  = os.stat(self.path)
+			stamp = (info.st_mtime, info.st_size, info.st_ino)
+		except OSError:
+			stamp = 'gone'
+		if stamp == self.stamp:
+			return
+		# Remembered even if the file will not load, so it is not tried again
+		# until it changes.
+		self.stamp = stamp
+		try:
+			context = self.build()
+		except (OSError, IOError, SSL.Error), e:
+			if self.context is None:
+				self.stamp = None
+				raise
+			log.warn('Keeping the old certificate, as %s would not load: %s', self.path, e)
+			return
+		if self.context is not None:
+			log.info('Reloaded the certificate from %s', self.path)
+		self.context = context
 
-		This is a sample implementation that loads a certificate from a file
-		called 'server.pem'."""
-		ctx = SSL.Context(SSL.SSLv23_METHOD)
-		ctx.use_certificate_file('server.pem')
-		ctx.use_privatekey_file('server.pem')
+	def build(self):
+		ctx = SSL.Context(SSL.TLS_SERVER_METHOD)
+		ctx.set_min_proto_version(SSL.TLS1_2_VERSION)
+		ctx.set_options(SSL.OP_NO_COMPRESSION | SSL.OP_CIPHER_SERVER_PREFERENCE)
+		ctx.set_cipher_list(CIPHERS)
+		ctx.use_certificate_chain_file(self.path)
+		ctx.use_privatekey_file(self.path)
+		ctx.check_privatekey()
+		ctx.set_session_id('haver')
+		ctx.set_session_cache_mode(SSL.SESS_CACHE_SERVER)
+		ctx.set_timeout(self.timeout)
 		return ctx
@@ -0,0 +1,82 @@
+#!/usr/bin/python
+"""Benchmark for TLS handshakes over loopback: the Haver listener runs in a
+child process, and a blocking client makes count connections for each way
+of connecting, sending HAVER and reading the reply on each. A full
+handshake starts every connection from nothing; a resumed one offers the
+session of the connection before it. Both are tried with TLS 1.2 and 1.3,
+against SSLContextFactory and against a context built afresh for every
+connection, as getContext once did.
+
+	python sslBench.py [count] [server.pem]
+"""
+import sys, os, socket, time
+from OpenSSL import SSL
+from twisted.internet import reactor
+from twisted.protocols.tls import TLSMemoryBIOFactory
+from haver.server.house  import House
+from haver.server.talker import HaverFactory
+from haver.server.ssl    import SSLContextFactory
+
+class Fresh(SSLContextFactory):
+	def getContext(self):
+		return self.build()
+
+def serve(factory):
+	"""Listen in a child process; return its pid and port."""
+	read, write = os.pipe()
+	pid = os.fork()
+	if pid == 0:
+		os.close(read)
+		port = reactor.listenTCP(0, TLSMemoryBIOFactory(factory, False, HaverFactory(House('bench'), ssl = True)))
+		os.write(write, '%d\n' % port.getHost().port)
+		os.close(write)
+		reactor.run()
+		os._exit(0)
+	os.close(write)
+	port = int(os.fdopen(read).readline())
+	return pid, port
+
+def connect(port, context, session):
+	sock = socket.create_connection(('127.0.0.1', port))
+	# Or a resumed TLS 1.2 handshake waits on a delayed ack before HAVER goes.
+	sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+	conn = SSL.Connection(context, sock)
+	if session is not None:
+		conn.set_session(session)
+	conn.set_connect_state()
+	conn.do_handshake()
+	conn.sendall("HAVER\tbench/1\n")
+	data = ''
+	while "\n" not in data:
+		data = data + conn.recv(4096)
+	# TLS 1.3 tickets come after the handshake, so ask once the reply is in.
+	session = conn.get_session()
+	# OpenSSL will not resume the session of a connection closed uncleanly.
+	conn.shutdown()
+	sock.close()
+	return session
+
+def run(port, version, resume, count):
+	context = SSL.Context(SSL.TLS_CLIENT_METHOD)
+	context.set_max_proto_version(version)
+	session = None
+	start = time.time()
+	for i in xrange(count):
+		last = connect(port, context, session)
+		if resume:
+			session = last
+	return count / (time.time() - start)
+
+if __name__ == '__main__':
+	count = len(sys.argv) > 1 and int(sys.argv[1]) or 500
+	path  = len(sys.argv) > 2 and sys.argv[2] or 'server.pem'
+	for name, factory in (('fresh', Fresh(path)), ('cached', SSLContextFactory(path))):
+		pid, port = serve(factory)
+		try:
+			for label, version in (('TLS 1.2', SSL.TLS1_2_VERSION), ('TLS 1.3', SSL.TLS1_3_VERSION)):
+				full    = run(port, version, False, count)
+				resumed = run(port, version, True, count)
+				print '%-6s %s: full %6.0f handshakes/s, resumed %6.0f handshakes/s' % (name, label, full, resumed)
+		finally:
+			os.kill(pid, 15)
+			os.waitpid(pid, 0)
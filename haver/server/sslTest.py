@@ -0,0 +1,75 @@
+#!/usr/bin/python
+import unittest, os, tempfile, shutil
+from OpenSSL import crypto
+from haver.server.ssl import SSLContextFactory
+
+def pem(name):
+	"""A self-signed certificate and its key, as one PEM file's contents."""
+	key = crypto.PKey()
+	key.generate_key(crypto.TYPE_RSA, 2048)
+	cert = crypto.X509()
+	cert.get_subject().CN = name
+	cert.set_serial_number(1)
+	cert.gmtime_adj_notBefore(0)
+	cert.gmtime_adj_notAfter(3600)
+	cert.set_issuer(cert.get_subject())
+	cert.set_pubkey(key)
+	cert.sign(key, 'sha256')
+	return crypto.dump_certificate(crypto.FILETYPE_PEM, cert) + crypto.dump_privatekey(crypto.FILETYPE_PEM, key)
+
+class TestContext(unittest.TestCase):
+	def setUp(self):
+		self.dir  = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, 'server.pem')
+		self.write(pem('one'), 1000)
+		self.factory = SSLContextFactory(self.path, interval = 0)
+
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+
+	def write(self, data, mtime):
+		new = self.path + '.new'
+		f = open(new, 'wb')
+		f.write(data)
+		f.close()
+		os.utime(new, (mtime, mtime))
+		os.rename(new, self.path)
+
+	def testReused(self):
+		self.assertTrue(self.factory.getContext() is self.factory.getContext())
+
+	def testReloadedWhenChanged(self):
+		old = self.factory.getContext()
+		self.write(pem('two'), 2000)
+		self.assertFalse(self.factory.getContext() is old)
+
+	def testBadFileKeepsOld(self):
+		old  = self.factory.getContext()
+		data = pem('two')
+		self.write(data[:len(data) // 2], 2000)
+		self.assertTrue(self.factory.getContext() is old)
+		self.write(data, 3000)
+		self.assertFalse(self.factory.getContext() is old)
+
+	def testBadFileTriedOnce(self):
+		old  = self.factory.getContext()
+		data = pem('two')
+		self.write(data[:len(data) // 2], 2000)
+		builds = []
+		build  = self.factory.build
+		def counted():
+			builds.append(1)
+			return build()
+		self.factory.build = counted
+		for i in range(3):
+			self.assertTrue(self.factory.getContext() is old)
+		self.assertEqual(len(builds), 1)
+
+	def testNotLookedAtWithinInterval(self):
+		self.factory.interval = 3600
+		old = self.factory.getContext()
+		self.write(pem('two'), 2000)
+		self.assertTrue(self.factory.getContext() is old)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,14 +1,15 @@
 import time
-from twisted.python            import log
-from twisted.protocols.basic   import LineOnlyReceiver
 from twisted.internet.protocol import Factory
-from twisted.internet          import reactor
-from twisted.internet          import task
 
 from haver.server.errors  import Fail, Bork
 from haver.server.thing   import User, Room
 from haver.server.asserts import *
 from haver.server.help    import Help
+from haver.server.idle    import shared
+from haver.server.outbound import Outbound
+from haver.server.lines    import LineBatchReceiver
+from haver.server.flood    import Flood
+from haver.server         import history, metrics, logger, quits, core, deflate, watch
 import haver.server
 import haver.protocol
 
@@ -62,145 +63,265 @@ def reply(*reply):
 	return code
 
 help = None
+commands = metrics.Commands(metrics.shared(), 'haver')
+clients  = logger.get('haver')
+fails    = logger.get('haver.fail')
+
+# Lines that jump ahead of anything queued for a slow client, lines that may
+# be thrown away when its queue is full, and lines written without waiting
+# for the end of the reactor iteration.
+URGENT = set(['PING', 'BYE', 'FAIL', 'BORK'])
+CHAT   = set(['IN', 'FROM'])
+FLUSH  = set(['PING', 'BYE'])
+# Commands that cost no tokens: answers to the server, TAG, which charges
+# for the command it wraps, and leaving, which nobody should be kept from.
+FREE   = set(['PONG', 'TAG', 'BYE', 'PART'])
 
 class HaverFactory(Factory):
 
-	def __init__(self, house, ssl = False):
+	def __init__(self, house, ssl = False, idle = None, backlog = 1000, overflow = 'drop',
+			listener = None, admins = ('127.0.0.1',), flood = None, compression = 1):
 		global help
 		if help is None:
 			help = Help(HaverTalker)
+		if idle is None:
+			idle = shared()
+		if listener is None:
+			listener = ssl and 'haver+ssl' or 'haver'
+		if flood is None:
+			flood = Flood()
 		self.house    = house
 		self.protocol = HaverTalker
 		self.ssl = ssl
+		self.idle = idle
+		self.backlog  = backlog
+		self.overflow = overflow
+		self.history  = history.shared(house)
+		self.watches  = watch.shared(house)
+		# Addresses that may ask for STATS.
+		self.admins   = admins
+		self.flood    = flood
+		# The zlib level of connections that ask for compress, or None to refuse.
+		self.compression = compression
+		self.meter    = metrics.shared().meter(listener)
+		self.deflated = deflate.Stats(metrics.shared(), 'sent')
+		self.inflated = deflate.Stats(metrics.shared(), 'received')
+		metrics.watch(metrics.shared(), house, idle)
 
 	def buildProtocol(self, addr):
 		p = self.protocol(addr)
 		p.factory = self
-		p.house   = self.house
 		return p
 		
-class HaverTalker(LineOnlyReceiver):
+class HaverTalker(LineBatchReceiver):
+	# Defaults shared by every connection until one sets its own.
+	delimiter = "\n"
+	phase     = 'none'
+	tag       = None
+	tardy     = None
+	closing   = False
+	bucket    = None
+	strikes   = 0
+	# Whether the client takes one QUIT for a user leaving all rooms at once.
+	quits     = False
+	# What the client sends is inflated by this once it asks for compress.
+	inflater  = None
+
 	def __init__(self, addr):
-		self.addr      = addr
-		self.delimiter = "\n"
-		self.phase     = 'none'
+		self.addr    = addr
+		self.lastCmd = time.time()
 
-		self.lastCmd   = time.time()
-		self.tardy     = None
-		self.pingTime  = 60
-		self.pingLoop  = task.LoopingCall(self.checkPing)
-		self.pingLoop.start(self.pingTime)
+	def invoke(self, cmd, args, start = None):
+		"""Run a command, timing it from start, or from now. Returns when it
+		finished."""
+		return self.call(self.admit(cmd, len(args)), args, start)
 
-	def invoke(self, cmd, args):
+	def admit(self, cmd, arity):
+		"""Look up a command sent with arity arguments, and charge for it if
+		it may run now; raise Fail if not."""
 		self.cmd = cmd
-		self.lastCmd = time.time()
 		try:
-			method = cmd.replace(':', '_')
-			func  = getattr(self, method)
-			phase = func.phase
-		except AttributeError:
+			command = help.table[cmd]
+		except KeyError:
 			raise Fail('unknown.command')
-		
+
+		phase = command.phase
 		if phase != self.phase and phase != 'magical':
 			raise Fail('strange.command', self.phase, phase)
 
-		assert_cmd(cmd)
-		assert_arity(func, args)
+		if arity > command.arity_max or arity < command.arity_min:
+			raise Fail('arity', command.arity_text, str(arity))
 
-		newphase = func(*args)
+		if cmd not in FREE:
+			self.factory.flood.charge(self, 1.0, self.lastCmd)
+		return command
+
+	def call(self, command, args, start = None):
+		if start is None:
+			start = time.time()
+		try:
+			newphase = command.handler(self, *args)
+		finally:
+			end = time.time()
+			commands.timer(self.cmd).observe(end - start)
 		if newphase is not None:
 			self.phase = newphase
+		return end
+
+	def linesReceived(self, lines):
+		"""Run the commands of one read in turn. Each is timed from when the
+		one before it finished, so the clock is read once a command."""
+		now = self.lastCmd = time.time()
+		transport = self.transport
+		run = self.run
+		for line in lines:
+			if transport.disconnecting:
+				return
+			now = run(line, now)
 
 	def lineReceived(self, line):
+		self.linesReceived([line])
+
+	def run(self, line, start):
+		"""Run one line. Returns when it finished."""
 		try:
 			try:
-				cmd, args = haver.protocol.parse( line )
-				self.tag = None
-				self.invoke(cmd, args)
+				# The arguments are only decoded for a command let through.
+				cmd, rest = haver.protocol.split(line)
+				command   = self.admit(cmd, haver.protocol.arity(rest))
+				return self.call(command, haver.protocol.fields(rest), start)
 			except Fail, failure:
-				log.msg('Command %s failed with failure %s (%s)' % (self.cmd, failure.name, str(failure.args)))
+				fails.limited(logger.INFO, failure.name, 'Command %s failed with failure %s %r',
+					self.cmd, failure.name, failure.args)
+				commands.failed(failure.name)
 				if self.phase != 'connect':
 					self.sendMsg('FAIL', self.cmd, failure.name, *failure.args)
 				else:
 					self.transport.loseConnection()
 
 			except Bork, bork:
-				log.msg('Borking client: %s' % bork.msg)
-				if self.phase != 'connect':
-					self.phase = 'bork'
-					self.sendMsg('BORK', bork.msg)
-				self.disconnect('bork')
+				self.bork(bork)
 		finally:
-			self.tag = None
+			if self.tag is not None:
+				del self.tag
+		return time.time()
+
+	def bork(self, bork):
+		clients.warn('Borking client %s: %s', self.addr.host, bork.msg)
+		if self.phase != 'connect':
+			self.phase = 'bork'
+			self.sendMsg('BORK', bork.msg)
+		self.disconnect('bork')
 
 	def sendMsg(self, cmd, *args):
+		chat   = cmd in CHAT
+		urgent = cmd in URGENT
+		flush  = cmd in FLUSH
 		if self.tag is not None:
 			args = (self.tag, cmd) + args
 			cmd = 'TAG'
-		self.sendLine(haver.protocol.deparse(cmd, args))
+			urgent = True
+		self.outbound.write(haver.protocol.deparse(cmd, args) + self.delimiter, urgent, chat, flush)
+
+	def sendFrame(self, frame):
+		"""Write a frame shared with other talkers. Only the talker whose
+		command caused the broadcast wraps it in TAG."""
+		self.sendData(frame.data, frame.cmd in CHAT)
+
+	def sendBatch(self, batch):
+		"""Write a batch shared with other talkers, in one write unless
+		each frame must be wrapped in TAG."""
+		if self.tag is not None:
+			for frame in batch.frames:
+				self.sendFrame(frame)
+		else:
+			self.outbound.write(batch.data, False, batch.cmd in CHAT)
+
+	def sendData(self, data, chat = False):
+		"""Write an already encoded line, wrapped in TAG if it answers a
+		tagged command."""
+		if self.tag is not None:
+			self.outbound.write(haver.protocol.deparse('TAG', (self.tag,)) + "\t" + data, True)
+		else:
+			self.outbound.write(data, False, chat)
 	
 	def connectionMade(self):
 		self.phase = 'connect'
-		log.msg('New client from ' + str(self.addr))
+		self.outbound = Outbound(self.transport, self.slow, self.factory.backlog, self.factory.overflow,
+			meter = self.factory.meter)
+		self.factory.idle.add(self)
+		self.factory.meter.connected.inc()
+		clients.info('New client from %s', self.addr.host)
 
 	def connectionLost(self, reason):
-		log.msg('Lost client from ' + str(self.addr))
+		clients.info('Lost client from %s', self.addr.host)
+		self.factory.idle.cancel(self)
+		self.factory.meter.connected.dec()
 		self.quit('closed')
 
+	def dataReceived(self, data):
+		self.factory.meter.received.inc(len(data))
+		if self.inflater is not None:
+			try:
+				data = self.inflater.unpack(data)
+			except Bork, bork:
+				self.inflater = None
+				return self.bork(bork)
+		LineBatchReceiver.dataReceived(self, data)
+
 	def init(self, user):
-		self.user = user
-		user['address'] = self.addr.host
-		user['version'] = self.version
+		user.address = self.addr.host
+		user.version = self.version
 		if self.factory.ssl:
-			user['secure'] = 'yes'
+			user.secure = 'yes'
 		else:
-			user['secure'] = 'no'
-		del self.version
+			user.secure = 'no'
 
+	@ext('quit')
 	def quit(self, why, reason = None):
 		house = self.factory.house
 		
 		if self.phase == 'normal':
-			for room in list(self.user.rooms):
-				if reason is not None:
-					why = "%s: %s" % (why, reason)
-				room.part(self.user, 'quit', why)
-
+			if reason is not None:
+				why = "%s: %s" % (why, reason)
+			quits.shared().quit(self.user, why)
 			house.remove(self.user)
 			self.phase = 'quit'
 
+	@ext('compress')
+	def compress(self):
+		"""Deflate what we send after the last line written, and inflate
+		what the client sends from its next read on."""
+		factory = self.factory
+		self.outbound.compress(deflate.Deflater(factory.compression, factory.deflated))
+		self.inflater = deflate.Inflater(factory.inflated)
+
 	def disconnect(self, *args):
 		self.sendMsg('BYE', *args)
 		self.transport.loseConnection()
 		self.quit(*args)
 
-	def checkPing(self):
-		"""Called every once and a while. Issues a ping if this client hasn't sent a command recently"""
-		now      = time.time()
-		duration = int (now - self.lastCmd)
-
-		if self.phase != 'normal':
-			self.tardy = None
-			return
-
-		if self.tardy is not None:
-			self.sendMsg('BYE', 'ping')
-			self.disconnect('ping')
-			return
+	def slow(self):
+		"""Called when this client's outbound queue overflows. We may be in the
+		middle of a broadcast to one of its rooms, so it is dropped afterwards."""
+		if not self.closing:
+			self.closing = True
+			core.clock().callLater(0, self.disconnect, 'slow')
 
-		if duration > self.pingTime:
-			self.sendMsg('PING', 'foo')
-			self.tardy = 'foo'
-	
 	@connect
 	@reply('HAVER', 'host', 'server_version', 'server_extensions')
 	def HAVER(self, version, extensions = '', *rest):
-		"""Clients must issue this message before any others."""
+		"""Clients must issue this message before any others. A client that asks for compress must wait for the reply before sending anything else; if the server lists compress too, both sides deflate everything after it."""
 		self.version = version
 		self.extensions = set(extensions.split(','))
+		self.quits = 'quit' in self.extensions
 		ver = "%s/%s" % (haver.server.name, haver.server.version)
-		print(type(help.extensions))
-		self.sendMsg('HAVER', self.factory.house.host, ver, ",".join(help.extensions))
+		offered = help.extensions
+		if self.factory.compression is None:
+			offered = offered - set(['compress'])
+		self.sendMsg('HAVER', self.factory.house.host, ver, ",".join(offered))
+		if 'compress' in self.extensions and 'compress' in offered:
+			self.compress()
 		return 'login'
 
 	@login
@@ -212,10 +333,11 @@ class HaverTalker(LineOnlyReceiver):
 		assert_name(name)
 		assert_name_unreserved(name)
 		user = User(name, self)
+		self.init(user)
 		house.add(user)
+		self.user = user
+		del self.version
 		self.sendMsg('HELLO', name, str(self.addr.host))
-
-		self.init(user)
 		return 'normal'
 
 	@login
@@ -230,7 +352,10 @@ class HaverTalker(LineOnlyReceiver):
 			if f.name == 'existing.thing':
 				house = self.factory.house
 				user  = house.lookup('user', name)
-				if user['address'] != self.addr.host:
+				if user.talker is None:
+					# Logged in on another server process.
+					raise f
+				if user.address != self.addr.host:
 					# TODO: I don't think failure name.
 					raise Fail('mismatch.ip')
 				user.talker.disconnect('ghost')
@@ -243,33 +368,39 @@ class HaverTalker(LineOnlyReceiver):
 	@reply('FROM', 'yourname', 'kind', 'msg', '[rest...]')
 	def TO(self, name, kind, msg, *rest):
 		"""Send a private message"""
-		assert_name(name)
 		house = self.factory.house
 		user  = house.lookup('user', name)
 		user.sendMsg('FROM', self.user.name, kind, msg, *rest)
 		self.user.updateIdle()
 
+	def spend(self, room):
+		"""Charge for writing to every member of room."""
+		flood = self.factory.flood
+		flood.charge(self, flood.fanout(room), self.lastCmd, room)
+
 	@normal
-	@failures('invalid.name', 'unknown.thing')
+	@failures('invalid.name', 'unknown.thing', 'rate.limited')
 	@reply('IN', 'name', 'yourname', 'kind', 'msg', '[rest...]')
 	def IN(self, name, kind, msg, *rest):
 		"""Send a public message"""
-		assert_name(name)
 		house = self.factory.house
 		room  = house.lookup('room', name)
+		self.spend(room)
 		room.sendMsg('IN', room.name, self.user.name, kind, msg, *rest)
 		self.user.updateIdle()
 
 	@normal
-	@failures('invalid.name', 'unknown.thing', 'strange.join', 'insecure')
+	@failures('invalid.name', 'unknown.thing', 'strange.join', 'insecure', 'rate.limited')
 	@reply('JOIN', 'room', 'yourname')
 	def JOIN(self, name):
 		"""Join room {name}"""
-		assert_name(name)
 		house = self.factory.house
 		room  = house.lookup('room', name)
-		if room['secure'] == 'yes' and self.user['secure'] != 'yes':
+		if room.secure == 'yes' and self.user.secure != 'yes':
 			raise Fail('insecure')
+		if self.user in room.users:
+			raise Fail('strange.join')
+		self.spend(room)
 		room.join(self.user)
 
 	@normal
@@ -277,7 +408,6 @@ class HaverTalker(LineOnlyReceiver):
 	@reply('PART', 'room', 'yourname')
 	def PART(self, name):
 		"""Part room {name}"""
-		assert_name(name)
 		house = self.factory.house
 		room  = house.lookup('room', name)
 		room.part(self.user, 'normal')
@@ -323,16 +453,13 @@ class HaverTalker(LineOnlyReceiver):
 	@reply('CLOSE', 'name')
 	def CLOSE(self, name):
 		"""Destroy a room. Only the owner can do this."""
-		assert_name(name)
-		assert_name_unreserved(name)
-
 		house = self.factory.house
 		room = house.lookup('room', name)
-		if room['owner'] != self.user.name:
-			raise Fail('access.owner', room.name, room['owner'], self.user.name)
+		assert_name_unreserved(name)
+		if room.owner != self.user.name:
+			raise Fail('access.owner', room.name, room.owner, self.user.name)
 
-		for user in room:
-			user.part(room.name, 'close', self.user.name)
+		room.partAll(list(room.users), 'close', self.user.name)
 		house.remove(room)
 		self.sendMsg('CLOSE', name)
 
@@ -365,18 +492,52 @@ class HaverTalker(LineOnlyReceiver):
 
 	@normal
 	@reply('USERS', 'names...')
-	def USERS(self):
-		"""Return a list of users on the server."""
+	def USERS(self, pattern = None):
+		"""Return a list of users on the server, optionally only those matching the glob {pattern}."""
 		house = self.factory.house
-		names = [ x for x in house.lookup_namespace('user') ]
+		if pattern is None:
+			names = [ x for x in house.lookup_namespace('user') ]
+		else:
+			names = [ x.key for x in house.glob('user', pattern) ]
 		self.sendMsg('USERS', *names)
+
+	@normal
+	@ext('watch')
+	@failures('invalid.name', 'watch.limit')
+	@reply('WATCH', 'online...')
+	@reply('ONLINE', 'name')
+	@reply('OFFLINE', 'name')
+	def WATCH(self, name, *more):
+		"""Be sent ONLINE when a user called {name} (or any of the other names given) logs in, and OFFLINE when they leave. The reply lists those of the names that are online now."""
+		house = self.factory.house
+		names = (name,) + more
+		for x in names:
+			assert_name(x)
+		self.factory.watches.watch(self.user, [ x.lower() for x in names ])
+		users = house.lookup_namespace('user')
+		self.sendMsg('WATCH', *[ users[x.lower()].name for x in names if x.lower() in users ])
+
+	@normal
+	@ext('watch')
+	@failures('invalid.name')
+	@reply('UNWATCH', 'names...')
+	def UNWATCH(self, name, *more):
+		"""Stop watching {name}, and any of the other names given."""
+		names = (name,) + more
+		for x in names:
+			assert_name(x)
+		self.factory.watches.unwatch(self.user, [ x.lower() for x in names ])
+		self.sendMsg('UNWATCH', *names)
 	
 	@normal
 	@reply('ROOMS', 'names...')
-	def ROOMS(self):
-		"""Return a list of rooms on the server"""
+	def ROOMS(self, pattern = None):
+		"""Return a list of rooms on the server, optionally only those matching the glob {pattern}."""
 		house = self.factory.house
-		names = [ x for x in house.lookup_namespace('room') ]
+		if pattern is None:
+			names = [ x for x in house.lookup_namespace('room') ]
+		else:
+			names = [ x.key for x in house.glob('room', pattern) ]
 		self.sendMsg('ROOMS', *names)
 	
 	@normal
@@ -390,36 +551,35 @@ class HaverTalker(LineOnlyReceiver):
 		self.sendMsg('USERSOF', room.name,  *names)
 
 	@normal
-	@failures('invalid.name', 'unknown.thing')
-	def KICK(self, rname, uname):
+	@failures('invalid.name', 'unknown.thing', 'access.owner', 'strange.part')
+	def KICK(self, rname, uname, *more):
+		"""Part one or more users from a room. Only the owner can do this."""
 		house = self.factory.house
 		room = house.lookup('room', rname)
-		user = house.lookup('user', uname)
-		if room['owner'] != self.user.name:
-			raise Fail('access.owner', room['owner'], self.user.name)
+		users = [ house.lookup('user', x) for x in (uname,) + more ]
+		if room.owner != self.user.name:
+			raise Fail('access.owner', room.owner, self.user.name)
 
-		room.part(user, 'kick', self.user.name)
+		if not room.partAll(users, 'kick', self.user.name):
+			raise Fail('strange.part')
 
 	@normal
 	@failures('unknown.thing', 'invalid.name')
 	def SECURE(self, name):
 		house = self.factory.house
 		room = house.lookup('room', name)
-		names = []
-		for user in room.users:
-			if user['secure'] == 'no':
-				room.part(user, 'secure', self.user.name)
-				names.append(user.name)
+		insecure = [ x for x in room.users if x.secure == 'no' ]
+		names = [ x.name for x in room.partAll(insecure, 'secure', self.user.name) ]
 
-		room['secure'] = 'yes'
+		room.secure = 'yes'
+		house.changed(room, 'secure')
 		self.sendMsg('SECURE', name, *names)
 
 	@normal
 	@ext('help')
 	@reply('HELP:COMMANDS', 'commands...')
 	def HELP_COMMANDS(self):
-		commands = [ x.replace('_', ':') for x in help.commands ]
-		self.sendMsg('HELP:COMMANDS', *commands)
+		self.sendFrame(help.commands_frame)
 
 	@magical
 	@ext('tag')
@@ -440,15 +600,14 @@ class HaverTalker(LineOnlyReceiver):
 	def HELP_COMMAND(self, cmd):
 		"""Get usage information on a particular command"""
 		try:
-			info = help.command(cmd.replace(':', '_'))
-			args = []
-			for k in info:
-				args.append(k)
-				args.append(info[k])
-			self.sendMsg('HELP:COMMAND', cmd, *args)
-		except AttributeError, a:
-			print a
+			info = help.command(cmd)
+		except KeyError:
 			raise Fail('unknown.command', cmd)
+		args = []
+		for k in info:
+			args.append(k)
+			args.append(info[k])
+		self.sendMsg('HELP:COMMAND', cmd, *args)
 
 	HELP = HELP_COMMAND
 
@@ -460,8 +619,91 @@ class HaverTalker(LineOnlyReceiver):
 		$0 should be replaced by the command that triggered the failure, and $1..$n should be replaced by the arguments of it."""
 		self.sendMsg('HELP:FAILURE', name, help.fail(name))
 
+	@normal
+	@ext('help')
+	@reply('HELP:LIMITS', 'name', 'value', '[name value...]')
+	def HELP_LIMITS(self):
+		"""The flood limits of this server: tokens a second and the most that can be saved up, for each connection and room. Every command costs a token, and writing to a room costs another for every FANOUT_UNIT members; failing with rate.limited too often in a row gets a client borked."""
+		self.sendMsg('HELP:LIMITS', *self.factory.flood.describe())
+
 	@normal
 	@ext('help')
 	def HELP_REPLIES(self, command):
 		"""Displays the reply for a command."""
-		self.sendMsg('HELP:REPLIES', command, *help.reply(command))
+		self.sendFrame(help.replies_frame(command))
+
+	def kept(self, name):
+		"""The room called name, if it keeps its history and we may see it."""
+		house = self.factory.house
+		room  = house.lookup('room', name)
+		if room.secure == 'yes' and self.user.secure != 'yes':
+			raise Fail('insecure')
+		if room.backlog is None:
+			raise Fail('history.off', room.name)
+		return room
+
+	def sendHistory(self, room, entries):
+		head = haver.protocol.deparse('HISTORY', (room.name,))
+		for stamp, data in entries:
+			self.sendData("%s\t%.6f\t%s" % (head, stamp, data))
+		self.sendMsg('HISTORY:END', room.name, str(len(entries)))
+
+	@normal
+	@ext('history')
+	@failures('invalid.name', 'unknown.thing', 'insecure', 'history.off', 'invalid.number')
+	@reply('HISTORY', 'room', 'stamp', 'IN', 'room', 'user', 'kind', 'msg', '[rest...]')
+	@reply('HISTORY:END', 'room', 'count')
+	def HISTORY(self, name, count = '50'):
+		"""Replay the last {count} messages said in room {name}, oldest first, each with the time it was said."""
+		room = self.kept(name)
+		try:
+			count = int(count)
+		except ValueError:
+			raise Fail('invalid.number', count)
+		self.sendHistory(room, room.backlog.last(min(count, self.factory.history.limit)))
+
+	@normal
+	@ext('history')
+	@failures('invalid.name', 'unknown.thing', 'insecure', 'history.off', 'invalid.number')
+	@reply('HISTORY', 'room', 'stamp', 'IN', 'room', 'user', 'kind', 'msg', '[rest...]')
+	@reply('HISTORY:END', 'room', 'count')
+	def HISTORY_SINCE(self, name, stamp):
+		"""Replay the messages said in room {name} after time {stamp} (seconds since the epoch), oldest first."""
+		room = self.kept(name)
+		try:
+			stamp = float(stamp)
+		except ValueError:
+			raise Fail('invalid.number', stamp)
+		self.sendHistory(room, room.backlog.since(stamp))
+
+	@normal
+	@ext('history')
+	@failures('invalid.name', 'unknown.thing', 'access.owner')
+	@reply('HISTORY:KEEP', 'room', 'yes|no')
+	def HISTORY_KEEP(self, name, keep = 'yes'):
+		"""Start or stop keeping the recent messages of room {name}. Only the owner can do this."""
+		house = self.factory.house
+		room  = house.lookup('room', name)
+		if room.owner != self.user.name:
+			raise Fail('access.owner', room.name, room.owner, self.user.name)
+		if keep != 'no':
+			keep = 'yes'
+		room.history = keep
+		house.changed(room, 'history')
+		self.sendMsg('HISTORY:KEEP', room.name, keep)
+
+	@normal
+	@ext('stats')
+	@failures('access.admin')
+	@reply('STATS', 'metric', 'value')
+	@reply('STATS:END', 'count')
+	def STATS(self, prefix = ''):
+		"""List the server's metrics, or those whose names start with {prefix}. Only connections from an admin address can do this."""
+		if self.addr.host not in self.factory.admins:
+			raise Fail('access.admin', self.addr.host)
+		count = 0
+		for name, labels, value in metrics.shared().samples():
+			if name.startswith(prefix):
+				self.sendMsg('STATS', metrics.key(name, labels), metrics.number(value))
+				count = count + 1
+		self.sendMsg('STATS:END', str(count))
@@ -1,78 +1,184 @@
 from haver.server.errors import Fail, Bork
+from haver.protocol import Frame, Batch
+from haver.server   import metrics, quits
 import time, re
 
-def val(x):
-	try:
-		return str(x())
-	except TypeError:
-		return str(x)
-
 class Thing(object):
+	"""Something with a name in the house.
+
+	Info keys listed in fields are kept in slots of the same name; any other
+	key goes in a dict that is only made when one is first set."""
+	__slots__ = ('house', '__name', '__key', '__info')
+	fields    = ()
+
 	name = property(lambda self: self.__name)
+	key  = property(lambda self: self.__key, doc = "The interned, case-folded name the house knows this thing by")
 	
 	def __init__(self, name):
+		self.house  = None
 		self.__name = name
-		self.__info = dict()
+		self.__key  = intern(name.lower())
+		self.__info = None
 
 	def __getitem__(self, key):
-		try:
-			return val(self.__info[key])
-		except KeyError:
-			raise Fail('unknown.infokey', self.namespace, self.name, key)
+		if key in self.fields:
+			try:
+				return getattr(self, key)
+			except AttributeError:
+				pass
+		elif self.__info is not None and key in self.__info:
+			return self.__info[key]
+		raise Fail('unknown.infokey', self.namespace, self.name, key)
 
 	def __setitem__(self, key, val):
-		self.__info[key] = val
-		return self.__info[key]
+		if key in self.fields:
+			setattr(self, key, val)
+		else:
+			if self.__info is None:
+				self.__info = dict()
+			self.__info[key] = val
+		return val
 
 	def __str__(self):
 		return "%s:%s" % (self.namespace, self.name)
 
 	def info(self):
-		for (x, y) in self.__info.iteritems():
+		for x in self.fields:
+			try:
+				y = getattr(self, x)
+			except AttributeError:
+				continue
 			yield x
-			yield val(y)
+			yield y
+		if self.__info is not None:
+			for (x, y) in self.__info.iteritems():
+				yield x
+				yield str(y)
+
+fanout = metrics.shared().histogram('haver_broadcast_recipients',
+	'Members a room message was written to', metrics.FANOUT)
+
+# Shared by every user that is in no rooms.
+NOROOMS = frozenset()
 
 class User(Thing):
+	__slots__ = ('rooms', 'talker', 'idleTime', 'stamp', 'address', 'version', 'secure')
 	namespace = 'user'
+	fields    = ('address', 'version', 'secure', 'idle')
+	node      = None
+
+	idle = property(lambda self: str(int(time.time() - self.idleTime)))
 
 	def __init__(self, name, talker):
 		Thing.__init__(self, name)
-		self.rooms     = set()
+		self.rooms     = NOROOMS
 		self.talker    = talker
 		self.idleTime  = time.time()
-		self['idle']   = lambda: int (time.time() - self.idleTime)
+		# When the user logged in, as sent between linked servers.
+		self.stamp     = round(self.idleTime, 6)
 
 	def updateIdle(self):
 		self.idleTime = time.time()
 
+	def enter(self, room):
+		if not self.rooms:
+			self.rooms = set()
+		self.rooms.add(room)
+
+	def leave(self, room):
+		self.rooms.discard(room)
+
 	def sendMsg(self, *msg):
 		if self.talker is not None:
 			self.talker.sendMsg(*msg)
 
+	def sendFrame(self, frame):
+		if self.talker is not None:
+			self.talker.sendFrame(frame)
+
+	def sendBatch(self, batch):
+		if self.talker is not None:
+			self.talker.sendBatch(batch)
+
 class Room(Thing):
+	__slots__ = ('users', 'owner', 'secure', 'history', 'backlog', 'names', 'bucket')
 	namespace = 'room'
+	fields    = ('owner', 'secure', 'history')
 
-	def __init__(self, name, owner = '&root'):
+	def __init__(self, name, owner = '&root', secure = 'no'):
 		Thing.__init__(self, name)
 		self.users   = set()
-		self['owner']  = owner
-		self['secure'] = 'no'
-
-	def sendMsg(self, *msg):
+		self.owner   = owner
+		self.secure  = secure
+		self.history = 'no'
+		self.backlog = None
+		# A names.Names of the members, once the IRC gateway wants one.
+		self.names   = None
+		# A flood.Bucket, once someone talks here.
+		self.bucket  = None
+
+	def sendMsg(self, cmd, *args):
+		"""Encode a message once and write it to every member."""
+		quits.settle()
+		frame = Frame(cmd, args)
 		for user in self.users:
-			user.sendMsg(*msg)
+			user.sendFrame(frame)
+		fanout.observe(len(self.users))
+		if self.backlog is not None and cmd == 'IN':
+			self.backlog.append(frame.data)
+		if self.house is not None:
+			self.house.broadcast(self, frame)
+		return frame
+
+	def admit(self, user):
+		"""Make user a member without telling anyone."""
+		quits.settle()
+		self.users.add(user)
+		user.enter(self)
+		if self.names is not None:
+			self.names.add(user.name)
+
+	def evict(self, user):
+		"""Stop user being a member without telling anyone."""
+		self.users.discard(user)
+		user.leave(self)
+		if self.names is not None:
+			self.names.discard(user.name)
 
 	def join(self, user, *args):
 		if user in self.users:
 			raise Fail('strange.join')
-		self.users.add(user)
-		user.rooms.add(self)
+		self.admit(user)
 		self.sendMsg('JOIN', self.name, user.name, *args)
 
 	def part(self, user, *args):
 		if user not in self.users:
 			raise Fail('strange.part')
 		self.sendMsg('PART', self.name, user.name, *args)
-		self.users.remove(user)
-		user.rooms.remove(self)
+		self.evict(user)
+
+	def partAll(self, users, *args):
+		"""Part every member among users in one pass, for CLOSE, SECURE and
+		KICK. Each of them is sent its own PART; everyone left gets all of
+		them in a single write. Returns the users parted."""
+		quits.settle()
+		gone   = []
+		frames = []
+		for user in users:
+			if user in self.users:
+				self.evict(user)
+				frame = Frame('PART', (self.name, user.name) + args)
+				user.sendFrame(frame)
+				gone.append(user)
+				frames.append(frame)
+		if not frames:
+			return gone
+		batch = Batch(frames)
+		for user in self.users:
+			user.sendBatch(batch)
+		fanout.observe(len(self.users) + len(gone))
+		if self.house is not None:
+			for frame in frames:
+				self.house.broadcast(self, frame)
+		return gone
 
@@ -0,0 +1,123 @@
+#!/usr/bin/python
+"""Memory benchmark: bytes of resident memory per idle user, for bare User
+objects in a house and for users logged in over a connection (talker,
+outbound queue and a do-nothing transport).
+
+	python thingBench.py [users]
+
+With part, times securing a room of connected members, half of them on
+insecure connections, with Room.partAll and with a Room.part per user, and
+counts the bytes and writes that reach the transports.
+
+	python thingBench.py part [members]
+"""
+import sys, os, gc, time
+from twisted.internet import address
+from haver.server.house  import House
+from haver.server.thing  import User, Room
+from haver.server.talker import HaverFactory
+from haver.server        import outbound
+
+class Transport(object):
+	"""Just enough of a transport for a talker that never writes."""
+	disconnecting = False
+
+	def __init__(self, port):
+		self.peer = address.IPv4Address('TCP', '10.0.0.1', port)
+
+	def registerProducer(self, producer, streaming):
+		self.producer = producer
+
+	def getPeer(self):
+		return self.peer
+
+	def getHost(self):
+		return self.peer
+
+	def write(self, data):
+		pass
+
+	def writeSequence(self, data):
+		counts['writes'] = counts['writes'] + len(data)
+		counts['bytes']  = counts['bytes'] + sum(map(len, data))
+
+counts = dict(writes = 0, bytes = 0)
+
+def resident():
+	gc.collect()
+	f = open('/proc/self/statm')
+	try:
+		return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+	finally:
+		f.close()
+
+def users(count):
+	house = House('bench')
+	before = resident()
+	for i in xrange(count):
+		user = User('user%d' % i, None)
+		user.address = '10.0.0.1'
+		user.version = 'bench/1'
+		user.secure  = 'no'
+		house.add(user)
+	return house, resident() - before
+
+def connected(count):
+	house   = House('bench')
+	house.add(Room('main'))
+	factory = HaverFactory(house)
+	before  = resident()
+	talkers = []
+	for i in xrange(count):
+		transport = Transport(i)
+		talker    = factory.buildProtocol(transport.peer)
+		talker.makeConnection(transport)
+		talker.lineReceived("HAVER\tbench/1")
+		talker.lineReceived("IDENT\tuser%d" % i)
+		talkers.append(talker)
+	return talkers, resident() - before
+
+def secure(count, bulk):
+	house   = House('bench')
+	room    = Room('main')
+	house.add(room)
+	factory = HaverFactory(house, backlog = count * 2)
+	for i in xrange(count):
+		transport = Transport(i)
+		talker    = factory.buildProtocol(transport.peer)
+		talker.makeConnection(transport)
+		talker.lineReceived("HAVER\tbench/1")
+		talker.lineReceived("IDENT\tuser%d" % i)
+		talker.user.secure = ('yes', 'no')[i % 2]
+		room.admit(talker.user)
+	counts.update(writes = 0, bytes = 0)
+	start    = time.time()
+	insecure = [ x for x in room.users if x.secure == 'no' ]
+	if bulk:
+		room.partAll(insecure, 'secure', 'bench')
+	else:
+		for user in insecure:
+			room.part(user, 'secure', 'bench')
+	outbound.shared().flush()
+	return time.time() - start
+
+def part(count):
+	for name, bulk in (('per-user', False), ('partAll', True)):
+		took = secure(count, bulk)
+		print "%-9s %6d members %8.1f ms %10d bytes %8d writes" % (
+			name, count, took * 1000, counts['bytes'], counts['writes'])
+
+def main(count):
+	keep, size = users(count)
+	print "user       %7d users %8.0f bytes/user" % (count, float(size) / count)
+	del keep
+	keep, size = connected(count)
+	print "connected  %7d users %8.0f bytes/user" % (count, float(size) / count)
+
+if __name__ == '__main__':
+	if sys.argv[1:2] == ['part']:
+		part(int((sys.argv[2:] or ['10000'])[0]))
+	elif len(sys.argv) > 1:
+		main(int(sys.argv[1]))
+	else:
+		main(100000)
@@ -0,0 +1,92 @@
+"""Presence subscriptions: the watch extension.
+
+A client WATCHes the names it cares about and is sent ONLINE when a user
+by one of them logs in and OFFLINE when they leave, here or on a linked
+server, instead of polling USERS for the whole house. Watches keeps an
+index from each watched name to its watchers, so a login or logout costs
+as much as the users watching that name, and one from each watcher to its
+names, so that its watches go when it does."""
+
+from haver.protocol      import Frame
+from haver.server.errors import Fail
+from haver.server        import quits
+
+class Watches(object):
+	def __init__(self, house, limit = 1000):
+		self.house    = house
+		# How many names one user may watch.
+		self.limit    = limit
+		# name key -> set of users watching it
+		self.watchers = dict()
+		# user -> set of name keys it watches
+		self.watching = dict()
+		house.observers.append(self)
+
+	def watch(self, user, keys):
+		"""Have user watch the names keys, which are already folded."""
+		mine = self.watching.get(user)
+		if mine is None:
+			mine = set()
+		new = set(keys) - mine
+		if len(mine) + len(new) > self.limit:
+			raise Fail('watch.limit', str(self.limit))
+		if not mine and new:
+			self.watching[user] = mine
+		for key in new:
+			mine.add(key)
+			try:
+				self.watchers[key].add(user)
+			except KeyError:
+				self.watchers[key] = set([user])
+
+	def unwatch(self, user, keys):
+		mine = self.watching.get(user)
+		if mine is None:
+			return
+		for key in keys:
+			if key in mine:
+				mine.discard(key)
+				self.drop(key, user)
+		if not mine:
+			del self.watching[user]
+
+	def drop(self, key, user):
+		watchers = self.watchers[key]
+		watchers.discard(user)
+		if not watchers:
+			del self.watchers[key]
+
+	def tell(self, user, frame):
+		watchers = self.watchers.get(user.key)
+		if watchers:
+			for watcher in watchers:
+				watcher.sendFrame(frame)
+
+	def added(self, thing):
+		if thing.namespace == 'user':
+			self.tell(thing, Frame('ONLINE', (thing.name,)))
+
+	def removed(self, thing):
+		if thing.namespace != 'user':
+			return
+		mine = self.watching.pop(thing, None)
+		if mine:
+			for key in mine:
+				self.drop(key, thing)
+		if thing.key in self.watchers:
+			# Anyone sharing a room with the user hears it leave before OFFLINE.
+			quits.settle()
+			self.tell(thing, Frame('OFFLINE', (thing.name,)))
+
+	def changed(self, thing, key):
+		pass
+
+	def broadcast(self, room, frame):
+		pass
+
+def shared(house):
+	"""Return the Watches of house, creating it on first use."""
+	for observer in house.observers:
+		if isinstance(observer, Watches):
+			return observer
+	return Watches(house)
@@ -0,0 +1,63 @@
+#!/usr/bin/python
+import unittest
+from twisted.internet import address
+from twisted.test.proto_helpers import StringTransport
+from haver.server.house  import House
+from haver.server.talker import HaverFactory
+from haver.server        import outbound, quits
+
+class TestWatch(unittest.TestCase):
+	def setUp(self):
+		self.house   = House('test')
+		self.factory = HaverFactory(self.house)
+
+	def connect(self, name):
+		transport = StringTransport(peerAddress = address.IPv4Address('TCP', '10.0.0.1', 1))
+		talker    = self.factory.buildProtocol(transport.getPeer())
+		talker.makeConnection(transport)
+		talker.dataReceived("HAVER\ttest/1\nIDENT\t%s\n" % name)
+		self.read(talker)
+		return talker
+
+	def read(self, talker):
+		quits.shared().flush()
+		outbound.shared().flush()
+		data = talker.transport.value()
+		talker.transport.clear()
+		return data.split("\n")[:-1]
+
+	def testOnlineAndOffline(self):
+		al = self.connect('al')
+		bo = self.connect('Bo')
+		al.dataReceived("WATCH\tbo\tcy\n")
+		self.assertEqual(self.read(al), ["WATCH\tBo"])
+		cy = self.connect('Cy')
+		self.assertEqual(self.read(al), ["ONLINE\tCy"])
+		bo.connectionLost(None)
+		self.assertEqual(self.read(al), ["OFFLINE\tBo"])
+		self.connect('dee')
+		self.assertEqual(self.read(al), [])
+
+	def testUnwatch(self):
+		al = self.connect('al')
+		al.dataReceived("WATCH\tbo\nUNWATCH\tbo\n")
+		self.assertEqual(self.read(al), ["WATCH", "UNWATCH\tbo"])
+		self.connect('bo')
+		self.assertEqual(self.read(al), [])
+		self.assertEqual(self.factory.watches.watchers, {})
+
+	def testWatchesGoWithWatcher(self):
+		al = self.connect('al')
+		al.dataReceived("WATCH\tbo\tcy\n")
+		al.connectionLost(None)
+		self.assertEqual(self.factory.watches.watchers, {})
+		self.assertEqual(self.factory.watches.watching, {})
+
+	def testLimit(self):
+		self.factory.watches.limit = 2
+		al = self.connect('al')
+		al.dataReceived("WATCH\tbo\tcy\nWATCH\tbo\nWATCH\tdee\n")
+		self.assertEqual(self.read(al), ["WATCH", "WATCH", "FAIL\tWATCH\twatch.limit\t2"])
+
+if __name__ == '__main__':
+    unittest.main()